@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+TRACKED_IPS = 65536
+
+
+class ClientState():
+    """Token bucket and live session count for one source address."""
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.sessions = 0
+
+
+class Admission():
+    """Decides, before any SMTP is spoken, whether a new connection may have a session.
+
+    Each source IP gets a token bucket refilled at rate connections per second
+    up to burst, and at most max_sessions concurrent sessions. Only the most
+    recently seen tracked IPs are kept; an address that falls out of the LRU
+    simply starts again with a full bucket. Addresses with sessions open are
+    never dropped, or their session count would start again from 0.
+    """
+
+    def __init__(self, rate=None, burst=None, max_sessions=None, tracked=TRACKED_IPS):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 1.0)
+        self.max_sessions = max_sessions
+        self.tracked = tracked
+        self.clients = OrderedDict()
+
+    def admit(self, ip, now=None):
+        """Returns None and counts a session when ip is admitted, otherwise the reason it is not."""
+        now = time.monotonic() if now is None else now
+        state = self.clients.get(ip)
+        if state is None:
+            state = self.clients[ip] = ClientState(self.burst, now)
+            if len(self.clients) > self.tracked:
+                self.evict()
+        else:
+            self.clients.move_to_end(ip)
+
+        if self.max_sessions is not None and state.sessions >= self.max_sessions:
+            return "sessions"
+        if self.rate is not None:
+            state.tokens = min(self.burst, state.tokens + (now - state.stamp) * self.rate)
+            state.stamp = now
+            if state.tokens < 1:
+                return "rate"
+            state.tokens -= 1
+        state.sessions += 1
+        return None
+
+    def evict(self):
+        """Drops least recently seen addresses down to tracked, passing over (and moving to
+        the back) those with sessions open. If every address has one, none is dropped."""
+        clients = self.clients
+        excess = len(clients) - self.tracked
+        for _ in range(len(clients)):
+            if excess <= 0:
+                break
+            ip, state = clients.popitem(last=False)
+            if state.sessions:
+                clients[ip] = state
+            else:
+                excess -= 1
+
+    def release(self, ip):
+        state = self.clients.get(ip)
+        if state is not None and state.sessions > 0:
+            state.sessions -= 1
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+REF_PREFIX = "X-Body-Ref: sha256:"
+REFS_WIDTH = 20  # counts are written zero padded, so updates never need a truncate
+
+
+class BodyWriter():
+    """Hashes and spools a body to a temporary file as lines stream in."""
+
+    def __init__(self, store):
+        self.store = store
+        self.hash = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self.hash.update(data)
+        self.file.write(data)
+
+    def finish(self, references=1):
+        """Stores the body (unless an identical one exists) and adds references; returns its digest."""
+        self.file.close()
+        digest = self.hash.hexdigest()
+        self.store.commit(digest, self.tmp_path, references)
+        return digest
+
+
+class BodyStore():
+    """Content-addressed message bodies with reference counts.
+
+    Bodies live in <root>/<2 hex>/<sha256>, with the reference count in
+    <sha256>.refs. Every count update, and garbage collection, happens under
+    an flock on the .refs file, so a body is never removed while another
+    delivery is adding a reference to it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def writer(self):
+        return BodyWriter(self)
+
+    def put(self, lines, references=1):
+        """Stores a body already held in memory; a known body only gets its count raised."""
+        data = "".join(lines).encode("utf-8", "surrogateescape")
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path(digest)) and self.update_refs(digest, references, existing=True):
+            return digest
+        writer = self.writer()
+        writer.write(data)
+        return writer.finish(references)
+
+    def update_refs(self, digest, delta, tmp_path=None, existing=False):
+        """Adds delta to the count, installing tmp_path as the body if missing; returns the new count.
+
+        With existing=True nothing changes, and None is returned, unless the
+        body is still present once the lock is held (collect() may have just
+        removed it).
+        """
+        path = self.path(digest)
+        fd = self.lock_refs(f"{path}.refs")
+        try:
+            if existing and not os.path.exists(path):
+                return None
+            count = int(os.pread(fd, REFS_WIDTH, 0) or b"0") + delta
+            if tmp_path is not None:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    os.rename(tmp_path, path)
+            os.pwrite(fd, str(count).zfill(REFS_WIDTH).encode(), 0)
+            return count
+        finally:
+            os.close(fd)
+
+    def lock_refs(self, refs_path, create=True):
+        """Opens and flocks a .refs file; returns the fd, or None if it is gone and create is False.
+
+        collect() may unlink the file between the open and the lock, and a count written
+        to the unlinked file would be lost, so the lock only counts once it is held on the
+        file still at refs_path. Otherwise the file is opened again.
+        """
+        flags = os.O_RDWR | os.O_CREAT if create else os.O_RDWR
+        while True:
+            try:
+                fd = os.open(refs_path, flags, 0o644)
+            except FileNotFoundError:
+                if not create:
+                    return None
+                os.makedirs(os.path.dirname(refs_path), exist_ok=True)
+                continue
+            if not fcntl:
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(refs_path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def commit(self, digest, tmp_path, references):
+        self.update_refs(digest, references, tmp_path)
+
+    def release(self, digest, references=1):
+        return self.update_refs(digest, -references)
+
+    def refs(self, digest):
+        try:
+            with open(f"{self.path(digest)}.refs", "rb") as f:
+                return int(f.read() or b"0")
+        except FileNotFoundError:
+            return 0
+
+    def read(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def resolve(self, body):
+        """Replaces a body reference written by DedupBackend with the stored body."""
+        if body.startswith(REF_PREFIX):
+            return self.read(body[len(REF_PREFIX):].strip()).decode("utf-8", "surrogateescape")
+        return body
+
+    def collect(self):
+        """Removes bodies whose reference count dropped to zero; returns how many were removed."""
+        removed = 0
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if prefix == "tmp" or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(".refs"):
+                    continue
+                refs_path = os.path.join(directory, name)
+                fd = self.lock_refs(refs_path, create=False)
+                if fd is None:
+                    # Collected by another process meanwhile
+                    continue
+                try:
+                    if int(os.pread(fd, REFS_WIDTH, 0) or b"0") <= 0:
+                        body_path = refs_path[:-len(".refs")]
+                        if os.path.exists(body_path):
+                            os.remove(body_path)
+                            removed += 1
+                        os.remove(refs_path)
+                finally:
+                    os.close(fd)
+        return removed
@@ -0,0 +1,35 @@
+"""Reusable receive buffers, so reads fill memory that already exists.
+
+recv() allocates a new bytes object for every read, which the protocol then
+copies into its own input buffer anyway. A BufferPool hands out bytearrays
+of a given size instead: the caller fills one with recv_into, passes a
+memoryview of the filled part on, and gives the buffer back.
+"""
+import threading
+
+# Buffers kept per size; more than this in use at once are simply not reused
+KEEP = 16
+
+
+class BufferPool():
+    """Free lists of bytearrays keyed by size; one pool can be shared between threads."""
+
+    def __init__(self, keep=KEEP):
+        self.keep = keep
+        self.free = {}
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self, size):
+        with self.lock:
+            free = self.free.get(size)
+            if free:
+                return free.pop()
+            self.created += 1
+        return bytearray(size)
+
+    def release(self, buffer):
+        with self.lock:
+            free = self.free.setdefault(len(buffer), [])
+            if len(free) < self.keep:
+                free.append(buffer)
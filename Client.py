@@ -2,10 +2,26 @@ import sys
 import os
 import re
 import time
+from functools import lru_cache
 from socket import *
 
+from Buffers import BufferPool
+from Protocol import ClientProtocol, is_error_code, reply_code
+from Sockets import SocketOptions, send_buffers
+from Transparency import terminate
+
 EMAIL_REGEX = "<.+>"
-WAIT_TIME = 0.05
+CHUNK_SIZE = 1024 * 1024  # bytes per BDAT command
+READ_SIZE = 4096  # bytes per read of server replies
+
+# Read buffers shared by every Client in the process (the relay runs several in threads)
+BUFFERS = BufferPool()
+
+
+@lru_cache(maxsize=None)
+def local_hostname():
+    """Looked up once per process; every session announces the same name."""
+    return gethostname()
 
 class QuitError(Exception):
     def __init__(self, error_response=None, msg=None):
@@ -308,10 +324,10 @@ class Parser:
 
 
 class Client:
-    def __init__(self, serverName, port=None, check_arguments=True):
+    def __init__(self, serverName, port=None, check_arguments=True, socket_options=None):
         self.serverName = serverName
         self.port = port
-        self.myName = gethostname()
+        self.myName = local_hostname()
         self.WD = os.path.dirname(os.path.realpath(__file__))
         self.parser = Parser()
         self.check_arguments = check_arguments
@@ -322,6 +338,13 @@ class Client:
         self.subject_field = None
         self.message_field = []
         self.msg = ""
+        # Recipients the server refused in the last transaction, as {address: reply}
+        self.rejected = {}
+
+        # Frames replies and builds transactions (EHLO sessions only)
+        self.protocol = ClientProtocol(CHUNK_SIZE)
+        # Commands go out in one write per round trip, so TCP_NODELAY costs no extra packets
+        self.socket_options = socket_options or SocketOptions()
 
     def extract_email(self, line):
         """Extracts email address from string."""
@@ -330,17 +353,11 @@ class Client:
 
     def extract_response_code(self, response):
         """Extracts response code from SMTP server"""
-        try: 
-            code = int(response[0:3])
-        except Exception:
-            code = 600
-        return code
+        return reply_code(response)
 
     def is_error_code(self, code, expected=None):
         """Returns whether a response code is an error code."""
-        if expected:
-            return False if code in expected else True
-        return True if code//100 == 5 else False
+        return is_error_code(code, expected)
     
     def check_response(self, response, expected=None):
         """Checks if server response is an error, QUIT if so."""
@@ -352,18 +369,105 @@ class Client:
     def socket_write(self, socket, line):
         #print(f"Trying to write: {[line]}")
         try:
-            sentence = line.encode()
+            sentence = line if isinstance(line, bytes) else line.encode("utf-8", "surrogateescape")
             socket.sendall(sentence)
         except Exception:
             raise SocketError(msg=f"Socket error when writing: {line}")
+
+    def socket_write_all(self, socket, commands):
+        """Sends several commands with one sendmsg (writev) instead of a write each."""
+        try:
+            send_buffers(socket, [command if isinstance(command, bytes) else command.encode("utf-8", "surrogateescape")
+                                  for command in commands])
+        except Exception:
+            raise SocketError(msg=f"Socket error when writing {len(commands)} commands")
     
     def socket_read(self, socket):
+        buffer = BUFFERS.acquire(READ_SIZE)
         try:
-            sentence = socket.recv(2048)
-            #print(f"Just read: {[sentence.decode()]}")
-            return sentence.decode()
+            received = socket.recv_into(buffer)
+            #print(f"Just read: {[buffer[:received].decode()]}")
+            return str(memoryview(buffer)[:received], "utf-8")
         except Exception:
             raise SocketError(msg="Error reading socket")
+        finally:
+            BUFFERS.release(buffer)
+
+    def read_reply(self, socket):
+        """Returns the next complete, possibly multi-line, reply, reading only when needed."""
+        reply = self.protocol.next_reply()
+        while reply is None:
+            data = self.socket_read(socket)
+            if data == "":
+                raise SocketError(msg="Connection closed while waiting for reply")
+            self.protocol.receive_data(data)
+            reply = self.protocol.next_reply()
+        return reply
+
+    def greet(self, socket):
+        """Sends EHLO, or HELO if the server does not know it.
+
+        Returns the offered extensions as {keyword: parameter or None}, or None after HELO.
+        """
+        self.protocol.reset()
+        self.socket_write(socket, self.protocol.hello(self.myName))
+        response = self.socket_read(socket)
+        if self.extract_response_code(response) == 250:
+            self.protocol.receive_data(response)
+            return self.protocol.extensions(self.read_reply(socket))
+
+        self.socket_write(socket, self.protocol.hello(self.myName, esmtp=False))
+        self.check_response(self.socket_read(socket), expected=[250])
+        return None
+
+    def simple_command(self, socket, extensions, command):
+        """Sends a command that takes one reply and returns its code; extensions as returned by greet()."""
+        self.socket_write(socket, command)
+        reply = self.read_reply(socket) if extensions is not None else self.socket_read(socket)
+        return self.extract_response_code(reply)
+
+    def reset(self, socket, extensions):
+        """Aborts the current transaction with RSET so the session can carry the next one."""
+        return self.simple_command(socket, extensions, "RSET\n") == 250
+
+    def noop(self, socket, extensions):
+        """Checks with NOOP that an idle session is still usable."""
+        return self.simple_command(socket, extensions, "NOOP\n") == 250
+
+    def send_transaction(self, socket, extensions, content):
+        """Sends one message (headers and body, no termination dot); returns the reply that decides it.
+
+        After HELO the whole transaction is one write with one reply. After EHLO each command
+        gets its own reply: with PIPELINING, MAIL, RCPT and DATA (or the BDAT chunks, when the
+        server offers CHUNKING) go out without waiting and their replies are read back in
+        order. The first failing reply, if any, is returned.
+
+        A message that went to some recipients but not all still returns the reply to its
+        data; the refused recipients are left in .rejected.
+        """
+        commands = self.protocol.transaction(self.build_envelope(), content, extensions)
+        self.rejected = {}
+        if extensions is None:
+            self.socket_write(socket, commands[0])
+            return self.socket_read(socket)
+
+        if "PIPELINING" in extensions:
+            self.socket_write_all(socket, commands)
+            replies = [self.read_reply(socket) for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                self.socket_write(socket, command)
+                replies.append(self.read_reply(socket))
+
+        reply, data, rejected = self.protocol.outcome(replies)
+        self.rejected = {self.extract_email(self.to_field[index]).strip("<>"): refusal
+                         for index, refusal in rejected.items()}
+        if data is None:
+            return reply
+        # Always read the reply to the data, or the next command would get this one
+        self.socket_write(socket, data)
+        return self.read_reply(socket)
 
     def get_email(self):
         """CLI interface for reading user email."""
@@ -418,57 +522,19 @@ class Client:
         clientSocket = None
         try:
             try:
-                clientSocket = socket(AF_INET, SOCK_STREAM)
-                #clientSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                clientSocket = self.socket_options.apply(socket(AF_INET, SOCK_STREAM))
                 clientSocket.connect((self.serverName, int(self.port)))
             except Exception as e:
                 print(e)
                 raise SocketError(msg="Error during clientSocket creation")
         
-            # HELO
+            # EHLO, or HELO for servers without ESMTP
             server_greeting = self.socket_read(clientSocket)
             self.check_response(server_greeting, expected=[220])
-
-            self.socket_write(clientSocket, f"HELO {self.myName}\n")
-            server_helo_response = self.socket_read(clientSocket)
-            self.check_response(server_helo_response, expected=[250])
-
-            # MAIL FROM
-            self.msg += f"MAIL FROM: {self.from_field}"
-
-            # RCPT TO
-            for rcpt in self.to_field:
-                self.msg += f"RCPT TO: {rcpt}"
-
-            # DATA command
-            data = "DATA\n"
-            self.msg += data
-            
-            # Write message
-            # Write from header
-            self.msg += f"From: {self.from_field}"
-
-            # Write to header
-            self.msg += "To: "
-            self.msg += ", ".join(self.to_field).replace("\n", "")
-            self.msg += "\n"
-
-            # Write subject header
-            self.msg += f"Subject: {self.subject_field}"
-
-            # Write empty newline between header and message
-            self.msg += "\n"
+            extensions = self.greet(clientSocket)
 
             # Write message
-            for line in self.message_field:
-                self.msg += line
-
-            # Write terminaiton dot
-            self.msg += ".\n"
-
-            # Write message
-            self.socket_write(clientSocket, self.msg)
-            server_email_response = self.socket_read(clientSocket)
+            server_email_response = self.send_transaction(clientSocket, extensions, self.build_content())
             self.check_response(server_email_response)
 
             # QUIT, raise QUITError handling emitting and receiving QUIT command
@@ -494,6 +560,52 @@ class Client:
                 clientSocket.close()
                 return
 
+    def build_message(self):
+        """Composes MAIL FROM, RCPT TO, DATA and message body into .msg"""
+        self.msg += self.build_envelope()
+
+        # DATA command
+        self.msg += "DATA\n"
+        self.msg += self.build_body()
+
+        return self.msg
+
+    def build_envelope(self):
+        """MAIL FROM and RCPT TO commands for the current message."""
+        # MAIL FROM
+        envelope = f"MAIL FROM: {self.from_field}"
+
+        # RCPT TO
+        for rcpt in self.to_field:
+            envelope += f"RCPT TO: {rcpt}"
+        return envelope
+
+    def build_body(self):
+        """Headers and message lines, dot-stuffed and ending with the termination dot."""
+        return terminate(self.build_content())
+
+    def build_content(self):
+        """Headers and message lines."""
+        # Write from header
+        body = f"From: {self.from_field}"
+
+        # Write to header
+        body += "To: "
+        body += ", ".join(self.to_field).replace("\n", "")
+        body += "\n"
+
+        # Write subject header
+        body += f"Subject: {self.subject_field}"
+
+        # Write empty newline between header and message
+        body += "\n"
+
+        # Write message
+        for line in self.message_field:
+            body += line
+
+        return body
+
 
     def start_client(self):
         # Checks if domain name is valid
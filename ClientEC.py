@@ -2,6 +2,7 @@ import sys
 import os
 import re
 import time
+from functools import lru_cache
 from socket import *
 
 import email
@@ -9,10 +10,18 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 
+from Transparency import terminate
+
 
 EMAIL_REGEX = "<.+>"
 WAIT_TIME = 0.05
 
+
+@lru_cache(maxsize=None)
+def local_hostname():
+    """Looked up once per process; every session announces the same name."""
+    return gethostname()
+
 class QuitError(Exception):
     def __init__(self, error_response=None, msg=None):
         if msg:
@@ -317,7 +326,7 @@ class Client:
     def __init__(self, serverName, port=None, check_arguments=True):
         self.serverName = serverName
         self.port = port
-        self.myName = gethostname()
+        self.myName = local_hostname()
         self.WD = os.path.dirname(os.path.realpath(__file__))
         self.parser = Parser()
         self.check_arguments = check_arguments
@@ -477,10 +486,8 @@ class Client:
                 msgImage = MIMEImage(img.read(), _subtype="png")
             message.attach(msgImage)
 
-            self.msg += message.as_string()
-
-            # Write terminaiton dot
-            self.msg += ".\n"
+            # Dot-stuffed, then the terminaiton dot
+            self.msg += terminate(message.as_string())
 
             # Write message
             self.socket_write(clientSocket, self.msg)
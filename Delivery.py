@@ -0,0 +1,141 @@
+import itertools
+import os
+import shutil
+import time
+from socket import gethostname
+
+from BodyStore import REF_PREFIX, BodyStore
+from Mailbox import COMPRESSION_SUFFIXES, append_message, compress_message, format_message
+
+FORWARD_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "forward")
+
+
+class DeliveryBackend():
+    """Stores an accepted message for each recipient domain.
+
+    deliver() receives the envelope sender, the recipients grouped by domain
+    ({domain: [address, ...]}, in RCPT order) and the message lines, and
+    returns the domains it delivered to.
+
+    With compression ("gzip" or "xz") every message is compressed on its
+    own, and stored files get the matching suffix.
+    """
+
+    def __init__(self, root=FORWARD_DIR, compression=None, level=None):
+        self.root = root
+        self.compression = compression
+        self.level = level
+        self.suffix = COMPRESSION_SUFFIXES[compression] if compression else ""
+
+    def encode(self, data):
+        if self.compression:
+            return compress_message(data, self.compression, self.level)
+        return data
+
+    def deliver(self, sender, recipients, lines):
+        raise NotImplementedError
+
+
+class MboxBackend(DeliveryBackend):
+    """One indexed mboxrd file per domain: forward/<domain>[.gz|.xz] (see Mailbox.py)."""
+
+    def deliver(self, sender, recipients, lines):
+        data = self.encode(format_message(sender, lines))
+        for domain, addresses in recipients.items():
+            path = os.path.join(self.root, domain + self.suffix)
+            try:
+                append_message(path, data, sender=sender, recipients=addresses)
+            except FileNotFoundError:
+                # forward/ is created on first use, and again if it was removed
+                os.makedirs(self.root, exist_ok=True)
+                append_message(path, data, sender=sender, recipients=addresses)
+        return list(recipients)
+
+
+class MaildirBackend(DeliveryBackend):
+    """One Maildir per domain: forward/<domain>/{tmp,new,cur}, one file per message.
+
+    The message is written once into tmp/ of the first domain. Other domains
+    get hard links to it in their new/ (or a copy when linking is not
+    possible), then the tmp/ file is renamed into the first domain's new/.
+    Consumers never see partial files, and linking from tmp/ means a consumer
+    moving new/ to cur/ cannot race with delivery to other domains.
+    """
+
+    def __init__(self, root=FORWARD_DIR, compression=None, level=None):
+        super().__init__(root, compression, level)
+        self.hostname = gethostname().replace("/", "\\057").replace(":", "\\072")
+        self.counter = itertools.count()
+        self.known = set()
+
+    def maildir(self, domain):
+        path = os.path.join(self.root, domain)
+        if path not in self.known:
+            for sub in ("tmp", "new", "cur"):
+                os.makedirs(os.path.join(path, sub), exist_ok=True)
+            self.known.add(path)
+        return path
+
+    def unique_name(self):
+        now = time.time()
+        return f"{int(now)}.M{int(now % 1 * 1e6)}P{os.getpid()}Q{next(self.counter)}.{self.hostname}{self.suffix}"
+
+    def deliver(self, sender, recipients, lines):
+        domains = list(recipients)
+        if not domains:
+            return []
+        name = self.unique_name()
+        data = self.encode(f"Return-Path: <{sender or ''}>\n{''.join(lines)}".encode("utf-8", "surrogateescape"))
+
+        first = self.maildir(domains[0])
+        tmp_path = os.path.join(first, "tmp", name)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+        for domain in domains[1:]:
+            target = os.path.join(self.maildir(domain), "new", name)
+            try:
+                os.link(tmp_path, target)
+            except OSError:
+                # Different filesystem or no hard link support: copy via tmp/
+                tmp_copy = os.path.join(self.maildir(domain), "tmp", name)
+                shutil.copyfile(tmp_path, tmp_copy)
+                os.rename(tmp_copy, target)
+        os.rename(tmp_path, os.path.join(first, "new", name))
+        return domains
+
+
+class DedupBackend(DeliveryBackend):
+    """Stores each distinct body once in a BodyStore and delivers references to it.
+
+    Wraps another backend: the body is hashed and spooled while its lines are
+    written, and the wrapped backend receives a single
+    "X-Body-Ref: sha256:<digest>" line instead of the body. The store holds
+    one reference per delivered domain; BodyStore.resolve() expands a stored
+    reference again.
+    """
+
+    def __init__(self, backend, store_root=None):
+        super().__init__(backend.root)
+        self.backend = backend
+        self.store = BodyStore(store_root or os.path.join(backend.root, ".bodies"))
+
+    def deliver(self, sender, recipients, lines):
+        if not recipients:
+            return []
+        digest = self.store.put(lines, references=len(recipients))
+        delivered = self.backend.deliver(sender, recipients, [f"{REF_PREFIX}{digest}\n"])
+        if len(delivered) < len(recipients):
+            self.store.release(digest, len(recipients) - len(delivered))
+        return delivered
+
+
+BACKENDS = {
+    "mbox": MboxBackend,
+    "maildir": MaildirBackend,
+}
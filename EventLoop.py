@@ -0,0 +1,365 @@
+"""Single-threaded server mode: every connection multiplexed on one poller.
+
+With --io selectors, Server.run_server hands its listening socket to an
+EventLoop instead of serving one connection at a time. All sockets are
+non-blocking. Each Connection keeps its ServerProtocol and the replies not
+sent yet, and the loop reads, parses and writes for whichever sockets are
+ready. Replies to everything read in one cycle leave together in a single
+sendmsg (writev). On Linux readiness comes from edge-triggered epoll,
+elsewhere from a level-triggered selectors.DefaultSelector.
+
+Once Server.drain has run, the loop closes its listener, sends 421 to the
+connections waiting for a command and lets the ones receiving message data
+finish, until the drain deadline. run returns when no connection is left.
+"""
+import select
+import selectors
+import signal
+import time
+from socket import socketpair
+
+from Protocol import NEED_DATA, Closed, DataFinished, DataStarted, Greeted, ServerProtocol
+from Sockets import IOV_MAX, consume
+from Timeouts import SessionTimeout
+
+# Reads per connection per turn of the loop, so one fast sender cannot starve the others
+READ_BUDGET = 16
+# Seconds before accepting again after accept() failed (EMFILE, ENOBUFS, ...)
+ACCEPT_RETRY = 0.1
+
+
+class EdgePoller():
+    """epoll in edge-triggered mode; each socket is registered once, for reads and writes."""
+
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.flags = select.EPOLLIN | select.EPOLLOUT | select.EPOLLRDHUP | select.EPOLLET
+        # Hang-ups and errors are reported as readable, so the next recv sees them
+        self.read_mask = select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLHUP | select.EPOLLERR
+
+    def register(self, fd):
+        self.epoll.register(fd, self.flags)
+
+    def want_write(self, fd, wanted):
+        # EPOLLOUT stays armed; an edge arrives whenever the send buffer frees up
+        pass
+
+    def unregister(self, fd):
+        self.epoll.unregister(fd)
+
+    def poll(self, timeout):
+        """Returns (fd, readable, writable) for every socket with news."""
+        return [(fd, bool(mask & self.read_mask), bool(mask & select.EPOLLOUT))
+                for fd, mask in self.epoll.poll(-1 if timeout is None else timeout)]
+
+
+class LevelPoller():
+    """selectors.DefaultSelector; write interest is only held while replies are pending."""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.events = {}
+
+    def register(self, fd):
+        self.events[fd] = selectors.EVENT_READ
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def want_write(self, fd, wanted):
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if wanted else 0)
+        if self.events[fd] != events:
+            self.events[fd] = events
+            self.selector.modify(fd, events)
+
+    def unregister(self, fd):
+        del self.events[fd]
+        self.selector.unregister(fd)
+
+    def poll(self, timeout):
+        return [(key.fd, bool(mask & selectors.EVENT_READ), bool(mask & selectors.EVENT_WRITE))
+                for key, mask in self.selector.select(timeout)]
+
+
+class Connection():
+    """One accepted socket, its protocol state and the replies it has not taken yet."""
+
+    __slots__ = ("sock", "fd", "ip", "protocol", "outgoing", "closing", "closed", "opened", "stage_start")
+
+    def __init__(self, sock, ip, protocol):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.ip = ip
+        self.protocol = protocol
+        # Replies not sent yet, as a list of buffers for sendmsg
+        self.outgoing = []
+        # Set after QUIT: close once outgoing is drained, read nothing more
+        self.closing = False
+        self.closed = False
+        self.opened = self.stage_start = time.perf_counter()
+
+
+class EventLoop():
+    """Serves every connection of server from one thread, driving each ServerProtocol."""
+
+    def __init__(self, server, listener):
+        self.server = server
+        self.listener = listener
+        self.poller = EdgePoller() if hasattr(select, "epoll") else LevelPoller()
+        self.connections = {}
+        # Connections that may still have input: their budget ran out, or an edge came in
+        self.ready = {}
+        self.draining = False
+        # When to call accept_all() again after it stopped on an error, or None
+        self.accept_retry = None
+
+    def run(self):
+        self.listener.setblocking(False)
+        listener_fd = self.listener.fileno()
+        self.poller.register(listener_fd)
+        # Signals write a byte here, so SIGTERM or SIGHUP cuts the poll short
+        waker, wakeup = socketpair()
+        waker.setblocking(False)
+        wakeup.setblocking(False)
+        self.poller.register(waker.fileno())
+        previous = signal.set_wakeup_fd(wakeup.fileno())
+        try:
+            while self.connections or not self.draining:
+                if self.server.draining and not self.draining:
+                    self.start_drain()
+                    continue
+                self.turn(listener_fd, waker)
+        finally:
+            signal.set_wakeup_fd(previous)
+            waker.close()
+            wakeup.close()
+
+    def turn(self, listener_fd, waker):
+        """One poll, then reads for every connection with input, then expiry."""
+        for fd, readable, writable in self.poller.poll(self.poll_timeout()):
+            if fd == listener_fd:
+                if not self.draining:
+                    self.accept_all()
+                continue
+            if fd == waker.fileno():
+                try:
+                    while waker.recv(64):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            conn = self.connections.get(fd)
+            if conn is None:
+                continue
+            if writable:
+                self.flush(conn)
+            if readable and not conn.closed and not conn.closing:
+                self.ready[fd] = conn
+        if self.accept_retry is not None and time.monotonic() >= self.accept_retry and not self.draining:
+            self.accept_all()
+        for conn in list(self.ready.values()):
+            self.on_readable(conn)
+        self.expire()
+
+    def start_drain(self):
+        """Stops accepting and shuts down every connection not in the middle of message data."""
+        self.draining = True
+        self.poller.unregister(self.listener.fileno())
+        self.listener.close()
+        for conn in list(self.connections.values()):
+            if not conn.closing and conn.protocol.phase != "data":
+                self.shut_down(conn)
+
+    def shut_down(self, conn):
+        """Queues 421 after any replies still owed, and closes conn once they are sent."""
+        conn.closing = True
+        self.ready.pop(conn.fd, None)
+        self.queue(conn, conn.protocol.take_replies() + [self.server.replies.shutdown])
+        self.flush(conn)
+
+    def poll_timeout(self):
+        """Seconds until the earliest deadline, or 0 while input is waiting to be read."""
+        if self.ready:
+            return 0
+        deadline = self.server.timeouts.timers.next_deadline()
+        if self.draining:
+            deadline = min(deadline or self.server.drain_deadline, self.server.drain_deadline)
+        elif self.accept_retry is not None:
+            deadline = min(deadline or self.accept_retry, self.accept_retry)
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    def accept_all(self):
+        """Accepts until the backlog is empty; with edge triggering there is no second notice.
+
+        If accept() fails for want of resources (EMFILE, ENFILE, ENOBUFS), connections may
+        still be queued with no edge left to report them, so accepting is retried
+        ACCEPT_RETRY seconds later.
+        """
+        server = self.server
+        self.accept_retry = None
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except BlockingIOError:
+                return
+            except OSError:
+                print("ERROR - Error when establishing connection socket")
+                self.accept_retry = time.monotonic() + ACCEPT_RETRY
+                return
+            ip = addr[0]
+            if server.admission:
+                reason = server.admission.admit(ip)
+                if reason:
+                    server.metrics.connection_refused(reason)
+                    server.close_with(sock, server.replies.busy)
+                    continue
+            try:
+                sock.setblocking(False)
+                server.socket_options.apply(sock)
+            except OSError:
+                sock.close()
+                continue
+            server.metrics.connection_opened()
+            server.profiler.session_started(sock)
+            server.timeouts.start_session(sock)
+            conn = Connection(sock, ip, ServerProtocol(server.replies, server.max_size))
+            self.connections[conn.fd] = conn
+            self.poller.register(conn.fd)
+            self.queue(conn, [server.replies.greeting])
+            self.flush(conn)
+            if not conn.closed:
+                server.timeouts.start_read(sock, conn.protocol.phase)
+                # Pipelining clients may already have sent their EHLO
+                self.ready[conn.fd] = conn
+
+    def on_readable(self, conn):
+        """Reads until the socket is drained or the budget is spent, parsing after every read.
+
+        Replies are sent once at the end, so a pipelined burst is answered in one write.
+        """
+        protocol = conn.protocol
+        for _ in range(READ_BUDGET):
+            try:
+                view = protocol.pending_chunk()
+                if view is not None:
+                    received = conn.sock.recv_into(view)
+                    if received:
+                        protocol.chunk_received(received)
+                else:
+                    received = self.read_pooled(conn)
+            except BlockingIOError:
+                del self.ready[conn.fd]
+                break
+            except OSError as e:
+                print(f"ERROR - {e}")
+                self.close(conn)
+                return
+            if received == 0:
+                # Half-closed: answer what was parsed already; flush closes once it is sent
+                protocol.receive_data(b"")
+                self.process(conn)
+                return
+            self.server.timeouts.end_read(conn.sock)
+            self.server.metrics.received(received)
+            if not self.process(conn):
+                return
+        self.flush(conn)
+
+    def read_pooled(self, conn):
+        """One recv_into a pooled buffer sized for the phase, handed to the protocol."""
+        server = self.server
+        protocol = conn.protocol
+        buffer = server.buffers.acquire(server.read_sizes[protocol.phase])
+        try:
+            received = conn.sock.recv_into(buffer)
+            if received:
+                protocol.receive_data(memoryview(buffer)[:received])
+        finally:
+            server.buffers.release(buffer)
+        return received
+
+    def process(self, conn):
+        """Handles the protocol's events until it needs input; False once the connection is done."""
+        server = self.server
+        protocol = conn.protocol
+        while True:
+            event = protocol.next_event()
+            if event is NEED_DATA:
+                if server.draining and protocol.phase != "data":
+                    # Between commands nothing is lost: the client retries later
+                    self.shut_down(conn)
+                    return False
+                self.queue(conn, protocol.take_replies())
+                server.timeouts.start_read(conn.sock, protocol.phase)
+                return True
+            elif isinstance(event, Greeted):
+                server.metrics.observe_stage("handshake", time.perf_counter() - conn.stage_start)
+            elif isinstance(event, DataStarted):
+                conn.stage_start = time.perf_counter()
+                server.metrics.observe_stage("envelope", conn.stage_start - protocol.session.envelope_start)
+            elif isinstance(event, DataFinished):
+                server.metrics.observe_stage("data", time.perf_counter() - conn.stage_start)
+                if event.message is not None:
+                    # Stored before the 250 is queued, so an acknowledged message is never lost
+                    server.store(protocol, event.message)
+            elif isinstance(event, Closed):
+                conn.closing = True
+                self.ready.pop(conn.fd, None)
+                self.queue(conn, protocol.take_replies())
+                self.flush(conn)
+                return False
+
+    def queue(self, conn, replies):
+        for reply in replies:
+            self.server.metrics.reply(reply)
+        conn.outgoing.extend(replies)
+
+    def flush(self, conn):
+        """Sends as much of the connection's output as the socket takes, gathered by sendmsg."""
+        while conn.outgoing:
+            try:
+                sent = conn.sock.sendmsg(conn.outgoing[:IOV_MAX])
+            except BlockingIOError:
+                self.poller.want_write(conn.fd, True)
+                return
+            except OSError as e:
+                print(f"ERROR - {e}")
+                self.close(conn)
+                return
+            consume(conn.outgoing, sent)
+        self.poller.want_write(conn.fd, False)
+        if conn.closing:
+            self.close(conn)
+
+    def expire(self):
+        """Sends 421 to, and closes, every connection whose read, session or drain deadline passed."""
+        server = self.server
+        for sock, kind in server.timeouts.timers.pop_expired():
+            conn = self.connections.get(sock.fileno())
+            if conn is None or conn.sock is not sock:
+                continue
+            self.detach(conn)
+            server.close_timed_out(sock, SessionTimeout(conn.protocol.phase))
+        if self.draining and time.monotonic() >= server.drain_deadline:
+            for conn in list(self.connections.values()):
+                self.detach(conn)
+                server.close_with(conn.sock, server.replies.shutdown)
+
+    def close(self, conn):
+        if not conn.closed:
+            self.detach(conn)
+            conn.sock.close()
+
+    def detach(self, conn):
+        """Stops watching conn and ends its session; the socket itself is left open."""
+        server = self.server
+        conn.closed = True
+        self.poller.unregister(conn.fd)
+        del self.connections[conn.fd]
+        self.ready.pop(conn.fd, None)
+        server.timeouts.end_session(conn.sock)
+        server.metrics.observe_stage("session", time.perf_counter() - conn.opened)
+        server.profiler.session_finished(conn.sock)
+        server.metrics.connection_closed()
+        if server.admission:
+            server.admission.release(conn.ip)
@@ -0,0 +1,304 @@
+import calendar
+import gzip
+import json
+import lzma
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# mboxrd: body lines matching this get one more ">" on write and lose one on read
+FROM_LINE = re.compile(r">*From ")
+FROM_LINES = re.compile(r"^(?=>*From )", re.MULTILINE)
+
+# Sidecar index record: message offset, message length, timestamp,
+# offset and length of the sender/recipients JSON line in <mailbox>.meta
+INDEX_RECORD = struct.Struct("<QIdQI")
+INDEX_FD_CACHE_SIZE = 128
+
+# Compressed mailboxes store every message as its own gzip member / xz stream,
+# so the index can decompress one message, and gunzip/xz read the whole file
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "xz": ".xz"}
+COMPRESSION_LEVELS = {"gzip": 6, "xz": 6}
+COMPRESS_CHUNK = 64 * 1024
+
+
+class AppendFdCache():
+    """Keeps O_APPEND descriptors of index files open between deliveries (LRU bounded).
+
+    get() returns the .meta and .idx descriptors of a mailbox together. Only
+    used for files written while the mailbox lock is held; the mailbox itself
+    is always opened fresh, because flock does not exclude threads sharing one
+    open file description.
+    """
+
+    def __init__(self, size=INDEX_FD_CACHE_SIZE):
+        self.size = size
+        self.fds = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            fds = self.fds.get(path)
+            if fds is not None:
+                self.fds.move_to_end(path)
+                return fds
+            fds = self.fds[path] = tuple(os.open(path + suffix, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                                         for suffix in (".meta", ".idx"))
+            if len(self.fds) > self.size:
+                for fd in self.fds.popitem(last=False)[1]:
+                    os.close(fd)
+            return fds
+
+    def discard(self, path):
+        with self.lock:
+            for fd in self.fds.pop(path, ()):
+                os.close(fd)
+
+
+index_fds = AppendFdCache()
+
+
+def format_message(sender, lines, timestamp=None):
+    """Frames message lines as one mboxrd entry, returned as bytes ready for a single write."""
+    if timestamp is None:
+        timestamp = time.time()
+    body = "".join(lines)
+    # Escape the whole body at once; plain str.replace unless a line starts with ">"
+    if "From " in body:
+        if "\n>" in body or body.startswith(">"):
+            body = FROM_LINES.sub(">", body)
+        else:
+            body = body.replace("\nFrom ", "\n>From ")
+            if body.startswith("From "):
+                body = ">" + body
+    if body and not body.endswith("\n"):
+        body += "\n"
+    return f"From {sender or 'MAILER-DAEMON'} {time.asctime(time.gmtime(timestamp))}\n{body}\n".encode("utf-8", "surrogateescape")
+
+
+def compress_message(data, compression, level=None):
+    """Compresses one framed message as an independent gzip member or xz stream."""
+    if level is None:
+        level = COMPRESSION_LEVELS[compression]
+    if compression == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    elif compression == "xz":
+        compressor = lzma.LZMACompressor(preset=level)
+    else:
+        raise ValueError(f"Unknown compression {compression}")
+    view = memoryview(data)
+    chunks = [compressor.compress(view[i:i + COMPRESS_CHUNK]) for i in range(0, len(view), COMPRESS_CHUNK)]
+    chunks.append(compressor.flush())
+    return b"".join(chunks)
+
+
+def compression_of(path):
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def decompress_message(data, compression):
+    if compression == "gzip":
+        return zlib.decompress(data, 31)
+    if compression == "xz":
+        return lzma.decompress(data)
+    return data
+
+
+def write_all(fd, data):
+    written = os.write(fd, data)
+    if written < len(data):
+        view = memoryview(data)[written:]
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def append_message(path, data, sender=None, recipients=None):
+    """Appends data with one O_APPEND write under an exclusive flock.
+
+    O_APPEND keeps concurrent writers from overwriting each other, and the
+    lock keeps a message contiguous even if the kernel splits the write.
+    The sidecar index (<path>.idx, <path>.meta) is appended under the same
+    lock, so index order always matches mailbox order. Everything but the
+    offsets is prepared before the lock is taken, so it is held only for the
+    writes themselves.
+    """
+    meta = index_meta(sender, recipients or [])
+    timestamp = time.time()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        # The end, where the append lands; no other writer moves it while the lock is held
+        offset = os.lseek(fd, 0, os.SEEK_END)
+        write_all(fd, data)
+        append_index(path, offset, len(data), timestamp, meta)
+    finally:
+        os.close(fd)  # also releases the lock
+
+
+def index_meta(sender, recipients):
+    """The .meta line of a message: what json.dumps({"sender": ..., "recipients": [...]}) gives,
+    formatted directly, which takes a fifth of the time."""
+    sender = "null" if sender is None else encode_basestring_ascii(sender)
+    return ('{"sender": %s, "recipients": [%s]}\n' % (sender, ", ".join(map(encode_basestring_ascii, recipients)))).encode()
+
+
+def append_index(path, offset, length, timestamp, meta):
+    """Caller must hold the mailbox lock."""
+    meta_fd, idx_fd = index_fds.get(path)
+    meta_offset = os.lseek(meta_fd, 0, os.SEEK_END)
+    write_all(meta_fd, meta)
+    write_all(idx_fd, INDEX_RECORD.pack(offset, length, timestamp, meta_offset, len(meta)))
+
+
+def parse_messages(text):
+    """Splits mboxrd text into (envelope line, body) pairs, undoing From-escaping."""
+    messages = []
+    envelope = None
+    body = []
+    for line in text.splitlines(keepends=True):
+        if line.startswith("From "):
+            if envelope is not None:
+                messages.append((envelope, "".join(body[:-1] if body and body[-1] == "\n" else body)))
+            envelope = line.rstrip("\n")
+            body = []
+        elif envelope is not None:
+            if FROM_LINE.match(line):
+                line = line[1:]
+            body.append(line)
+    if envelope is not None:
+        messages.append((envelope, "".join(body[:-1] if body and body[-1] == "\n" else body)))
+    return messages
+
+
+def read_messages(path):
+    compression = compression_of(path)
+    opener = {"gzip": gzip.open, "xz": lzma.open}.get(compression, open)
+    with opener(path, "rt", encoding="utf-8", errors="surrogateescape") as f:
+        return parse_messages(f.read())
+
+
+class MailboxIndex():
+    """Random access to an indexed mailbox by message number or time range.
+
+    The index is memory mapped and messages are read with pread at their
+    recorded offset, so nothing is scanned. Call refresh() to pick up
+    messages appended after opening.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.compression = compression_of(path)
+        self.mailbox_fd = os.open(path, os.O_RDONLY)
+        self.meta_fd = os.open(f"{path}.meta", os.O_RDONLY)
+        self.index = None
+        self.count = 0
+        self.refresh()
+
+    def refresh(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        with open(f"{self.path}.idx", "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.count = size // INDEX_RECORD.size
+            if self.count:
+                self.index = mmap.mmap(f.fileno(), self.count * INDEX_RECORD.size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+        os.close(self.mailbox_fd)
+        os.close(self.meta_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def record(self, k):
+        if k < 0:
+            k += self.count
+        if not 0 <= k < self.count:
+            raise IndexError("message index out of range")
+        return INDEX_RECORD.unpack_from(self.index, k * INDEX_RECORD.size)
+
+    def timestamp(self, k):
+        return self.record(k)[2]
+
+    def entry(self, k):
+        """Returns offset, length, timestamp, sender and recipients of message k."""
+        offset, length, timestamp, meta_offset, meta_length = self.record(k)
+        meta = json.loads(os.pread(self.meta_fd, meta_length, meta_offset))
+        return {"offset": offset, "length": length, "timestamp": timestamp, **meta}
+
+    def raw(self, k):
+        offset, length = self.record(k)[0:2]
+        return decompress_message(os.pread(self.mailbox_fd, length, offset), self.compression)
+
+    def get(self, k):
+        """Returns (envelope line, body) of message k."""
+        return parse_messages(self.raw(k).decode("utf-8", "surrogateescape"))[0]
+
+    def __iter__(self):
+        for k in range(self.count):
+            yield self.get(k)
+
+    def find_time(self, timestamp):
+        """Number of the first message at or after timestamp (binary search)."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def time_range(self, start=None, end=None):
+        """Yields (number, envelope line, body) for messages with start <= timestamp < end."""
+        first = 0 if start is None else self.find_time(start)
+        last = self.count if end is None else self.find_time(end)
+        for k in range(first, last):
+            yield (k, *self.get(k))
+
+
+def rebuild_index(path):
+    """Recreates the sidecar index of an existing uncompressed mailbox from its envelope lines."""
+    if compression_of(path):
+        raise ValueError("Cannot rebuild the index of a compressed mailbox")
+    index_fds.discard(path)
+    for suffix in (".idx", ".meta"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            starts = [m.start() for m in re.finditer(rb"(?:^|(?<=\n))From ", data)]
+            starts.append(len(data))
+            for start, end in zip(starts, starts[1:]):
+                envelope = data[start:data.find(b"\n", start)].decode("utf-8", "surrogateescape").split(" ", 2)
+                try:
+                    timestamp = calendar.timegm(time.strptime(envelope[2], "%a %b %d %H:%M:%S %Y"))
+                except (IndexError, ValueError):
+                    timestamp = 0.0
+                sender = envelope[1] if len(envelope) > 1 else None
+                append_index(path, start, end - start, timestamp, index_meta(sender, []))
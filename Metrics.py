@@ -0,0 +1,178 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) for stage latency histograms
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# Upper bounds for recipients-per-message histogram
+RECIPIENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram():
+    """Cumulative histogram in the Prometheus sense (le buckets + sum + count)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        sep = "," if labels else ""
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class StageTimer():
+    """Context manager recording elapsed time of a stage into Metrics."""
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics():
+    """Counters collected by Server, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_accepted = 0
+        self.connections_active = 0
+        self.connections_refused = {}
+        self.messages_accepted = 0
+        self.bytes_received = 0
+        self.recipients = Histogram(RECIPIENT_BUCKETS)
+        self.domain_deliveries = {}
+        self.reply_codes = {}
+        self.stage_latency = {}
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections_accepted += 1
+            self.connections_active += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.connections_active -= 1
+
+    def connection_refused(self, reason):
+        with self.lock:
+            self.connections_refused[reason] = self.connections_refused.get(reason, 0) + 1
+
+    def received(self, nbytes):
+        with self.lock:
+            self.bytes_received += nbytes
+
+    def reply(self, data):
+        """Counts a sent reply by its code; data is the encoded reply."""
+        code = data[0:3]
+        with self.lock:
+            self.reply_codes[code] = self.reply_codes.get(code, 0) + 1
+
+    def message_accepted(self, recipients):
+        with self.lock:
+            self.messages_accepted += 1
+            self.recipients.observe(recipients)
+
+    def delivered(self, domain):
+        with self.lock:
+            self.domain_deliveries[domain] = self.domain_deliveries.get(domain, 0) + 1
+
+    def observe_stage(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stage_latency:
+                self.stage_latency[stage] = Histogram(LATENCY_BUCKETS)
+            self.stage_latency[stage].observe(seconds)
+
+    def time(self, stage):
+        return StageTimer(self, stage)
+
+    def render(self):
+        """Returns all metrics in Prometheus exposition format."""
+        with self.lock:
+            lines = [
+                "# TYPE smtp_connections_accepted_total counter",
+                f"smtp_connections_accepted_total {self.connections_accepted}",
+                "# TYPE smtp_connections_active gauge",
+                f"smtp_connections_active {self.connections_active}",
+                "# TYPE smtp_messages_accepted_total counter",
+                f"smtp_messages_accepted_total {self.messages_accepted}",
+                "# TYPE smtp_bytes_received_total counter",
+                f"smtp_bytes_received_total {self.bytes_received}",
+                "# TYPE smtp_recipients_per_message histogram",
+            ]
+            lines += self.recipients.render("smtp_recipients_per_message")
+
+            lines.append("# TYPE smtp_connections_refused_total counter")
+            for reason, count in sorted(self.connections_refused.items()):
+                lines.append(f'smtp_connections_refused_total{{reason="{reason}"}} {count}')
+
+            lines.append("# TYPE smtp_domain_deliveries_total counter")
+            for domain, count in sorted(self.domain_deliveries.items()):
+                lines.append(f'smtp_domain_deliveries_total{{domain="{domain}"}} {count}')
+
+            lines.append("# TYPE smtp_replies_total counter")
+            for code, count in sorted(self.reply_codes.items()):
+                lines.append(f'smtp_replies_total{{code="{code.decode()}"}} {count}')
+
+            lines.append("# TYPE smtp_stage_seconds histogram")
+            for stage, histogram in sorted(self.stage_latency.items()):
+                lines += histogram.render("smtp_stage_seconds", labels=f'stage="{stage}"')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class MetricsHTTPServer(ThreadingHTTPServer):
+    # A restarted server binds the port while the old one is still draining
+    allow_reuse_port = hasattr(socket, "SO_REUSEPORT")
+
+
+def start_metrics_server(metrics, port, host="127.0.0.1"):
+    """Serves /metrics from a daemon thread so the SMTP accept loop never waits on it."""
+    httpd = MetricsHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.metrics = metrics
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
@@ -0,0 +1,134 @@
+import os
+import signal
+import time
+
+from Restart import spawn_successor
+
+RESTART_DELAY = 1.0
+SHUTDOWN_TIMEOUT = 10.0
+
+
+class Supervisor():
+    """Pre-forks worker processes that each run Server.run_server on a SO_REUSEPORT socket.
+
+    The supervisor opens the sockets, one per worker, and keeps them, so a
+    restarted worker picks up the connections queued while it was down.
+    Crashed workers are restarted; SIGTERM or SIGINT drains and stops all
+    workers, SIGHUP hands the sockets to a new supervisor first, and SIGUSR1
+    is forwarded to them so profiling still works per worker.
+    """
+
+    def __init__(self, server, workers, listeners=None):
+        self.server = server
+        self.workers = workers
+        # Inherited from the supervisor this one replaces, or opened in run
+        self.listeners = listeners or []
+        self.children = {}
+        self.started = {}
+        self.stopping = False
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if hasattr(signal, "SIGHUP"):
+                # Restarts are the supervisor's job
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            self.server.restart_command = None
+            code = 1
+            try:
+                if self.server.metrics_port:
+                    self.server.metrics_port += index
+                self.server.run_server(listener=self.listeners[index])
+                if self.server.draining:
+                    code = 0
+            except KeyboardInterrupt:
+                code = 0
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        self.started[index] = time.monotonic()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def restart(self, signum, frame):
+        """Starts a new supervisor on the same sockets, then stops this one."""
+        if self.stopping:
+            return
+        try:
+            spawn_successor(self.server.restart_command, self.listeners)
+        except OSError as e:
+            print(f"ERROR - Cannot start new server: {e}")
+            return
+        self.stopping = True
+
+    def forward(self, signum, frame):
+        for pid in self.children:
+            os.kill(pid, signum)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.forward)
+        if self.server.restart_command and hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.restart)
+
+        for listener in self.listeners[self.workers:]:
+            listener.close()
+        del self.listeners[self.workers:]
+        try:
+            while len(self.listeners) < self.workers:
+                self.listeners.append(self.server.open_listener(reuse_port=True))
+        except OSError as e:
+            print(e)
+            print("ERROR - Cannot establish welcome socket")
+            return
+
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while not self.stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            print(f"ERROR - worker {index} (pid {pid}) exited with status {status}, restarting")
+            # Avoid a tight crash loop when a worker dies right after starting
+            if time.monotonic() - self.started[index] < RESTART_DELAY:
+                time.sleep(RESTART_DELAY)
+            self.spawn(index)
+
+        self.shutdown()
+
+    def shutdown(self):
+        """SIGTERM makes each worker drain; one still running after its drain_timeout is killed."""
+        for listener in self.listeners:
+            listener.close()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.server.drain_timeout + SHUTDOWN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.05)
+            else:
+                self.children.pop(pid, None)
+        for pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children = {}
@@ -0,0 +1,74 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+
+class SessionProfiler():
+    """Profiles the next N sessions with cProfile and tracemalloc once armed.
+
+    Arming is cheap and signal safe (it only sets a counter); profiling starts
+    with the next session, and results are written to .out_dir after the Nth
+    session, at which point the profiler switches itself off.
+
+    In selectors mode sessions overlap on one thread, so cProfile covers the
+    whole loop while any profiled session is open, other sessions included.
+    """
+
+    def __init__(self, out_dir, sessions=10):
+        self.out_dir = out_dir
+        self.sessions = sessions
+        self.remaining = 0
+        self.profile = None
+        # Keys of the profiled sessions still open
+        self.profiled = set()
+
+    def arm(self, sessions=None):
+        if self.remaining == 0:
+            self.remaining = sessions or self.sessions
+
+    def handle_signal(self, signum, frame):
+        self.arm()
+
+    def session_started(self, key):
+        if self.remaining - len(self.profiled) <= 0:
+            return
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            tracemalloc.start(25)
+        if not self.profiled:
+            self.profile.enable()
+        self.profiled.add(key)
+
+    def session_finished(self, key):
+        if key not in self.profiled:
+            return
+        self.profiled.remove(key)
+        self.remaining -= 1
+        if not self.profiled:
+            self.profile.disable()
+            if self.remaining == 0:
+                self.dump()
+
+    def dump(self):
+        """Writes the .prof file plus text summaries, then disables profiling."""
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.out_dir, f"profile-{os.getpid()}-{stamp}")
+
+        self.profile.dump_stats(f"{base}.prof")
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(50)
+        with open(f"{base}.txt", "w") as f:
+            f.write(stream.getvalue())
+
+        with open(f"{base}-memory.txt", "w") as f:
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+
+        self.profile = None
+        print(f"Profile written to {base}.prof")
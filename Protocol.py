@@ -0,0 +1,1332 @@
+"""SMTP without I/O, shared by Server and Client.
+
+ServerProtocol takes the bytes a client sent and returns events plus the
+replies to send back; ClientProtocol frames the server's replies and builds
+the commands of a transaction. Neither touches a socket, so blocking,
+threaded and asyncio front ends are thin drivers on top, and the protocol
+can be exercised with plain bytes.
+"""
+import re
+import time
+
+from Session import GREETED, INIT, OUT_OF_SEQUENCE, RCPT, SESSION_COMMANDS, Session
+from Transparency import find_end, terminate, unstuff
+
+ERROR_500 = "500 Syntax error: command unrecognized"
+ERROR_501 = "501 Syntax error in parameters or arguments"
+ERROR_503 = "503 Bad sequence of commands"
+OK_250 = "250 OK"
+ERROR_451 = "451 Requested action aborted: local error in processing"
+OK_354 = "354 Start mail input; end with <CRLF>.<CRLF>"
+OK_252 = "252 Cannot VRFY user, but will accept message and attempt delivery"
+ERROR_552 = "552 Message size exceeds fixed maximum message size"
+ERROR_555 = "555 MAIL FROM/RCPT TO parameters not recognized or not implemented"
+ERROR_500_LINE = "500 Line too long"
+
+MAX_MESSAGE_SIZE = 50 * 1024 * 1024
+# Longest command line, newline included (RFC 5321 4.5.3.1.4)
+MAX_COMMAND_LINE = 512
+# Refused BDAT chunks are read into this and dropped. Nothing ever looks at what it
+# holds, so all sessions share it.
+SKIP_BUFFER = bytearray(65536)
+EMAIL_REGEX = "<.+>"
+
+
+class ParseError(Exception):
+    """Responsible for reporting out-of-place characters in 501 errors."""
+
+    def __init__(self, msg, char, pos, *args):
+        self.msg = msg
+        self.args = args
+        self.char = char
+        self.pos = pos
+
+    def __str__(self):
+        # return f"ERROR -- {self.msg} at pos {self.pos} next char {self.char}, ord {ord(self.char)}"
+        return f"{self.msg}"
+    
+
+class SyntaxError500(Exception):
+    def __init__(self):
+        self.msg = "500 Syntax error: command unrecognized"
+
+    def __str__(self):
+        return f"{self.msg}"
+
+
+class SyntaxError501(Exception):
+    def __init__(self):
+        self.msg = "501 Syntax error in parameters or arguments"
+
+    def __str__(self):
+        return f"{self.msg}"
+
+
+class OrderError503(Exception):
+    def __init__(self):
+        self.msg = "503 Bad sequence of commands"
+
+    def __str__(self):
+        return f"{self.msg}"
+
+
+class ReplyTable():
+    """Every fixed server reply, encoded once at startup, each ending in a newline."""
+
+    def __init__(self, hostname, max_size=MAX_MESSAGE_SIZE):
+        self.hostname = hostname
+        self.greeting = f"220 {hostname} ESMTP\n".encode()
+        self.closing = f"221 {hostname} closing connection\n".encode()
+        self.timeout = f"421 {hostname} Timeout, closing transmission channel\n".encode()
+        self.busy = f"421 {hostname} Too many connections, try again later\n".encode()
+        self.shutdown = f"421 {hostname} Service shutting down, closing transmission channel\n".encode()
+        self.ok_250 = f"{OK_250}\n".encode()
+        self.ok_354 = f"{OK_354}\n".encode()
+        self.error_500 = f"{ERROR_500}\n".encode()
+        self.error_501 = f"{ERROR_501}\n".encode()
+        self.error_503 = f"{ERROR_503}\n".encode()
+        self.error_451 = f"{ERROR_451}\n".encode()
+        self.ok_252 = f"{OK_252}\n".encode()
+        self.error_552 = f"{ERROR_552}\n".encode()
+        self.error_555 = f"{ERROR_555}\n".encode()
+        self.line_too_long = f"{ERROR_500_LINE}\n".encode()
+        # Replies for the codes produced by the Session transition table
+        self.codes = {250: self.ok_250, 252: self.ok_252, 354: self.ok_354, 503: self.error_503}
+        # Follows the "250-<host> Hello <client>" line of an EHLO reply
+        self.capabilities = f"250-PIPELINING\n250-SIZE {max_size}\n250-8BITMIME\n250 CHUNKING\n".encode()
+
+
+class Parser():
+    def __init__(self):
+        self.sentence = None
+        self.next_pos = -1
+        self.next_char = None
+        self.params = []
+        self.chunk_size = None
+        self.chunk_last = False
+
+    def flush(self):
+        self.sentence = None
+        self.next_pos = -1
+        self.next_char = None
+
+    def increment(self):
+        self.next_pos += 1
+        try:
+            self.next_char = self.sentence[self.next_pos]
+        except:
+            self.next_char = None
+
+    def parse_mail_from(self, sentence):
+        self.sentence = sentence
+        self.params = []
+        self.increment()
+        try:
+            self.mail_from_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        except SyntaxError501 as e:
+            self.flush()
+            return 501
+
+    def parse_rcpt_to(self, sentence):
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.rcpt_to_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        except SyntaxError501 as e:
+            self.flush()
+            return 501
+
+    def parse_data(self, sentence):
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.data_cmd()
+            self.flush()
+            return 354
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        
+    def parse_quit(self, sentence):
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.quit_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+
+    def parse_rset(self, sentence):
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.rset_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+
+    def parse_noop(self, sentence):
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.noop_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+
+    def parse_vrfy(self, sentence):
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.vrfy_cmd()
+            self.flush()
+            return 252
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        except SyntaxError501 as e:
+            self.flush()
+            return 501
+
+    def parse_data_end(self, sentence):
+        """Checks if sentence is data termination sequence."""
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.data_end_cmd()
+            self.flush()
+            return True
+        except SyntaxError500 as e:
+            self.flush()
+            return False
+        
+    def parse_bdat(self, sentence):
+        """Checks if sentence is bdat command; size and LAST flag go to .chunk_size/.chunk_last"""
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.bdat_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        except SyntaxError501 as e:
+            self.flush()
+            return 501
+
+    def parse_ehlo(self, sentence):
+        """Checks if sentence is ehlo command."""
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.ehlo_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        except SyntaxError501 as e:
+            self.flush()
+            return 501
+
+    def parse_helo(self, sentence):
+        """Checks if sentence is helo command."""
+        self.sentence = sentence
+        self.increment()
+        try:
+            self.helo_cmd()
+            self.flush()
+            return 250
+        except SyntaxError500 as e:
+            self.flush()
+            return 500
+        except SyntaxError501 as e:
+            self.flush()
+            return 501
+
+    def mail_from_cmd(self):
+        if self.next_char != "M":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "A":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "I":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "L":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.whitespace()
+        except ParseError:
+            raise SyntaxError500()
+
+        if self.next_char != "F":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "R":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "O":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "M":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != ":":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.nullspace()
+            self.reverse_path()
+            self.nullspace()
+            self.mail_parameters()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError501()
+
+    def rcpt_to_cmd(self):
+        if self.next_char != "R":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "C":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "P":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "T":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.whitespace()
+        except ParseError:
+            raise SyntaxError500()
+
+        if self.next_char != "T":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "O":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != ":":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.nullspace()
+            self.forward_path()
+            self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError501()
+
+    def data_cmd(self):
+        if self.next_char != "D":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "A":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "T":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "A":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError500()
+        
+    def quit_cmd(self):
+        if self.next_char != "Q":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "U":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "I":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "T":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError500()
+        
+    def rset_cmd(self):
+        if self.next_char != "R":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "S":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "E":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "T":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError500()
+
+    def noop_cmd(self):
+        if self.next_char != "N":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "O":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "O":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "P":
+            raise SyntaxError500()
+        self.increment()
+
+        # NOOP may carry any argument, which is ignored
+        try:
+            self.nullspace()
+            self.argument()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError500()
+
+    def vrfy_cmd(self):
+        if self.next_char != "V":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "R":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "F":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "Y":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.whitespace()
+            start = self.next_pos
+            self.argument()
+            if self.next_pos == start:
+                raise ParseError(msg="vrfy", pos=self.next_pos, char=self.next_char)
+            self.crlf()
+        except ParseError:
+            raise SyntaxError501()
+
+    def argument(self):
+        """Free text up to the end of the line."""
+        while self.next_char is not None and self.next_char not in "\r\n":
+            self.increment()
+
+    def bdat_cmd(self):
+        if self.next_char != "B":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "D":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "A":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "T":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.whitespace()
+            start = self.next_pos
+            self.digit()
+            while self.next_char is not None and self.next_char.isdigit():
+                self.increment()
+            self.chunk_size = int(self.sentence[start:self.next_pos])
+            self.chunk_last = False
+            self.nullspace()
+            if self.next_char is not None and self.next_char in "Ll":
+                if self.sentence[self.next_pos:self.next_pos + 4].upper() != "LAST":
+                    raise ParseError(msg="bdat", pos=self.next_pos, char=self.next_char)
+                for _ in range(4):
+                    self.increment()
+                self.chunk_last = True
+                self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError501()
+
+    def ehlo_cmd(self):
+        if self.next_char != "E":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "H":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "L":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "O":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.whitespace()
+            self.domain()
+            self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError501()
+
+    def helo_cmd(self):
+        if self.next_char != "H":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "E":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "L":
+            raise SyntaxError500()
+        self.increment()
+        if self.next_char != "O":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.whitespace()
+            self.domain()
+            self.nullspace()
+            self.crlf()
+        except ParseError:
+            raise SyntaxError501()
+
+    def data_end_cmd(self):
+        if self.next_char != ".":
+            raise SyntaxError500()
+        self.increment()
+
+        try:
+            self.crlf()
+        except ParseError:
+            raise SyntaxError500()
+
+    def whitespace(self):
+        try:
+            self.sp()
+        except ParseError:
+            raise ParseError(msg="whitespace", pos=self.next_pos, char=self.next_char)
+
+        try:
+            self.whitespace()
+        except ParseError:
+            pass
+
+    def sp(self):
+        if self.next_char == " " or self.next_char == "\t":
+            self.increment()
+        else:
+            raise ParseError(msg="sp", pos=self.next_pos, char=self.next_char)
+
+    def nullspace(self):
+        self.null()
+        try:
+            self.whitespace()
+        except ParseError:
+            pass
+
+    def null(self):
+        return
+
+    def mail_parameters(self):
+        """Zero or more space separated esmtp-keyword["=" esmtp-value], collected into .params"""
+        while self.next_char is not None and self.next_char.isalnum():
+            self.esmtp_param()
+            self.nullspace()
+
+    def esmtp_param(self):
+        start = self.next_pos
+        while self.next_char is not None and (self.next_char.isalnum() or self.next_char == "-"):
+            self.increment()
+        keyword = self.sentence[start:self.next_pos]
+        value = None
+        if self.next_char == "=":
+            self.increment()
+            start = self.next_pos
+            while self.next_char is not None and 33 <= ord(self.next_char) <= 126 and self.next_char != "=":
+                self.increment()
+            if self.next_pos == start:
+                raise ParseError(msg="esmtp-value", pos=self.next_pos, char=self.next_char)
+            value = self.sentence[start:self.next_pos]
+        self.params.append((keyword.upper(), value))
+
+    def reverse_path(self):
+        self.path()
+
+    def forward_path(self):
+        self.path()
+
+    def path(self):
+        if self.next_char != "<":
+            raise ParseError(msg="path", pos=self.next_pos, char=self.next_char)
+        self.increment()
+
+        self.mailbox()
+
+        if self.next_char != ">":
+            raise ParseError(msg="path", pos=self.next_pos, char=self.next_char)
+        self.increment()
+
+    def mailbox(self):
+        self.local_part()
+
+        if self.next_char != "@":
+            raise ParseError(msg="mailbox", pos=self.next_pos, char=self.next_char)
+        self.increment()
+
+        self.domain()
+
+    def local_part(self):
+        self.string()
+
+    def string(self):
+        try:
+            self.char()
+        except ParseError:
+            raise ParseError(msg="string", pos=self.next_pos, char=self.next_char)
+
+        try:
+            self.string()
+        except ParseError:
+            pass
+
+    def char(self):
+        EXCLUDED_ASCII = [60, 62, 40, 41, 91, 93, 92, 46, 44, 59, 58, 64, 34, 32, 9]
+        ascii_num = ord(self.next_char)
+        if 32 <= ascii_num and ascii_num <= 126 and ascii_num not in EXCLUDED_ASCII:
+            self.increment()
+        else:
+            raise ParseError(msg="char", pos=self.next_pos, char=self.next_char)
+
+    def domain(self):
+        self.element()
+
+        if self.next_char == ".":
+            self.increment()
+            self.domain()
+
+    def element(self):
+        try:
+            self.letter()
+        except ParseError:
+            raise ParseError(msg="element", pos=self.next_pos, char=self.next_char)
+
+        try:
+            self.let_dig_str()
+        except ParseError:
+            pass
+
+    def name(self):
+        try:
+            self.letter()
+        except ParseError:
+            raise ParseError(msg="name", pos=self.next_pos, char=self.next_char)
+
+        self.let_dig_str()
+
+    def letter(self):
+        if self.next_char.isalpha() or self.next_char.isdigit():
+            self.increment()
+        else:
+            raise ParseError(msg="letter", pos=self.next_pos, char=self.next_char)
+
+    def let_dig_str(self):
+        self.let_dig()
+
+        try:
+            self.let_dig_str()
+        except ParseError:
+            pass
+
+    def let_dig(self):
+        try:
+            self.letter()
+        except ParseError:
+            try:
+                self.digit()
+            except ParseError:
+                raise ParseError(msg="let-dig", pos=self.next_pos, char=self.next_char)
+
+    def digit(self):
+        if self.next_char.isdigit():
+            self.increment()
+        else:
+            raise ParseError(msg="digit", char=self.next_char, pos=self.next_pos)
+
+    def crlf(self):
+        if self.next_char == "\n" or self.next_char == "\r":
+            self.increment()
+        else:
+            raise ParseError(msg="CRLF", char=self.next_char, pos=self.next_pos)
+
+    def special(self):
+        if self.next_char in '<>()[]\\.,;:@"':
+            self.increment()
+        else:
+            raise ParseError(msg="special", char=self.next_char, pos=self.next_pos)
+
+
+# First four characters of a command -> (command name, Parser method)
+COMMANDS = {
+    "MAIL": ("mail_from", Parser.parse_mail_from),
+    "RCPT": ("rcpt_to", Parser.parse_rcpt_to),
+    "DATA": ("data", Parser.parse_data),
+    "QUIT": ("quit", Parser.parse_quit),
+    "HELO": ("helo", Parser.parse_helo),
+    "EHLO": ("ehlo", Parser.parse_ehlo),
+    "BDAT": ("bdat", Parser.parse_bdat),
+    "RSET": ("rset", Parser.parse_rset),
+    "NOOP": ("noop", Parser.parse_noop),
+    "VRFY": ("vrfy", Parser.parse_vrfy),
+}
+
+
+# What ServerProtocol is reading: command lines, DATA up to the lone ".", or a BDAT chunk
+COMMAND, MESSAGE, CHUNK = range(3)
+ENVELOPE_COMMANDS = ("mail_from", "rcpt_to", "data")
+
+
+class NeedData():
+    """Returned by next_event() when the input runs out; send the replies, then read."""
+
+    def __repr__(self):
+        return "NEED_DATA"
+
+
+NEED_DATA = NeedData()
+
+
+class Greeted():
+    """The client completed HELO or EHLO."""
+    __slots__ = ("esmtp",)
+
+    def __init__(self, esmtp):
+        self.esmtp = esmtp
+
+
+class DataStarted():
+    """The envelope is complete and message data follows (DATA, or the first BDAT chunk)."""
+    __slots__ = ()
+
+
+class Message():
+    """An accepted message, ready to be stored or relayed."""
+    __slots__ = ("sender", "recipients", "forward_domains", "text")
+
+    def __init__(self, sender, recipients, forward_domains, text):
+        self.sender = sender
+        self.recipients = recipients
+        self.forward_domains = forward_domains
+        self.text = text
+
+
+class DataFinished():
+    """Message data ended; message is None if it was refused for its size."""
+    __slots__ = ("message",)
+
+    def __init__(self, message):
+        self.message = message
+
+
+class Closed():
+    """QUIT was answered, or the client went away; the driver closes the connection."""
+    __slots__ = ()
+
+
+class ServerProtocol():
+    """The server side of SMTP, with no I/O.
+
+    Pass what the client sent to receive_data() (b"" once it closes) and call
+    next_event() until it returns NEED_DATA. Replies collect meanwhile and are taken
+    with take_replies(); a driver sends them before it reads again, and before it
+    stores a message, so pipelined replies leave together.
+
+    HELO sessions keep the original exchange: a whole transaction gets one reply,
+    and an error drops the rest of the input received so far. RSET, NOOP and VRFY
+    are the exception and are answered wherever they come.
+    """
+
+    def __init__(self, replies, max_size=MAX_MESSAGE_SIZE, session=None):
+        self.replies = replies
+        self.max_size = max_size
+        self.parser = Parser()
+        self.session = session if session is not None else Session()
+        self.legacy = False
+        self.reading = COMMAND
+        self.eof = False
+        self.closed = False
+        self.data_pieces = []
+        self.data_size = 0
+        self.chunk = None
+        self.chunk_filled = 0
+        self.chunk_last = False
+        # Bytes of a refused BDAT chunk still to be dropped
+        self.skipping = 0
+        # Input after session.pos already searched for a newline
+        self.scanned = 0
+        # The rest of an over-long command line is dropped up to its newline
+        self.long_line = False
+        # Message data was taken up to the middle of a line
+        self.mid_line = False
+
+    @property
+    def phase(self):
+        """Which read deadline applies to the next read: greeting, command or data."""
+        if self.reading != COMMAND:
+            return "data"
+        return "greeting" if self.session.state == INIT else "command"
+
+    def receive_data(self, data):
+        """Appends data (bytes, or a memoryview of the driver's read buffer) to the input.
+
+        The input is one bytearray per session. Parsed bytes are dropped from its front,
+        which bytearray does without moving the rest, and new ones are appended in place,
+        so a read no longer builds a new bytes object holding everything unparsed.
+        """
+        session = self.session
+        if not data:
+            self.eof = True
+            return
+        if self.reading == CHUNK and session.pos == len(session.buffer):
+            # Straight into the chunk, without going through the buffer
+            data = data[self.fill_chunk(data):]
+            session.discard_input()
+        if session.pos:
+            del session.buffer[:session.pos]
+            session.pos = 0
+        session.buffer += data
+
+    def pending_chunk(self):
+        """Writable view of the rest of the BDAT chunk being read, for recv_into, or None."""
+        if self.reading != CHUNK or self.session.pos != len(self.session.buffer):
+            return None
+        if self.chunk is None:
+            return memoryview(SKIP_BUFFER)[:min(len(SKIP_BUFFER), self.skipping)]
+        return memoryview(self.chunk)[self.chunk_filled:]
+
+    def chunk_received(self, nbytes):
+        """Records nbytes written into the view from pending_chunk()."""
+        if self.chunk is None:
+            self.skipping -= nbytes
+        else:
+            self.chunk_filled += nbytes
+
+    def fill_chunk(self, data):
+        """Moves the start of data into the chunk being read, or drops it for a refused
+        chunk; returns how many bytes were taken."""
+        if self.chunk is None:
+            take = min(len(data), self.skipping)
+            self.skipping -= take
+            return take
+        take = min(len(data), len(self.chunk) - self.chunk_filled)
+        self.chunk[self.chunk_filled:self.chunk_filled + take] = memoryview(data)[:take]
+        self.chunk_filled += take
+        return take
+
+    def take_replies(self):
+        replies = self.session.outbox
+        self.session.outbox = []
+        return replies
+
+    def data_to_send(self):
+        return b"".join(self.take_replies())
+
+    def next_event(self):
+        while True:
+            if self.closed:
+                return Closed()
+            if self.reading == COMMAND:
+                event = self.next_command()
+            elif self.reading == MESSAGE:
+                event = self.read_message()
+            else:
+                event = self.read_chunk()
+            if event is NEED_DATA and self.eof:
+                self.closed = True
+                continue
+            if event is not None:
+                return event
+
+    def reply(self, reply):
+        self.session.outbox.append(reply if isinstance(reply, bytes) else reply.encode())
+
+    def which_cmd(self, sentence):
+        """Determines if sentence is a valid cmd, and if syntax correct."""
+        # Every verb is four letters, so only the one parser that can match is run
+        command = COMMANDS.get(sentence[:4])
+        if command is None:
+            raise SyntaxError500()  # Invalid command
+        cmd, parse = command
+        code = parse(self.parser, sentence)
+        if code == 500:
+            raise SyntaxError500()
+        return (cmd, code != 501)
+
+    def next_command(self):
+        """Parses the next whole command line. A line over MAX_COMMAND_LINE is answered
+        with 500 as soon as it is that long and dropped as it arrives, so input waiting
+        for a newline stays bounded, and each byte is searched for one only once."""
+        session = self.session
+        end = session.buffer.find(b"\n", session.pos + self.scanned)
+        if end == -1:
+            self.scanned = len(session.buffer) - session.pos
+            if self.scanned >= MAX_COMMAND_LINE or self.long_line:
+                self.scanned = 0
+                session.discard_input()
+                self.refuse_line()
+            return NEED_DATA
+        self.scanned = 0
+        if self.long_line or end + 1 - session.pos > MAX_COMMAND_LINE:
+            session.pos = end + 1
+            self.refuse_line()
+            self.long_line = False
+            return None
+        line = session.buffer[session.pos:end + 1]
+        session.pos = end + 1
+        # 8BITMIME bodies need not be UTF-8; undecodable bytes survive as surrogates
+        session.sentence = line.decode("utf-8", "surrogateescape")
+        if session.state == INIT:
+            return self.handshake_command()
+        if self.legacy:
+            return self.legacy_command()
+        return self.esmtp_command()
+
+    def handshake_command(self):
+        session = self.session
+        try:
+            cmd, syntax_correct = self.which_cmd(session.sentence)
+        except SyntaxError500:
+            self.reply(self.replies.error_500)
+            return None
+        if cmd == "quit":
+            return self.quit()
+        elif cmd in SESSION_COMMANDS:
+            if syntax_correct == False:
+                self.reply(self.replies.error_501)
+            else:
+                self.reply(self.session_reply(cmd))
+        elif syntax_correct == False and (cmd == "helo" or cmd == "ehlo"):
+            self.reply(self.replies.error_501)
+        elif session.advance(cmd) == OUT_OF_SEQUENCE:
+            self.reply(self.replies.error_503)
+        else:
+            session.esmtp = cmd == "ehlo"
+            self.legacy = not session.esmtp
+            self.reply(self.hello_reply(session.sentence))
+            return Greeted(session.esmtp)
+        return None
+
+    def legacy_command(self):
+        """One command of a HELO session, which only replies at the end of a transaction."""
+        session = self.session
+        try:
+            cmd, syntax_correct = self.which_cmd(session.sentence)  # Will raise 500 error is cmd invalid
+            if cmd == "quit":
+                return self.quit()
+            if cmd in SESSION_COMMANDS:
+                # Valid at any point (RFC 5321 4.1.4); RSET drops the transaction in progress
+                if syntax_correct == False:
+                    raise SyntaxError501()
+                self.reply(self.session_reply(cmd))
+                return None
+            if cmd not in ENVELOPE_COMMANDS or session.advance(cmd) == OUT_OF_SEQUENCE:
+                raise OrderError503()
+            if cmd == "data":
+                return self.start_data()
+            if syntax_correct == False or (cmd == "mail_from" and self.parser.params):
+                raise SyntaxError501()  # MAIL FROM parameters need EHLO
+            self.envelope_command(cmd)
+        except SyntaxError500:
+            self.refuse(self.replies.error_500)
+        except OrderError503:
+            self.refuse(self.replies.error_503)
+        except SyntaxError501:
+            self.refuse(self.replies.error_501)
+        return None
+
+    def refuse_line(self):
+        """Answers an over-long command line once, however many reads it spans."""
+        if self.long_line:
+            return
+        self.long_line = True
+        if self.legacy:
+            self.refuse(self.replies.line_too_long)
+        else:
+            self.reply(self.replies.line_too_long)
+
+    def refuse(self, reply):
+        """Drops a rejected HELO transaction and what is left of its input, so it gets a single reply."""
+        self.reply(reply)
+        self.session.discard_input()
+        self.session.reset()
+
+    def esmtp_command(self):
+        """One command of an EHLO session: every command gets its own reply, in order, so
+        clients may pipeline MAIL, RCPT and DATA (RFC 2920) and declare SIZE up front."""
+        session = self.session
+        try:
+            cmd, syntax_correct = self.which_cmd(session.sentence)
+        except SyntaxError500:
+            self.reply(self.replies.error_500)
+            return None
+
+        if cmd == "quit":
+            return self.quit()
+        elif syntax_correct == False:
+            self.reply(self.replies.error_501)
+            return None
+        elif cmd in SESSION_COMMANDS:
+            self.reply(self.session_reply(cmd))
+            return None
+        elif cmd == "bdat":
+            return self.start_chunk()
+
+        code = session.advance(cmd)
+        if code == OUT_OF_SEQUENCE:
+            self.reply(self.replies.error_503)
+        elif cmd == "helo" or cmd == "ehlo":
+            session.esmtp = cmd == "ehlo"
+            self.reply(self.hello_reply(session.sentence))
+        elif cmd == "mail_from":
+            error = self.check_mail_parameters()
+            if error:
+                session.reset()
+                self.reply(error)
+                return None
+            self.envelope_command(cmd)
+            self.reply(self.replies.codes[code])
+        elif cmd == "rcpt_to":
+            self.envelope_command(cmd)
+            self.reply(self.replies.codes[code])
+        elif cmd == "data":
+            return self.start_data()
+        return None
+
+    def quit(self):
+        self.reply(self.replies.closing)
+        self.closed = True
+        return Closed()
+
+    def session_reply(self, cmd):
+        """Carries out RSET, NOOP or VRFY, which are valid at any point of a session."""
+        # RSET drops only the transaction; the greeting and buffered input stay
+        return self.replies.codes[self.session.advance(cmd)]
+
+    def hello_reply(self, greeting):
+        """250 reply to HELO, or the multi-line capability list for EHLO."""
+        client_name = greeting.rstrip("\r\n").strip(" ")[4:].strip(" ")
+        if self.session.esmtp:
+            return f"250-{self.replies.hostname} Hello {client_name}\n".encode() + self.replies.capabilities
+        return f"250 Hello {client_name} pleased to meet you\n"
+
+    def check_mail_parameters(self):
+        """Returns the error reply for unacceptable MAIL FROM parameters, or None."""
+        for keyword, value in self.parser.params:
+            if keyword == "SIZE":
+                if value is None or not value.isdigit():
+                    return self.replies.error_501
+                if int(value) > self.max_size:
+                    # Refused before any of the message is sent
+                    return self.replies.error_552
+            elif keyword == "BODY":
+                if value is None or value.upper() not in ("7BIT", "8BITMIME"):
+                    return self.replies.error_501
+            else:
+                return self.replies.error_555
+        return None
+
+    def envelope_command(self, cmd):
+        session = self.session
+        address = re.search(EMAIL_REGEX, session.sentence).group().strip("<").strip(">")
+        if cmd == "mail_from":
+            session.envelope_start = time.perf_counter()
+            session.sender = address
+        else:
+            session.add_recipient(address)
+
+    def start_data(self):
+        self.reading = MESSAGE
+        self.data_pieces = []
+        self.data_size = 0
+        self.mid_line = False
+        if not self.legacy:
+            self.reply(self.replies.codes[354])
+        return DataStarted()
+
+    def read_message(self):
+        """Takes message data up to the lone "." line, removing dot stuffing.
+
+        Each receive is searched for the end as a whole (Transparency.find_end), and lines
+        are only split once the message is complete. Everything received is taken at once,
+        unfinished lines included, except a line start that may still become the end line,
+        so input never piles up waiting for a newline and is not searched twice. A message
+        over max_size is still read to the end, dropping its data, then refused.
+        """
+        session = self.session
+        buffer, pos = session.buffer, session.pos
+        start = pos
+        if self.mid_line:
+            # The end line can only begin after the newline of the line taken in part
+            start = buffer.find(b"\n", pos)
+            start = -1 if start == -1 else start + 1
+        # The end line includes its newline, so an unfinished line can never match
+        end = find_end(buffer, start) if start != -1 else -1
+        if end == -1:
+            cut = len(buffer)
+            if start != -1:
+                line = max(start, buffer.rfind(b"\n", start) + 1)
+                if cut - line <= 2 and buffer.startswith(b".", line):
+                    cut = line
+                self.mid_line = line < cut
+            if cut == pos:
+                return NEED_DATA
+            block = buffer[pos:cut]
+            session.pos = cut
+        else:
+            block = buffer[pos:end]
+            session.pos = buffer.index(b"\n", end) + 1
+            self.mid_line = False
+        self.data_size += len(block)
+        if self.data_size <= self.max_size:
+            self.data_pieces.append(block)
+        elif self.data_pieces:
+            self.data_pieces = []
+        if end == -1:
+            return NEED_DATA
+
+        self.reading = COMMAND
+        body = b"".join(self.data_pieces)
+        self.data_pieces = []
+        if self.data_size > self.max_size:
+            return self.finish_message(None)
+        return self.finish_message(unstuff(body))
+
+    def delivery_failed(self):
+        """Turns the 250 for the message just finished into 451, for when it could not be
+        stored. Call it on DataFinished, before the replies are taken."""
+        self.session.outbox[-1] = self.replies.error_451
+
+    def start_chunk(self):
+        """Starts reading one BDAT chunk (RFC 3030). The chunk is always read, even when it
+        is refused, so the byte stream stays in step with the commands.
+
+        A chunk out of sequence, or one that would take the message past max_size, is
+        answered at once and its bytes are dropped as they arrive. Only an accepted chunk
+        gets a buffer of its size, so the size a client announces is bounded by max_size.
+        """
+        session = self.session
+        size = self.parser.chunk_size
+        first = session.state == RCPT
+        self.reading = CHUNK
+        self.chunk = None
+        self.chunk_filled = 0
+        self.chunk_last = self.parser.chunk_last
+        self.skipping = size
+        if session.advance("bdat") == OUT_OF_SEQUENCE:
+            self.reply(self.replies.error_503)
+            return None
+        if size > self.max_size - session.chunked_size:
+            # The transaction ends here; further chunks are out of sequence
+            self.reply(self.replies.error_552)
+            session.reset()
+            return None if first else DataFinished(None)
+        self.skipping = 0
+        self.chunk = bytearray(size)
+        return DataStarted() if first else None
+
+    def read_chunk(self):
+        session = self.session
+        if session.pos < len(session.buffer):
+            session.pos += self.fill_chunk(memoryview(session.buffer)[session.pos:])
+        if self.chunk is None:
+            if self.skipping:
+                return NEED_DATA
+            self.reading = COMMAND
+            return None
+        if self.chunk_filled < len(self.chunk):
+            return NEED_DATA
+
+        self.reading = COMMAND
+        chunk, size, last = self.chunk, len(self.chunk), self.chunk_last
+        self.chunk = None
+        session.chunked_size += size
+        session.chunks.append(chunk)
+        if not last:
+            self.reply(f"250 {size} octets received\n")
+            return None
+        return self.finish_message(b"".join(session.chunks))
+
+    def finish_message(self, body):
+        """Answers the end of message data; body is None when it outgrew max_size."""
+        session = self.session
+        message = None
+        if body is None:
+            self.reply(self.replies.error_552)
+        else:
+            # Split into the newline-terminated lines the delivery backends take
+            lines = body.decode("utf-8", "surrogateescape").split("\n")
+            tail = lines.pop()
+            session.text = [line + "\n" for line in lines] + ([tail] if tail else [])
+            message = Message(session.sender, session.recipients, session.forward_domains, session.text)
+            self.reply(self.replies.ok_250)
+        session.reset()
+        return DataFinished(message)
+
+
+def reply_code(reply):
+    """The code a server reply starts with, or 600 if it has none."""
+    try:
+        return int(reply[0:3])
+    except Exception:
+        return 600
+
+
+def is_error_code(code, expected=None):
+    """Whether code is an error: anything not in expected, or any 5xx without it."""
+    if expected:
+        return code not in expected
+    return code // 100 == 5
+
+
+class ClientProtocol():
+    """The client side of SMTP, with no I/O: frames replies and builds transactions.
+
+    Only servers that answered EHLO are framed this way; they end every reply line
+    with a newline, so several pipelined replies can arrive in one read.
+    """
+
+    def __init__(self, chunk_size=1024 * 1024):
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.lines = []
+        self.data = None
+        # MAIL plus the RCPT commands of the last transaction
+        self.envelope_size = 0
+
+    def receive_data(self, data):
+        self.buffer += data
+
+    def reset(self):
+        self.buffer = ""
+        self.lines = []
+
+    def next_reply(self):
+        """The next complete, possibly multi-line, reply, or None until more arrives."""
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.lines.append(line)
+            if line[3:4] != "-":
+                reply = "\n".join(self.lines)
+                self.lines = []
+                return reply
+        return None
+
+    def hello(self, name, esmtp=True):
+        return f"{'EHLO' if esmtp else 'HELO'} {name}\n"
+
+    def extensions(self, reply):
+        """The extensions offered in an EHLO reply, as {keyword: parameter or None}."""
+        extensions = {}
+        for line in reply.split("\n")[1:]:
+            keyword, _, parameter = line[4:].strip().partition(" ")
+            extensions[keyword.upper()] = parameter or None
+        return extensions
+
+    def transaction(self, envelope, content, extensions):
+        """The commands that send content (headers and body, no termination dot).
+
+        envelope holds the MAIL FROM and RCPT TO lines; extensions is None after HELO.
+        After HELO the result is a single string with the whole transaction. After EHLO
+        it is one command per expected reply: strings, and bytes for BDAT chunks when the
+        server offers CHUNKING. DATA is then followed by finish_data().
+        """
+        if extensions is None:
+            self.data = None
+            return [envelope + "DATA\n" + terminate(content)]
+
+        data = content.encode("utf-8", "surrogateescape")
+        params = ""
+        if "SIZE" in extensions:
+            params += f" SIZE={len(data)}"
+        if "8BITMIME" in extensions and not data.isascii():
+            params += " BODY=8BITMIME"
+        commands = envelope.splitlines(keepends=True)
+        commands[0] = commands[0].rstrip("\n") + params + "\n"
+        self.envelope_size = len(commands)
+
+        if "CHUNKING" in extensions:
+            # Length-prefixed chunks: no termination dot and nothing for the server to scan
+            self.data = None
+            view = memoryview(data)
+            for start in range(0, max(len(data), 1), self.chunk_size):
+                chunk = view[start:start + self.chunk_size]
+                last = " LAST" if start + self.chunk_size >= len(data) else ""
+                commands.append(f"BDAT {len(chunk)}{last}\n".encode() + chunk)
+        else:
+            self.data = data
+            commands.append("DATA\n")
+        return commands
+
+    def outcome(self, replies):
+        """Decides a transaction from the replies to its commands.
+
+        Returns (reply, data, rejected). rejected maps the position of each refused RCPT
+        (0 for the first) to its reply; the message still goes to the other recipients.
+        data is the dot-terminated message to send when DATA got 354, and reply is then
+        None: the server's reply to the data decides, and it must always be read.
+        Otherwise data is None and reply decides: the refused MAIL, the first refused
+        RCPT when every one was refused, or the first failing reply after them.
+        """
+        data, self.data = self.data, None
+        mail, recipients, rest = replies[0], replies[1:self.envelope_size], replies[self.envelope_size:]
+        rejected = {index: reply for index, reply in enumerate(recipients) if reply_code(reply) // 100 != 2}
+        if reply_code(mail) // 100 != 2:
+            return mail, None, rejected
+        if recipients and len(rejected) == len(recipients):
+            return rejected[0], None, rejected
+        if data is not None and reply_code(replies[-1]) == 354:
+            return None, terminate(data), rejected
+        for reply in rest:
+            if reply_code(reply) // 100 != 2:
+                return reply, None, rejected
+        return replies[-1], None, rejected
@@ -0,0 +1,313 @@
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from socket import create_connection
+
+from Client import Client
+from Protocol import reply_code
+
+RETRY_BASE = 30.0
+RETRY_MAX = 3600.0
+MAX_ATTEMPTS = 10
+IDLE_TIMEOUT = 0.5
+CONNECT_TIMEOUT = 10.0
+
+
+class RelayError(Exception):
+    """Delivery attempt failed; permanent errors are not retried."""
+
+    def __init__(self, msg, permanent=False):
+        self.msg = msg
+        self.permanent = permanent
+
+    def __str__(self):
+        return f"{self.msg}"
+
+
+class RelaySender(Client):
+    """Client that reuses one connection for several transactions to a relay host."""
+
+    def __init__(self, serverName, port):
+        super().__init__(serverName, port, check_arguments=False)
+        self.socket = None
+        self.extensions = None
+
+    def connect(self):
+        sock = self.socket_options.apply(create_connection((self.serverName, int(self.port)),
+                                                           timeout=CONNECT_TIMEOUT))
+        try:
+            self.expect(sock, self.socket_read(sock), 220)
+            self.extensions = self.greet(sock)
+        except Exception:
+            sock.close()
+            raise
+        self.socket = sock
+
+    def expect(self, sock, response, code):
+        got = self.extract_response_code(response)
+        if got != code:
+            raise RelayError(f"Expected {code}, got {response!r}", permanent=got // 100 == 5)
+
+    def send(self, sender, recipients, lines):
+        """Relays one message; returns the recipients the relay refused, as {address: reply}.
+
+        The message went to every other recipient. RelayError means it went to none.
+        """
+        if self.socket is None:
+            self.connect()
+        self.from_field = f"<{sender}>\n"
+        self.to_field = [f"<{rcpt}>\n" for rcpt in recipients]
+        reply = self.send_transaction(self.socket, self.extensions, "".join(lines))
+        try:
+            self.expect(self.socket, reply, 250)
+        except RelayError:
+            # Keep the connection for the next message if the relay accepts a reset
+            try:
+                reusable = self.reset(self.socket, self.extensions)
+            except Exception:
+                reusable = False
+            if not reusable:
+                self.close()
+            raise
+        return self.rejected
+
+    def close(self):
+        if self.socket is None:
+            return
+        try:
+            self.socket_write(self.socket, "QUIT\n")
+            self.socket_read(self.socket)
+        except Exception:
+            pass
+        self.socket.close()
+        self.socket = None
+
+
+class RelayQueue():
+    """Persistent outbound queue, one spool directory per destination domain.
+
+    route maps a domain to a (host, port) relay target, or None when there is
+    no route. Every queued message is a JSON file <root>/<domain>/<id>.json. Retries are
+    kept in a heap ordered by due time, and a pool of sender threads drains
+    it. Each thread keeps one RelaySender per relay host, so consecutive
+    messages reuse the connection. A sender claims a file by renaming it to
+    <id>.json.<pid>, so several processes can share one queue directory.
+    Failed attempts back off exponentially. After max_attempts, or on a 5xx
+    reply, the message moves to <root>/failed/.
+    """
+
+    def __init__(self, root, route, workers=4, retry_base=RETRY_BASE, retry_max=RETRY_MAX,
+                 max_attempts=MAX_ATTEMPTS):
+        self.root = root
+        self.route = route
+        self.workers = workers
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self.heap = []
+        self.cond = threading.Condition()
+        self.counter = itertools.count()
+        self.rng = random.Random()
+        self.threads = []
+        self.running = False
+        os.makedirs(os.path.join(root, "failed"), exist_ok=True)
+
+    def write_entry(self, path, entry):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.rename(tmp_path, path)
+
+    def enqueue(self, sender, domain, recipients, lines):
+        directory = os.path.join(self.root, domain)
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        path = os.path.join(directory, f"{now:.6f}-{os.getpid()}-{next(self.counter)}.json")
+        entry = {"sender": sender, "domain": domain, "recipients": recipients, "lines": lines,
+                 "attempts": 0, "next_attempt": now, "queued": now}
+        self.write_entry(path, entry)
+        self.schedule(now, path)
+        return path
+
+    def schedule(self, due, path):
+        with self.cond:
+            heapq.heappush(self.heap, (due, next(self.counter), path))
+            self.cond.notify()
+
+    def backoff(self, attempts):
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay * (0.5 + self.rng.random() / 2)
+
+    def load(self):
+        """Schedules queued messages left on disk, restoring claims of dead processes."""
+        for domain in os.listdir(self.root):
+            directory = os.path.join(self.root, domain)
+            if domain == "failed" or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if ".json." in name:
+                    base, _, pid = name.rpartition(".")
+                    if pid.isdigit() and not pid_alive(int(pid)):
+                        os.rename(path, os.path.join(directory, base))
+                        path = os.path.join(directory, base)
+                    else:
+                        continue
+                if not path.endswith(".json"):
+                    continue
+                try:
+                    with open(path) as f:
+                        due = json.load(f)["next_attempt"]
+                except (OSError, ValueError, KeyError):
+                    continue
+                self.schedule(due, path)
+
+    def start(self):
+        self.running = True
+        self.load()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap)
+
+    def next_due(self, timeout):
+        """Waits up to timeout seconds for a due entry; returns its path or None."""
+        with self.cond:
+            deadline = time.monotonic() + timeout
+            while self.running:
+                now = time.time()
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    return None
+                if self.heap:
+                    wait = min(wait, self.heap[0][0] - now)
+                self.cond.wait(wait)
+            return None
+
+    def worker(self):
+        senders = {}
+        while self.running:
+            # Connections stay open only while due work keeps arriving, so an
+            # idle sender never holds a session on a remote that serves one at a time
+            path = self.next_due(timeout=IDLE_TIMEOUT if senders else 1.0)
+            if path is None:
+                for sender in senders.values():
+                    sender.close()
+                senders = {}
+                continue
+            self.attempt(path, senders)
+        for sender in senders.values():
+            sender.close()
+
+    def attempt(self, path, senders):
+        claimed = f"{path}.{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return  # another process took it
+        try:
+            with open(claimed) as f:
+                entry = json.load(f)
+            domain = entry["domain"]
+        except (OSError, ValueError, KeyError) as e:
+            # Corrupt or truncated: set aside, so the worker goes on and nothing stays claimed
+            self.set_aside(claimed, os.path.basename(path), e)
+            return
+
+        target = self.route(domain)
+        sender = senders.get(target)
+        if sender is None and target is not None:
+            sender = senders[target] = RelaySender(*target)
+        try:
+            if target is None:
+                raise RelayError(f"No route to {domain}", permanent=True)
+            try:
+                rejected = sender.send(entry["sender"], entry["recipients"], entry["lines"])
+            except RelayError:
+                raise
+            except Exception:
+                # A reused connection may have been closed by the peer: retry once on a fresh one
+                sender.close()
+                rejected = sender.send(entry["sender"], entry["recipients"], entry["lines"])
+        except Exception as e:
+            if sender is not None and not isinstance(e, RelayError):
+                sender.close()
+            self.retry(path, claimed, entry, e)
+            return
+        if rejected:
+            self.retry_rejected(path, claimed, entry, rejected)
+            return
+        os.remove(claimed)
+
+    def set_aside(self, claimed, name, error):
+        """Moves a queue entry that cannot be read to failed/ as it is."""
+        try:
+            os.rename(claimed, os.path.join(self.root, "failed", name))
+        except OSError:
+            pass
+        print(f"ERROR - cannot read queued message {name}, moved to failed/: {error!r}")
+
+    def retry(self, path, claimed, entry, error):
+        """Schedules the claimed entry again with backoff, or moves it to failed/ after a
+        permanent error or max_attempts."""
+        entry["attempts"] += 1
+        entry["last_error"] = str(error)
+        if (isinstance(error, RelayError) and error.permanent) or entry["attempts"] >= self.max_attempts:
+            self.write_entry(os.path.join(self.root, "failed", os.path.basename(path)), entry)
+            os.remove(claimed)
+            print(f"ERROR - giving up relaying {os.path.basename(path)} to {entry['domain']}: {error}")
+            return
+        entry["next_attempt"] = time.time() + self.backoff(entry["attempts"])
+        self.write_entry(claimed, entry)
+        os.rename(claimed, path)
+        self.schedule(entry["next_attempt"], path)
+
+    def retry_rejected(self, path, claimed, entry, rejected):
+        """After a delivery some recipients refused: those refused for good (5xx) go to
+        failed/, and only the ones refused for now (4xx) are tried again."""
+        permanent = [rcpt for rcpt in entry["recipients"] if reply_code(rejected.get(rcpt, "250")) // 100 == 5]
+        temporary = [rcpt for rcpt in entry["recipients"] if rcpt in rejected and rcpt not in permanent]
+        if permanent:
+            failed = dict(entry, recipients=permanent, last_error=rejected[permanent[0]])
+            name = f"{os.path.basename(path)[:-len('.json')]}-{entry['attempts']}.json"
+            self.write_entry(os.path.join(self.root, "failed", name), failed)
+            print(f"ERROR - {len(permanent)} recipient(s) of {os.path.basename(path)} refused: {failed['last_error']}")
+        if not temporary:
+            os.remove(claimed)
+            return
+        entry["recipients"] = temporary
+        self.retry(path, claimed, entry, RelayError(rejected[temporary[0]]))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def parse_target(value):
+    """Parses host:port."""
+    host, _, port = value.rpartition(":")
+    return (host or "127.0.0.1", int(port))
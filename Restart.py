@@ -0,0 +1,41 @@
+"""Zero-downtime restart: a new server process takes over the listening sockets.
+
+On SIGHUP the running server starts its successor with the same command
+line plus --listen-fd, passing its listening sockets down as inherited file
+descriptors. Both processes then share the same accept queues. A client
+that connects during the switch waits in the queue until one of them
+accepts it, so it is never refused or reset. The old process then drains
+(see Server.drain) and exits.
+"""
+import os
+import subprocess
+import sys
+from socket import socket
+
+LISTEN_FD_FLAG = "--listen-fd"
+
+
+def restart_command(argv=None):
+    """The command line that started this process, without any --listen-fd."""
+    argv = list(sys.argv if argv is None else argv)
+    command = [sys.executable, os.path.abspath(argv[0])]
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == LISTEN_FD_FLAG:
+            next(args, None)
+        elif not arg.startswith(LISTEN_FD_FLAG + "="):
+            command.append(arg)
+    return command
+
+
+def spawn_successor(command, listeners):
+    """Starts command with the listeners inherited; returns the Popen."""
+    fds = [listener.fileno() for listener in listeners]
+    for fd in fds:
+        os.set_inheritable(fd, True)
+    return subprocess.Popen([*command, LISTEN_FD_FLAG, ",".join(str(fd) for fd in fds)], pass_fds=fds)
+
+
+def inherited_listeners(value):
+    """Listening sockets from a --listen-fd value (comma-separated descriptors)."""
+    return [socket(fileno=int(fd)) for fd in value.split(",")]
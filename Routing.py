@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from Relay import parse_target
+
+CACHE_SIZE = 10000
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class RouteTable():
+    """Domain to relay host:port rules, indexed by reversed domain labels.
+
+    Rules are "pattern host:port" lines. A pattern is an exact domain
+    ("example.com"), a suffix wildcard ("*.example.com", any subdomain but not
+    example.com itself) or "*" as the default route. Blank lines and "#"
+    comments are ignored. Lookup walks one trie node per label, so its cost
+    depends on the domain depth and not on the number of rules. The most
+    specific match wins: exact, then the longest wildcard suffix.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.default = None
+        self.rules = 0
+
+    def add(self, pattern, target):
+        pattern = pattern.lower().rstrip(".")
+        if pattern == "*":
+            self.default = target
+            self.rules += 1
+            return
+        wildcard = pattern.startswith("*.")
+        if wildcard:
+            pattern = pattern[2:]
+        node = self.root
+        for label in reversed(pattern.split(".")):
+            node = node.setdefault(label, {})
+        # Non-label keys cannot collide with labels, which never contain spaces
+        node[" *" if wildcard else " ="] = target
+        self.rules += 1
+
+    def lookup(self, domain):
+        labels = domain.lower().rstrip(".").split(".")
+        node = self.root
+        best = self.default
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return best
+            # A wildcard matches only when labels remain below this node
+            if i > 0 and " *" in node:
+                best = node[" *"]
+        return node.get(" =", best)
+
+    @classmethod
+    def parse(cls, text):
+        table = cls()
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                pattern, target = line.split()
+                table.add(pattern, parse_target(target))
+            except ValueError:
+                raise ValueError(f"Invalid route on line {number}: {line!r}")
+        return table
+
+
+class Router():
+    """Loads a RouteTable from a file, reloads it when the file changes, caches lookups.
+
+    The file's mtime is checked at most once per check_interval during
+    resolve(). A reload that fails to parse keeps the previous table.
+    Resolved routes go into a bounded LRU, which is cleared on reload.
+    fallback is returned for domains no rule matches.
+    """
+
+    def __init__(self, path, fallback=None, cache_size=CACHE_SIZE, check_interval=RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.fallback = fallback
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.next_check = 0
+        self.table = RouteTable()
+        self.reload()
+
+    def reload(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path) as f:
+            table = RouteTable.parse(f.read())
+        with self.lock:
+            self.table = table
+            self.mtime = mtime
+            self.cache.clear()
+
+    def check_reload(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.check_interval
+        try:
+            if os.stat(self.path).st_mtime_ns != self.mtime:
+                self.reload()
+        except (OSError, ValueError) as e:
+            print(f"ERROR - keeping previous routes, cannot reload {self.path}: {e}")
+
+    def resolve(self, domain):
+        """Returns (host, port) for domain, or fallback when no rule matches."""
+        self.check_reload()
+        with self.lock:
+            target = self.cache.get(domain)
+            if target is not None:
+                self.cache.move_to_end(domain)
+                return target
+            target = self.table.lookup(domain) or self.fallback
+            if target is not None:
+                self.cache[domain] = target
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            return target
+
+    __call__ = resolve
@@ -1,29 +1,36 @@
-import sys
-import re
+import time
 import os
+import argparse
+import signal
 from socket import *
 
-ERROR_500 = "500 Syntax error: command unrecognized"
-ERROR_501 = "501 Syntax error in parameters or arguments"
-ERROR_503 = "503 Bad sequence of commands"
-OK_250 = "250 OK"
-OK_354 = "354 Start mail input; end with <CRLF>.<CRLF>"
+from Admission import TRACKED_IPS, Admission
+from Buffers import BufferPool
+from Delivery import BACKENDS, FORWARD_DIR, DedupBackend
+from EventLoop import EventLoop
+from Mailbox import COMPRESSION_SUFFIXES
+from Metrics import Metrics, start_metrics_server
+from Prefork import Supervisor
+from Profiler import SessionProfiler
+from Protocol import (MAX_MESSAGE_SIZE, NEED_DATA, Closed, DataFinished, DataStarted, Greeted, ReplyTable,
+                      ServerProtocol)
+from Relay import RETRY_BASE, RelayQueue, parse_target
+from Restart import LISTEN_FD_FLAG, inherited_listeners, restart_command, spawn_successor
+from Routing import Router
+from Sockets import SocketOptions, send_buffers
+from Timeouts import (COMMAND_TIMEOUT, DATA_TIMEOUT, GREETING_TIMEOUT, SESSION_TIMEOUT, SessionTimeout,
+                      Timeouts)
+
+LISTEN_BACKLOG = 128
+# blocking serves one connection at a time; selectors multiplexes them all on one thread
+IO_MODES = ("blocking", "selectors")
+# Bytes asked for per read: commands are short, message data comes in bulk
+COMMAND_READ_SIZE = 4096
+DATA_READ_SIZE = 65536
+# Seconds sessions in progress get to finish after SIGTERM or SIGHUP
+DRAIN_TIMEOUT = 30.0
 
 
-class ParseError(Exception):
-    """Responsible for reporting out-of-place characters in 501 errors."""
-
-    def __init__(self, msg, char, pos, *args):
-        self.msg = msg
-        self.args = args
-        self.char = char
-        self.pos = pos
-
-    def __str__(self):
-        # return f"ERROR -- {self.msg} at pos {self.pos} next char {self.char}, ord {ord(self.char)}"
-        return f"{self.msg}"
-    
-
 class SocketError(Exception):
     def __init__(self, msg="Error during socket operation"):
         self.msg = msg
@@ -39,39 +46,6 @@ class EOFReceivedError(Exception):
     def __str__(self):
         return f"{self.msg}"
 
-class QUITError(Exception):
-    "Closes connectionSocket when receiving QUIT command"
-    def __init__(self, msg="Receiving QUIT command"):
-        self.msg = msg
-    
-    def __str__(self):
-        return f"{self.msg}"
-    
-
-class SyntaxError500(Exception):
-    def __init__(self):
-        self.msg = "500 Syntax error: command unrecognized"
-
-    def __str__(self):
-        return f"{self.msg}"
-
-
-class SyntaxError501(Exception):
-    def __init__(self):
-        self.msg = "501 Syntax error in parameters or arguments"
-
-    def __str__(self):
-        return f"{self.msg}"
-
-
-class OrderError503(Exception):
-    def __init__(self):
-        self.msg = "503 Bad sequence of commands"
-
-    def __str__(self):
-        return f"{self.msg}"
-
-
 class HaltError(Exception):
     """Responsible for halting program if keyboard interrupt or EOF."""
 
@@ -82,695 +56,418 @@ class HaltError(Exception):
         return f"{self.msg}"
 
 
-class EOFInDATAError(Exception):
-    """Error for handling EOF error in DATA command."""
-
-    def __init__(self):
-        self.msg = "EOF error in DATA command."
-
-    def __str__(self):
-        return f"{self.msg}"
-
-
-class Parser():
-    def __init__(self):
-        self.sentence = None
-        self.next_pos = -1
-        self.next_char = None
-
-    def flush(self):
-        self.sentence = None
-        self.next_pos = -1
-        self.next_char = None
-
-    def increment(self):
-        self.next_pos += 1
-        try:
-            self.next_char = self.sentence[self.next_pos]
-        except:
-            self.next_char = None
-
-    def parse_mail_from(self, sentence):
-        self.sentence = sentence
-        self.increment()
-        try:
-            self.mail_from_cmd()
-            self.flush()
-            return 250
-        except SyntaxError500 as e:
-            self.flush()
-            return 500
-        except SyntaxError501 as e:
-            self.flush()
-            return 501
-
-    def parse_rcpt_to(self, sentence):
-        self.sentence = sentence
-        self.increment()
-        try:
-            self.rcpt_to_cmd()
-            self.flush()
-            return 250
-        except SyntaxError500 as e:
-            self.flush()
-            return 500
-        except SyntaxError501 as e:
-            self.flush()
-            return 501
-
-    def parse_data(self, sentence):
-        self.sentence = sentence
-        self.increment()
-        try:
-            self.data_cmd()
-            self.flush()
-            return 354
-        except SyntaxError500 as e:
-            self.flush()
-            return 500
-        
-    def parse_quit(self, sentence):
-        self.sentence = sentence
-        self.increment()
-        try:
-            self.quit_cmd()
-            self.flush()
-            return 250
-        except SyntaxError500 as e:
-            self.flush()
-            return 500
-
-    def parse_data_end(self, sentence):
-        """Checks if sentence is data termination sequence."""
-        self.sentence = sentence
-        self.increment()
-        try:
-            self.data_end_cmd()
-            self.flush()
-            return True
-        except SyntaxError500 as e:
-            self.flush()
-            return False
-        
-    def parse_helo(self, sentence):
-        """Checks if sentence is helo command."""
-        self.sentence = sentence
-        self.increment()
-        try:
-            self.helo_cmd()
-            self.flush()
-            return 250
-        except SyntaxError500 as e:
-            self.flush()
-            return 500
-        except SyntaxError501 as e:
-            self.flush()
-            return 501
-
-    def mail_from_cmd(self):
-        if self.next_char != "M":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "A":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "I":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "L":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.whitespace()
-        except ParseError:
-            raise SyntaxError500()
-
-        if self.next_char != "F":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "R":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "O":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "M":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != ":":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.nullspace()
-            self.reverse_path()
-            self.nullspace()
-            self.crlf()
-        except ParseError:
-            raise SyntaxError501()
-
-    def rcpt_to_cmd(self):
-        if self.next_char != "R":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "C":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "P":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "T":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.whitespace()
-        except ParseError:
-            raise SyntaxError500()
-
-        if self.next_char != "T":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "O":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != ":":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.nullspace()
-            self.forward_path()
-            self.nullspace()
-            self.crlf()
-        except ParseError:
-            raise SyntaxError501()
-
-    def data_cmd(self):
-        if self.next_char != "D":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "A":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "T":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "A":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.nullspace()
-            self.crlf()
-        except ParseError:
-            raise SyntaxError500()
-        
-    def quit_cmd(self):
-        if self.next_char != "Q":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "U":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "I":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "T":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.nullspace()
-            self.crlf()
-        except ParseError:
-            raise SyntaxError500()
-        
-    def helo_cmd(self):
-        if self.next_char != "H":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "E":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "L":
-            raise SyntaxError500()
-        self.increment()
-        if self.next_char != "O":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.whitespace()
-            self.domain()
-            self.nullspace()
-            self.crlf()
-        except ParseError:
-            raise SyntaxError501()
-
-    def data_end_cmd(self):
-        if self.next_char != ".":
-            raise SyntaxError500()
-        self.increment()
-
-        try:
-            self.crlf()
-        except ParseError:
-            raise SyntaxError500()
-
-    def whitespace(self):
-        try:
-            self.sp()
-        except ParseError:
-            raise ParseError(msg="whitespace", pos=self.next_pos, char=self.next_char)
-
-        try:
-            self.whitespace()
-        except ParseError:
-            pass
-
-    def sp(self):
-        if self.next_char == " " or self.next_char == "\t":
-            self.increment()
-        else:
-            raise ParseError(msg="sp", pos=self.next_pos, char=self.next_char)
-
-    def nullspace(self):
-        self.null()
-        try:
-            self.whitespace()
-        except ParseError:
-            pass
-
-    def null(self):
-        return
-
-    def reverse_path(self):
-        self.path()
-
-    def forward_path(self):
-        self.path()
-
-    def path(self):
-        if self.next_char != "<":
-            raise ParseError(msg="path", pos=self.next_pos, char=self.next_char)
-        self.increment()
-
-        self.mailbox()
-
-        if self.next_char != ">":
-            raise ParseError(msg="path", pos=self.next_pos, char=self.next_char)
-        self.increment()
-
-    def mailbox(self):
-        self.local_part()
-
-        if self.next_char != "@":
-            raise ParseError(msg="mailbox", pos=self.next_pos, char=self.next_char)
-        self.increment()
-
-        self.domain()
-
-    def local_part(self):
-        self.string()
-
-    def string(self):
-        try:
-            self.char()
-        except ParseError:
-            raise ParseError(msg="string", pos=self.next_pos, char=self.next_char)
-
-        try:
-            self.string()
-        except ParseError:
-            pass
-
-    def char(self):
-        EXCLUDED_ASCII = [60, 62, 40, 41, 91, 93, 92, 46, 44, 59, 58, 64, 34, 32, 9]
-        ascii_num = ord(self.next_char)
-        if 32 <= ascii_num and ascii_num <= 126 and ascii_num not in EXCLUDED_ASCII:
-            self.increment()
-        else:
-            raise ParseError(msg="char", pos=self.next_pos, char=self.next_char)
-
-    def domain(self):
-        self.element()
-
-        if self.next_char == ".":
-            self.increment()
-            self.domain()
-
-    def element(self):
-        try:
-            self.letter()
-        except ParseError:
-            raise ParseError(msg="element", pos=self.next_pos, char=self.next_char)
-
-        try:
-            self.let_dig_str()
-        except ParseError:
-            pass
-
-    def name(self):
-        try:
-            self.letter()
-        except ParseError:
-            raise ParseError(msg="name", pos=self.next_pos, char=self.next_char)
-
-        self.let_dig_str()
-
-    def letter(self):
-        if self.next_char.isalpha() or self.next_char.isdigit():
-            self.increment()
-        else:
-            raise ParseError(msg="letter", pos=self.next_pos, char=self.next_char)
-
-    def let_dig_str(self):
-        self.let_dig()
-
-        try:
-            self.let_dig_str()
-        except ParseError:
-            pass
-
-    def let_dig(self):
-        try:
-            self.letter()
-        except ParseError:
-            try:
-                self.digit()
-            except ParseError:
-                raise ParseError(msg="let-dig", pos=self.next_pos, char=self.next_char)
-
-    def digit(self):
-        if self.next_char.isdigit():
-            self.increment()
-        else:
-            raise ParseError(msg="digit", char=self.next_char, pos=self.next_pos)
-
-    def crlf(self):
-        if self.next_char == "\n" or self.next_char == "\r":
-            self.increment()
-        else:
-            raise ParseError(msg="CRLF", char=self.next_char, pos=self.next_pos)
-
-    def special(self):
-        if self.next_char in '<>()[]\\.,;:@"':
-            self.increment()
-        else:
-            raise ParseError(msg="special", char=self.next_char, pos=self.next_pos)
-
-
 class Server():
-    def __init__(self, port):
-        self.parser = Parser()
-        self.EMAIL_REGEX = "<.+>"
+    def __init__(self, port, metrics_port=None, profile_dir="profiles", profile_sessions=10, backend="mbox",
+                 compression=None, compression_level=None, dedup=False, relay=None, relay_workers=4,
+                 relay_retry_base=RETRY_BASE, routes=None, timeouts=None,
+                 admission=None, max_size=MAX_MESSAGE_SIZE, io="blocking", socket_options=None,
+                 read_sizes=None, drain_timeout=DRAIN_TIMEOUT):
+        self.backend = BACKENDS[backend](compression=compression, level=compression_level)
+        if dedup:
+            self.backend = DedupBackend(self.backend)
+        self.relay = None
+        if relay or routes:
+            target = parse_target(relay) if relay else None
+            # --relay alone sends everything to one host; with --routes it is the fallback
+            route = Router(routes, fallback=target) if routes else (lambda domain: target)
+            self.relay = RelayQueue(os.path.join(FORWARD_DIR, ".queue"), route=route,
+                                    workers=relay_workers, retry_base=relay_retry_base)
+        self.metrics = Metrics()
+        self.metrics_port = metrics_port
+        self.profiler = SessionProfiler(profile_dir, profile_sessions)
+        self.timeouts = timeouts or Timeouts()
+        self.admission = admission
         self.serverPort = int(port)
         self.hostname = gethostname()
-        self.received_text = None
-        self.curr_index = 0
-
-        self.text = []
-        self.forward_domains = []
-        self.sentence = None
-
-    def reset(self):
-        self.received_text = None
-        self.curr_index = 0
-        self.text = []
-        self.forward_domains = []
-        self.sentence = None
-
-    def extract_domain(self):
-        """Extracts domain from RCPT to command"""
-        match = re.search(self.EMAIL_REGEX, self.sentence)
-        domain = match.group().strip("<").strip(">").split("@")[-1]
-        return domain
-
-    def write_to_files(self):
-        for domain in self.forward_domains:
-            file_name = domain.strip("\n")
-            with open(f"{os.path.dirname(os.path.realpath(__file__))}/forward/{file_name}", "a") as f:
-                f.writelines(self.text)
-
-    def which_cmd(self, sentence=None):
-        """Determines if .sentence is a valid cmd, and if syntax correct."""
-        if not sentence:
-            sentence = self.sentence
-
-        cmd = None
-        syntax_correct = None
-
-        mail_from_code = self.parser.parse_mail_from(sentence)
-        rcpt_to_code = self.parser.parse_rcpt_to(sentence)
-        data_code = self.parser.parse_data(sentence)
-        helo_code = self.parser.parse_helo(sentence)
-        quit_code = self.parser.parse_quit(sentence)
-
-        if mail_from_code == 250 or mail_from_code == 501:
-            cmd = "mail_from"
-            syntax_correct = False if mail_from_code == 501 else True
-        elif rcpt_to_code == 250 or rcpt_to_code == 501:
-            cmd = "rcpt_to"
-            syntax_correct = False if rcpt_to_code == 501 else True
-        elif data_code == 354 or data_code == 501:
-            cmd = "data"
-            syntax_correct = False if data_code == 501 else True
-        elif quit_code == 250 or quit_code == 501:
-            cmd = "quit"
-            syntax_correct == False if quit_code == 501 else True
-        elif helo_code == 250 or helo_code == 501:
-            cmd = "helo"
-            syntax_correct = False if helo_code == 501 else True
-        else:
-            raise SyntaxError500()  # Invalid command
-        return (cmd, syntax_correct)
-    
-    def socket_read(self, socket):
+        self.max_size = max_size
+        self.replies = ReplyTable(self.hostname, max_size)
+        self.io = io
+        self.socket_options = socket_options or SocketOptions()
+        # Read size per phase, as for Timeouts.limits; reads fill pooled buffers
+        self.read_sizes = read_sizes or {"greeting": COMMAND_READ_SIZE, "command": COMMAND_READ_SIZE,
+                                         "data": DATA_READ_SIZE}
+        self.buffers = BufferPool()
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.drain_deadline = None
+        self.listener = None
+        # (socket, protocol) of the session the blocking loop is serving
+        self.active = None
+        # Set to restart_command() to let SIGHUP start a successor on the same socket
+        self.restart_command = None
+        self.successor = None
+
+    def write_to_files(self, message):
+        """Hands the message to the delivery backend, or the relay queue, once per recipient domain."""
+        recipients = {domain.strip("\n"): [] for domain in message.forward_domains}
+        for rcpt in message.recipients:
+            recipients[rcpt.split("@")[-1]].append(rcpt)
+        if self.relay:
+            for domain, addresses in recipients.items():
+                self.relay.enqueue(message.sender, domain, addresses, message.text)
+                self.metrics.delivered(domain)
+            return
+        for domain in self.backend.deliver(message.sender, recipients, message.text):
+            self.metrics.delivered(domain)
+
+    def socket_read_into(self, socket, view, phase="data"):
+        """Reads into view (recv_into) and returns the byte count, giving up with SessionTimeout
+        once the phase or session deadline passes."""
+        left = self.timeouts.start_read(socket, phase)
+        if left == 0:
+            raise SessionTimeout(phase)
         try:
-            sentence = socket.recv(2048)
-            #print(f"Just read: {[sentence.decode()]}")
-            if sentence.decode() == '':
-                raise HaltError()
-            return sentence.decode()
-        except Exception as e:
+            socket.settimeout(left)
+            received = socket.recv_into(view)
+            self.timeouts.end_read(socket)
+        except timeout:
+            raise SessionTimeout(phase)
+        except KeyboardInterrupt:
+            raise HaltError()
+        except OSError as e:
             print(e)
             raise SocketError(msg="Error reading socket")
-        
+        if received == 0:
+            raise HaltError()
+        self.metrics.received(received)
+        return received
+
     def socket_write(self, socket, line):
+        """Sends a reply; pass bytes from .replies to skip formatting and encoding."""
         #print(f"Trying to write: {[line]}")
         try:
-            sentence = line.encode()
+            sentence = line if isinstance(line, bytes) else line.encode()
             socket.sendall(sentence)
+            self.metrics.reply(sentence)
         except Exception:
             raise SocketError(msg=f"Socket error when writing: {line}")
 
-    def read_sentence(self, connection_socket, in_data=False):
-        """Reads a single sentence from socket and assigns to .sentence field."""
+    def receive(self, connectionSocket, protocol):
+        """Feeds the next read to the protocol, with no allocation per read: BDAT chunks are
+        read in place, anything else into a pooled buffer sized for the phase."""
+        view = protocol.pending_chunk()
+        if view is not None:
+            protocol.chunk_received(self.socket_read_into(connectionSocket, view))
+            return
+        phase = protocol.phase
+        buffer = self.buffers.acquire(self.read_sizes[phase])
         try:
-            self.sentence = self.socket_read(connection_socket)
-            if self.sentence == '':
-                if not in_data:
-                    raise HaltError()
-                else:
-                    raise EOFInDATAError()
-        except KeyboardInterrupt:
-            raise HaltError()
-        except (EOFError, SystemExit):
-            if not in_data:
-                raise HaltError()
-            else:
-                raise EOFInDATAError()
-    
-    def get_next(self):
+            received = self.socket_read_into(connectionSocket, buffer, phase)
+            protocol.receive_data(memoryview(buffer)[:received])
+        finally:
+            self.buffers.release(buffer)
+
+    def flush_replies(self, connectionSocket, protocol):
+        """Sends every reply the protocol has queued with one sendmsg (writev)."""
+        replies = protocol.take_replies()
+        if not replies:
+            return
         try:
-            self.sentence = self.received_text[self.curr_index]
-            self.curr_index += 1
-        except IndexError:
-            raise SocketError("Get_next index incorrect")
-
-
-    def get_email(self, connectionSocket):
-        self.reset() # Ensure previouos data has been erased
-
-        while True:
-            try:  # Program halts if keyboard interrupt or reaches end of file
-                try:
-                    self.reset()
-                    # Get email
-                    self.read_sentence(connectionSocket)
-                    self.received_text = self.sentence.split("\n")
-                    if (self.received_text[-1] == ""):
-                        self.received_text.pop()
-                    self.received_text = [line + "\n" for line in self.received_text]
-
-                    # Check if is mail from
-                    self.get_next()
-                    cmd, syntax_correct = self.which_cmd()  # Will raise 500 error is cmd invalid
-                    if cmd == "quit":
-                        raise QUITError()
-                    elif cmd != "mail_from":
-                        raise OrderError503()
-                    elif syntax_correct == False:
-                        raise SyntaxError501()
-                    
-                    # Check if is rcpt to
-                    self.get_next()
-                    cmd, syntax_correct = self.which_cmd()  # Will raise 500 error is cmd invalid
-                    if cmd == "quit":
-                        raise QUITError()
-                    elif cmd != "rcpt_to":
-                        raise OrderError503()
-                    elif syntax_correct == False:
-                        raise SyntaxError501()
-
-                    # Append domain to self.domains if not already there
-                    rcpt_domain = self.extract_domain()
-                    if rcpt_domain not in self.forward_domains:
-                        self.forward_domains.append(rcpt_domain)
-
-
-                    # While loop to read and assign any further recipients
-                    while cmd == "rcpt_to":
-                        self.get_next()
-                        cmd, syntax_correct = self.which_cmd()
-                        if cmd == "quit":
-                            raise QUITError()
-                        elif cmd == "data":
-                            break
-                        elif cmd == "mail_from" or cmd == "helo":
-                            raise OrderError503()
-                        elif syntax_correct == False:  # if reached, cmd must be "rcpt_to"
-                            raise SyntaxError501()
-                        else:
-                            rcpt_domain = self.extract_domain()
-                            if rcpt_domain not in self.forward_domains:
-                                self.forward_domains.append(rcpt_domain)
-
-                    # NOTE: no need to read another sentence because while loop 
-                    # NOTE: also, cmd must be data due to "break" in while loop
-                    # While loop to read all lines, append to .text, until data termination
-                    # current, .sentence is still the "DATA" command
-                    try:
-                        self.get_next()
-                        while not self.parser.parse_data_end(self.sentence):
-                            self.text.append(self.sentence)
-                            self.get_next()
-                        self.socket_write(connectionSocket, OK_250)
-                    except EOFInDATAError:
-                        raise SyntaxError501()
-
-                    # Write text to appropiate forward paths
-                    self.write_to_files()
-
-                except SyntaxError500:
-                    self.socket_write(connectionSocket, ERROR_500)
-                    self.reset()
-                    continue
-                except OrderError503 as e:
-                    self.socket_write(connectionSocket, ERROR_503)
-                    self.reset()
-                    continue
-                except SyntaxError501 as e:
-                    self.socket_write(connectionSocket, ERROR_501)
-                    self.reset()
-                    continue
-                except QUITError:
-                    self.socket_write(connectionSocket, f"221 {self.hostname} closing connection")
-                    connectionSocket.close()
-                    return
-            except HaltError as e:
-                connectionSocket.close()
-                return
-            except SocketError as e:
-                print(f"ERROR - {e}")
-                connectionSocket.close()
-                return
+            send_buffers(connectionSocket, replies)
+        except Exception:
+            raise SocketError(msg=f"Socket error when writing: {replies}")
+        for reply in replies:
+            self.metrics.reply(reply)
+
+    def deliver(self, message):
+        self.metrics.message_accepted(len(message.recipients))
+        # Write text to appropiate forward paths
+        with self.metrics.time("delivery"):
+            self.write_to_files(message)
+
+    def store(self, protocol, message):
+        """Delivers a finished message; if the backend fails, the client gets 451 instead
+        of 250 and may retry, and the session goes on."""
+        try:
+            self.deliver(message)
+        except OSError as e:
+            print(f"ERROR - cannot store message: {e}")
+            protocol.delivery_failed()
 
-    def run_server(self):
-        """Server's main loop."""
+    def close_timed_out(self, connectionSocket, error):
+        print(f"ERROR - {error}")
+        self.close_with(connectionSocket, self.replies.timeout)
+
+    def close_with(self, connectionSocket, reply):
+        """Sends reply (best effort, the client may not be reading) and closes."""
+        try:
+            connectionSocket.settimeout(0)
+            connectionSocket.send(reply)
+            self.metrics.reply(reply)
+        except OSError:
+            pass
+        connectionSocket.close()
+
+    def open_listener(self, reuse_port=False):
+        """Creates the welcome socket; reuse_port lets several processes bind the same port."""
+        serverSocket = socket(AF_INET, SOCK_STREAM)
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        if reuse_port:
+            serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        serverSocket.bind(("", self.serverPort))
+        serverSocket.listen(LISTEN_BACKLOG)
+        return serverSocket
+
+    def drain(self, signum=None, frame=None):
+        """Stops accepting and lets the sessions in progress finish within drain_timeout.
+
+        A session waiting for a command gets 421 and is closed; one in the middle of
+        message data may finish it first. This runs as a signal handler, so it only sets
+        flags and interrupts reads: a message that was acknowledged is always stored.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_deadline = time.monotonic() + self.drain_timeout
+        if self.io == "selectors":
+            # The signal wakes the event loop, which drains its connections itself
+            return
+        if self.listener:
+            # accept() fails once the handler returns, which ends the accept loop
+            self.listener.close()
+        if self.active and self.active[1].phase != "data":
+            self.interrupt()
+        if hasattr(signal, "setitimer"):
+            signal.signal(signal.SIGALRM, self.interrupt)
+            signal.setitimer(signal.ITIMER_REAL, self.drain_timeout)
+
+    def interrupt(self, signum=None, frame=None):
+        """Makes the read the active session is blocked in return EOF."""
+        if self.active:
+            try:
+                self.active[0].shutdown(SHUT_RD)
+            except OSError:
+                pass
+
+    def restart(self, signum=None, frame=None):
+        """Starts a new server process on the same listening socket, then drains this one."""
+        if self.draining:
+            return
+        try:
+            self.successor = spawn_successor(self.restart_command, [self.listener])
+        except OSError as e:
+            print(f"ERROR - Cannot start new server: {e}")
+            return
+        self.drain()
+
+    def run_server(self, reuse_port=False, listener=None):
+        """Server's main loop; returns once drained. listener is an already open welcome socket."""
 
         # Create connection socket
         try:
-            serverSocket = socket(AF_INET, SOCK_STREAM)
-            serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-            serverSocket.bind(("", self.serverPort))
-            serverSocket.listen(1)
+            serverSocket = listener or self.open_listener(reuse_port)
         except Exception as e:
             print(e)
             print("ERROR - Cannot establish welcome socket")
             return
-        
-        # This while loop should never terminate 
-        while True:
+        self.listener = serverSocket
+
+        if self.metrics_port:
+            start_metrics_server(self.metrics, self.metrics_port)
+
+        if self.relay:
+            self.relay.start()
+
+        # kill -USR1 <pid> profiles the next sessions without a restart
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.profiler.handle_signal)
+        signal.signal(signal.SIGTERM, self.drain)
+        if self.restart_command and hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.restart)
+
+        if self.io == "selectors":
+            EventLoop(self, serverSocket).run()
+        else:
+            self.accept_connections(serverSocket)
+        # Drained: nothing is accepted or in progress any more
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if self.relay:
+            self.relay.stop()
+
+    def accept_connections(self, serverSocket):
+        """Serves one connection at a time until drain() closes serverSocket."""
+        # An inherited socket may come from a process that ran the event loop
+        serverSocket.setblocking(True)
+        while not self.draining:
             connectionSocket = None
             try:
                 connectionSocket, addr = serverSocket.accept()
             except Exception:
+                if self.draining:
+                    break
                 print("ERROR - Error when establishing connection socket")
                 continue
-
+            ip = addr[0]
+            if self.admission:
+                # Refused before the greeting, so abusive clients never reach the parser
+                reason = self.admission.admit(ip)
+                if reason:
+                    self.metrics.connection_refused(reason)
+                    self.close_with(connectionSocket, self.replies.busy)
+                    continue
+            try:
+                self.socket_options.apply(connectionSocket)
+            except OSError:
+                # Reset before we got to it
+                connectionSocket.close()
+                continue
+            self.metrics.connection_opened()
+            self.profiler.session_started(connectionSocket)
+            self.timeouts.start_session(connectionSocket)
+            try:
+                self.handle_connection(connectionSocket)
+            finally:
+                self.timeouts.end_session(connectionSocket)
+                self.profiler.session_finished(connectionSocket)
+                self.metrics.connection_closed()
+                if self.admission:
+                    self.admission.release(ip)
+
+    def handle_connection(self, connectionSocket):
+        """Drives a ServerProtocol from the socket for one accepted connection."""
+        with self.metrics.time("session"):
             # Send greeting message
             try:
-                serverGreeting = f"220 {self.hostname}"
-                self.socket_write(connectionSocket, serverGreeting)
+                self.socket_write(connectionSocket, self.replies.greeting)
             except SocketError:
-                print(msg="ERROR - cannot send greeting to client")
+                print("ERROR - cannot send greeting to client")
                 connectionSocket.close()
-                continue
+                return
 
-            handshake_established = False
-            while not handshake_established:
-                try:
-                    # Send greeting message
-                    client_greeting = self.socket_read(connectionSocket)
-                    cmd, syntax_correct = self.which_cmd(client_greeting)
-                    if cmd == "quit":
-                        raise QUITError()
-                    elif cmd != "helo":
-                        self.socket_write(connectionSocket, ERROR_503)
-                    elif syntax_correct == False:
-                        self.socket_write(connectionSocket, ERROR_501)
-                    else:
-                        handshake_established = True
-                        client_name = client_greeting.strip("\n").strip(" ").strip("HELO").strip(" ")
-                        greeting_message = f"250 Hello {client_name} pleased to meet you"
-                        self.socket_write(connectionSocket, greeting_message)
-
-                except SocketError:
-                    print("ERROR - handshake failed")
-                    connectionSocket.close()
-                    break
-                except SyntaxError500:
-                    try:
-                        self.socket_write(connectionSocket, ERROR_500)
-                        continue
-                    except SocketError:
-                        print("ERROR - Cannot write 500 to greeting message")
-                        connectionSocket.close()
-                        break
-                except QUITError:
-                    try:
-                        self.socket_write(connectionSocket, f"221 {self.hostname} closing connection")
-                        connectionSocket.close()
-                        break
-                    except SocketError:
-                        print("ERROR - Cannot write 221 quit message")
+            protocol = ServerProtocol(self.replies, self.max_size)
+            stage_start = time.perf_counter()
+            self.active = (connectionSocket, protocol)
+            try:
+                while True:
+                    event = protocol.next_event()
+                    if event is NEED_DATA:
+                        # Out of input: pipelined replies leave together before blocking
+                        self.flush_replies(connectionSocket, protocol)
+                        if self.draining and protocol.phase != "data":
+                            # Between commands nothing is lost: the client retries later
+                            self.close_with(connectionSocket, self.replies.shutdown)
+                            return
+                        self.receive(connectionSocket, protocol)
+                    elif isinstance(event, Greeted):
+                        self.metrics.observe_stage("handshake", time.perf_counter() - stage_start)
+                    elif isinstance(event, DataStarted):
+                        stage_start = time.perf_counter()
+                        self.metrics.observe_stage("envelope", stage_start - protocol.session.envelope_start)
+                    elif isinstance(event, DataFinished):
+                        self.metrics.observe_stage("data", time.perf_counter() - stage_start)
+                        if event.message is not None:
+                            # Stored before the 250 leaves, so an acknowledged message is never lost
+                            self.store(protocol, event.message)
+                    elif isinstance(event, Closed):
+                        self.flush_replies(connectionSocket, protocol)
                         connectionSocket.close()
-                        break
-
-            if handshake_established:
-                # Reads mail
-                self.get_email(connectionSocket)
+                        return
+            except HaltError:
+                if self.draining:
+                    # Cut short by drain(); the message in progress was not acknowledged
+                    self.close_with(connectionSocket, self.replies.shutdown)
+                else:
+                    connectionSocket.close()
+            except SessionTimeout as e:
+                self.close_timed_out(connectionSocket, e)
+            except SocketError as e:
+                print(f"ERROR - {e}")
+                connectionSocket.close()
+            finally:
+                self.active = None
 
 
 if __name__ == "__main__":
-    port = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description="SMTP server emulator")
+    arg_parser.add_argument("port")
+    arg_parser.add_argument("--metrics-port", type=int, default=None,
+                            help="serve Prometheus metrics on 127.0.0.1:<port>/metrics")
+    arg_parser.add_argument("--profile-dir", default="profiles",
+                            help="where SIGUSR1-triggered profiles are written")
+    arg_parser.add_argument("--profile-sessions", type=int, default=10,
+                            help="number of sessions profiled per SIGUSR1")
+    arg_parser.add_argument("--backend", choices=sorted(BACKENDS), default="mbox",
+                            help="how messages are stored under forward/")
+    arg_parser.add_argument("--compression", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                            help="compress every stored message on its own")
+    arg_parser.add_argument("--compression-level", type=int, default=None,
+                            help="gzip 1-9 or xz preset 0-9 (default 6)")
+    arg_parser.add_argument("--dedup", action="store_true",
+                            help="store identical bodies once under forward/.bodies/")
+    arg_parser.add_argument("--relay", metavar="HOST:PORT", default=None,
+                            help="forward messages to this SMTP server through a persistent queue")
+    arg_parser.add_argument("--routes", metavar="FILE", default=None,
+                            help="relay using per-domain routes from FILE (reloaded on change)")
+    arg_parser.add_argument("--relay-workers", type=int, default=4,
+                            help="number of relay sender threads")
+    arg_parser.add_argument("--relay-retry-base", type=float, default=RETRY_BASE,
+                            help="first retry delay in seconds, doubled per failed attempt")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="pre-fork this many SO_REUSEPORT worker processes")
+    arg_parser.add_argument("--greeting-timeout", type=float, default=GREETING_TIMEOUT,
+                            help="seconds to wait for HELO after the 220 greeting")
+    arg_parser.add_argument("--command-timeout", type=float, default=COMMAND_TIMEOUT,
+                            help="seconds to wait for each envelope command")
+    arg_parser.add_argument("--data-timeout", type=float, default=DATA_TIMEOUT,
+                            help="seconds to wait for each chunk of message data")
+    arg_parser.add_argument("--session-timeout", type=float, default=SESSION_TIMEOUT,
+                            help="seconds a whole session may last")
+    arg_parser.add_argument("--ip-rate", type=float, default=None,
+                            help="new connections per second allowed from one IP (token bucket)")
+    arg_parser.add_argument("--ip-burst", type=float, default=None,
+                            help="bucket size for --ip-rate (default: max(1, rate))")
+    arg_parser.add_argument("--ip-max-sessions", type=int, default=None,
+                            help="concurrent sessions allowed from one IP")
+    arg_parser.add_argument("--tracked-ips", type=int, default=TRACKED_IPS,
+                            help="source IPs remembered for admission control (LRU)")
+    arg_parser.add_argument("--max-size", type=int, default=MAX_MESSAGE_SIZE,
+                            help="largest message accepted, in bytes (advertised as SIZE)")
+    arg_parser.add_argument("--no-nodelay", dest="nodelay", action="store_false",
+                            help="leave Nagle's algorithm on for connection sockets")
+    arg_parser.add_argument("--sndbuf", type=int, default=None,
+                            help="SO_SNDBUF for connection sockets, in bytes (default: system)")
+    arg_parser.add_argument("--rcvbuf", type=int, default=None,
+                            help="SO_RCVBUF for connection sockets, in bytes (default: system)")
+    arg_parser.add_argument("--keepalive", type=float, default=None,
+                            help="send TCP keepalive probes after this many idle seconds")
+    arg_parser.add_argument("--command-read-size", type=int, default=COMMAND_READ_SIZE,
+                            help="bytes per read while waiting for commands")
+    arg_parser.add_argument("--data-read-size", type=int, default=DATA_READ_SIZE,
+                            help="bytes per read of message data")
+    arg_parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+                            help="seconds sessions in progress get to finish after SIGTERM or SIGHUP")
+    arg_parser.add_argument(LISTEN_FD_FLAG, default=None, metavar="FD[,FD...]",
+                            help="serve on inherited listening sockets (set by SIGHUP restarts)")
+    arg_parser.add_argument("--io", choices=IO_MODES, default="blocking",
+                            help="serve connections one at a time, or all at once from one selectors loop")
+    args = arg_parser.parse_args()
+    port = args.port
     try:
         port = int(port)
     except Exception:
         print("Port is not a number")
 
-    aserver = Server(port=port)
-    aserver.run_server()
+    admission = None
+    if args.ip_rate is not None or args.ip_max_sessions is not None:
+        admission = Admission(rate=args.ip_rate, burst=args.ip_burst, max_sessions=args.ip_max_sessions,
+                              tracked=args.tracked_ips)
+    aserver = Server(port=port, metrics_port=args.metrics_port, profile_dir=args.profile_dir,
+                     profile_sessions=args.profile_sessions, backend=args.backend,
+                     compression=args.compression, compression_level=args.compression_level,
+                     dedup=args.dedup, relay=args.relay, relay_workers=args.relay_workers,
+                     relay_retry_base=args.relay_retry_base, routes=args.routes,
+                     timeouts=Timeouts(greeting=args.greeting_timeout, command=args.command_timeout,
+                                       data=args.data_timeout, session=args.session_timeout),
+                     admission=admission, max_size=args.max_size, io=args.io,
+                     socket_options=SocketOptions(nodelay=args.nodelay, sndbuf=args.sndbuf, rcvbuf=args.rcvbuf,
+                                                  keepalive=args.keepalive),
+                     read_sizes={"greeting": args.command_read_size, "command": args.command_read_size,
+                                 "data": args.data_read_size},
+                     drain_timeout=args.drain_timeout)
+    aserver.restart_command = restart_command()
+    listeners = inherited_listeners(args.listen_fd) if args.listen_fd else None
+    if args.workers > 1:
+        Supervisor(aserver, args.workers, listeners).run()
+    else:
+        aserver.run_server(listener=listeners[0] if listeners else None)
@@ -0,0 +1,98 @@
+"""Per-session SMTP state, kept apart from the sockets that feed it.
+
+A Session holds everything one connection needs: the phase it is in, the
+open transaction and the input not parsed yet. Moves between phases come
+from TRANSITIONS, so a driver (blocking, threaded or asyncio) only parses
+commands, calls advance() and does the I/O the reply code asks for.
+"""
+
+INIT, GREETED, MAIL, RCPT, DATA = range(5)
+STATE_NAMES = ("INIT", "GREETED", "MAIL", "RCPT", "DATA")
+
+# Commands allowed at any point of a session; they never change its phase
+SESSION_COMMANDS = ("rset", "noop", "vrfy")
+
+
+def build_transitions():
+    table = {}
+    for state in (INIT, GREETED, MAIL, RCPT, DATA):
+        # A greeting (again) or RSET drops any transaction in progress
+        table[state, "helo"] = table[state, "ehlo"] = (GREETED, 250)
+        table[state, "rset"] = (INIT if state == INIT else GREETED, 250)
+        table[state, "noop"] = (state, 250)
+        table[state, "vrfy"] = (state, 252)
+    table[GREETED, "mail_from"] = (MAIL, 250)
+    table[MAIL, "rcpt_to"] = (RCPT, 250)
+    table[RCPT, "rcpt_to"] = (RCPT, 250)
+    table[RCPT, "data"] = (DATA, 354)
+    # BDAT chunks keep the session in DATA until the LAST one ends the message
+    table[RCPT, "bdat"] = (DATA, 250)
+    table[DATA, "bdat"] = (DATA, 250)
+    return table
+
+
+# (state, command) -> (next state, reply code); any pair not listed is 503 and keeps the state
+TRANSITIONS = build_transitions()
+OUT_OF_SEQUENCE = 503
+
+
+class Session():
+    """State of one SMTP connection; does no I/O itself."""
+
+    __slots__ = ("state", "esmtp", "sender", "recipients", "forward_domains", "text",
+                 "chunks", "chunked_size", "envelope_start", "sentence",
+                 "buffer", "pos", "outbox")
+
+    def __init__(self):
+        self.state = INIT
+        self.esmtp = False
+        self.sentence = None
+        # Input received but not parsed yet starts at buffer[pos]
+        self.buffer = bytearray()
+        self.pos = 0
+        # Replies held back until the next read would block
+        self.outbox = []
+        self.sender = None
+        self.recipients = []
+        self.forward_domains = []
+        self.text = []
+        self.chunks = []
+        self.chunked_size = 0
+        self.envelope_start = None
+
+    def advance(self, cmd):
+        """Takes cmd to its next state and returns the reply code; out of sequence is 503."""
+        state, code = TRANSITIONS.get((self.state, cmd), (self.state, OUT_OF_SEQUENCE))
+        if state <= GREETED < self.state:
+            self.clear_transaction()
+        self.state = state
+        return code
+
+    def reset(self):
+        """Ends the transaction, delivered or not; the session stays greeted."""
+        if self.state > GREETED:
+            self.clear_transaction()
+            self.state = GREETED
+
+    def clear_transaction(self):
+        self.sender = None
+        self.recipients = []
+        self.forward_domains = []
+        self.text = []
+        self.chunks = []
+        self.chunked_size = 0
+        self.envelope_start = None
+
+    def add_recipient(self, address):
+        self.recipients.append(address)
+        domain = address.split("@")[-1]
+        if domain not in self.forward_domains:
+            self.forward_domains.append(domain)
+
+    def discard_input(self):
+        self.buffer.clear()
+        self.pos = 0
+
+    @property
+    def state_name(self):
+        return STATE_NAMES[self.state]
@@ -0,0 +1,68 @@
+"""Socket tuning and vectored sends shared by Server, EventLoop and Client.
+
+Replies and pipelined commands are gathered into a list of buffers and sent
+with one sendmsg (writev) call instead of a write each or a join. One write
+per round trip means Nagle's algorithm has nothing to hold back, so leaving
+TCP_NODELAY on costs no extra packets.
+"""
+import os
+import socket
+from socket import IPPROTO_TCP, SO_KEEPALIVE, SO_RCVBUF, SO_SNDBUF, SOL_SOCKET, TCP_NODELAY
+
+# Most buffers one sendmsg call accepts
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+class SocketOptions():
+    """Options set on each connection socket; None leaves the system default.
+
+    keepalive is the idle time in seconds before the first TCP keepalive probe,
+    where the platform lets it be set (TCP_KEEPIDLE); None turns keepalive off.
+    """
+
+    def __init__(self, nodelay=True, sndbuf=None, rcvbuf=None, keepalive=None):
+        self.nodelay = nodelay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.keepalive = keepalive
+
+    def apply(self, sock):
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, int(self.nodelay))
+        if self.sndbuf:
+            sock.setsockopt(SOL_SOCKET, SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf:
+            sock.setsockopt(SOL_SOCKET, SO_RCVBUF, self.rcvbuf)
+        if self.keepalive is not None:
+            sock.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(self.keepalive)))
+        return sock
+
+
+def consume(buffers, sent):
+    """Drops the first sent bytes from the list buffers, in place."""
+    done = 0
+    while done < len(buffers) and sent >= len(buffers[done]):
+        sent -= len(buffers[done])
+        done += 1
+    del buffers[:done]
+    if sent:
+        buffers[0] = memoryview(buffers[0])[sent:]
+
+
+def send_buffers(sock, buffers):
+    """sendall for a list of buffers, gathered by the kernel; returns the byte count."""
+    if not hasattr(sock, "sendmsg"):
+        data = b"".join(buffers)
+        sock.sendall(data)
+        return len(data)
+    buffers = list(buffers)
+    total = 0
+    while buffers:
+        sent = sock.sendmsg(buffers[:IOV_MAX])
+        consume(buffers, sent)
+        total += sent
+    return total
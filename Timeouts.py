@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import time
+
+# RFC 5321 4.5.3.2 asks servers to wait at least 5 minutes for a command
+GREETING_TIMEOUT = 300.0
+COMMAND_TIMEOUT = 300.0
+DATA_TIMEOUT = 180.0
+SESSION_TIMEOUT = 1800.0
+# Stale heap entries tolerated beyond the live ones before the heap is rebuilt
+COMPACT_SLACK = 64
+
+
+class SessionTimeout(Exception):
+    """A read deadline or the session deadline passed before the client sent anything."""
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __str__(self):
+        return f"Timed out waiting for {self.phase}"
+
+
+class TimerHeap():
+    """Deadlines for any number of keys kept in one heap.
+
+    Rescheduling or cancelling a key leaves its old entry in the heap; stale
+    entries are recognised by their sequence number and dropped when they
+    reach the top, so every operation stays O(log n). Nothing may ever look at
+    the top (the blocking server never does), so once stale entries outnumber
+    live ones the heap is rebuilt from the live entries. That bounds it to
+    about twice the live keys, and the O(n) rebuild is paid for by the n
+    stale entries before it.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.live = {}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.live)
+
+    def schedule(self, key, deadline):
+        seq = next(self.counter)
+        self.live[key] = (deadline, seq)
+        heapq.heappush(self.heap, (deadline, seq, key))
+        self.compact()
+
+    def cancel(self, key):
+        if self.live.pop(key, None) is not None:
+            self.compact()
+
+    def compact(self):
+        """Drops every stale entry, and so the references they hold, once they outnumber the live ones."""
+        if len(self.heap) > 2 * len(self.live) + COMPACT_SLACK:
+            self.heap = [(deadline, seq, key) for key, (deadline, seq) in self.live.items()]
+            heapq.heapify(self.heap)
+
+    def deadline(self, key):
+        entry = self.live.get(key)
+        return entry[0] if entry else None
+
+    def prune(self):
+        while self.heap:
+            deadline, seq, key = self.heap[0]
+            if self.live.get(key) == (deadline, seq):
+                return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self):
+        self.prune()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_expired(self, now=None):
+        """Removes and returns the keys whose deadline is at or before now."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.next_deadline() is not None and self.heap[0][0] <= now:
+            _, _, key = heapq.heappop(self.heap)
+            del self.live[key]
+            expired.append(key)
+        return expired
+
+
+class Timeouts():
+    """Per-phase read limits plus a deadline for the whole session, tracked in a TimerHeap."""
+
+    def __init__(self, greeting=GREETING_TIMEOUT, command=COMMAND_TIMEOUT, data=DATA_TIMEOUT,
+                 session=SESSION_TIMEOUT):
+        self.limits = {"greeting": greeting, "command": command, "data": data}
+        self.session = session
+        self.timers = TimerHeap()
+
+    def start_session(self, conn, now=None):
+        now = time.monotonic() if now is None else now
+        self.timers.schedule((conn, "session"), now + self.session)
+
+    def end_session(self, conn):
+        self.timers.cancel((conn, "session"))
+        self.timers.cancel((conn, "read"))
+
+    def start_read(self, conn, phase, now=None):
+        """Arms the read deadline for phase; returns seconds left before conn times out."""
+        now = time.monotonic() if now is None else now
+        self.timers.schedule((conn, "read"), now + self.limits[phase])
+        return self.remaining(conn, now)
+
+    def end_read(self, conn):
+        self.timers.cancel((conn, "read"))
+
+    def remaining(self, conn, now=None):
+        now = time.monotonic() if now is None else now
+        deadlines = [self.timers.deadline((conn, kind)) for kind in ("read", "session")]
+        deadlines = [d for d in deadlines if d is not None]
+        return max(0.0, min(deadlines) - now) if deadlines else None
@@ -0,0 +1,59 @@
+"""SMTP transparency (RFC 5321 4.5.2) over whole buffers.
+
+Every helper takes str, bytes or bytearray and works with C-level replace/find calls, so
+the cost does not depend on how many lines a message has.
+"""
+
+
+def literals(data):
+    """The newline, dot and carriage return literals of the same type as data."""
+    return (b"\n", b".", b"\r") if isinstance(data, (bytes, bytearray)) else ("\n", ".", "\r")
+
+
+def stuff(data, at_line_start=True):
+    """Doubles the dot at the start of every line so no line of data can end the message.
+
+    at_line_start tells whether data begins a line; when stuffing a message piece by
+    piece, pass whether the previous piece ended with a newline.
+    """
+    newline, dot, cr = literals(data)
+    data = data.replace(newline + dot, newline + dot + dot)
+    if at_line_start and data.startswith(dot):
+        data = dot + data
+    return data
+
+
+def unstuff(data):
+    """Removes the dot added by stuff() from every line of a message that starts with one."""
+    newline, dot, cr = literals(data)
+    data = data.replace(newline + dot, newline)
+    if data.startswith(dot):
+        data = data[1:]
+    return data
+
+
+def terminate(data):
+    """Stuffed data followed by the lone "." line that ends DATA."""
+    newline, dot, cr = literals(data)
+    data = stuff(data)
+    if data and not data.endswith(newline):
+        data += newline
+    return data + dot + newline
+
+
+def find_end(block, start=0):
+    """Index of the line holding only "." (the end of DATA) in block, or -1.
+
+    The search starts at start, which must be the beginning of a line. Only lines that
+    start with a dot are looked at one by one, and in stuffed data those are rare.
+    """
+    newline, dot, cr = literals(block)
+    ends = (dot + newline, dot + cr + newline)
+    if block.startswith(ends, start):
+        return start
+    index = block.find(newline + dot, start)
+    while index != -1:
+        if block.startswith(ends, index + 1):
+            return index + 1
+        index = block.find(newline + dot, index + 2)
+    return -1
@@ -0,0 +1,130 @@
+"""Admission control overhead and behaviour under a connection flood.
+
+Three runs against Server.py, each at --per-minute connections/min for
+--seconds: without admission control, with limits loose enough to admit
+everyone (the pure overhead), and with a tight per-IP rate so most
+connections get an early 421. Every connection reads the first reply and
+sends QUIT if it was greeted. Also times Admission.admit/release directly
+with more distinct IPs than the LRU tracks.
+
+    python benchmarks/admission.py --per-minute 50000 --seconds 10
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from socket import create_connection
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from load import percentile, peak_rss_kb, start_server  # noqa: E402
+from Admission import Admission  # noqa: E402
+
+CASES = {
+    "off": [],
+    "loose": ["--ip-rate", "1000000", "--ip-max-sessions", "1000"],
+    "tight": ["--ip-rate", "10", "--ip-burst", "10"],
+}
+
+
+def connect_once(port):
+    start = time.perf_counter()
+    sock = create_connection(("127.0.0.1", port))
+    try:
+        first = sock.recv(1024)
+        latency = time.perf_counter() - start
+        if first.startswith(b"220"):
+            sock.sendall(b"QUIT\n")
+            sock.recv(1024)
+        return first[:3].decode() or "eof", latency
+    finally:
+        sock.close()
+
+
+def run_case(port, per_minute, seconds):
+    interval = 60.0 / per_minute
+    total = int(per_minute * seconds / 60)
+    codes = {}
+    latencies = []
+    start = time.perf_counter()
+    for i in range(total):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        code, latency = connect_once(port)
+        codes[code] = codes.get(code, 0) + 1
+        latencies.append(latency)
+    elapsed = time.perf_counter() - start
+    return {
+        "connections": total,
+        "elapsed_s": elapsed,
+        "achieved_per_minute": total / elapsed * 60,
+        "first_reply_codes": codes,
+        "first_reply_p50_s": percentile(latencies, 50),
+        "first_reply_p99_s": percentile(latencies, 99),
+    }
+
+
+def admit_ns(calls, distinct, tracked):
+    admission = Admission(rate=100.0, max_sessions=10, tracked=tracked)
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(distinct)]
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        ip = ips[i % distinct]
+        if admission.admit(ip) is None:
+            admission.release(ip)
+    elapsed = time.perf_counter_ns() - start
+    return elapsed / calls, len(admission.clients)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2614)
+    arg_parser.add_argument("--per-minute", type=int, default=50000)
+    arg_parser.add_argument("--seconds", type=float, default=10.0)
+    arg_parser.add_argument("--calls", type=int, default=500000)
+    arg_parser.add_argument("--distinct-ips", type=int, default=200000)
+    arg_parser.add_argument("--tracked-ips", type=int, default=65536)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    results = {}
+    for name, server_args in CASES.items():
+        workdir = tempfile.mkdtemp(prefix="smtp-admission-")
+        proc = start_server(workdir, args.port, server_args)
+        try:
+            results[name] = run_case(args.port, args.per_minute, args.seconds)
+            results[name]["server_args"] = server_args
+            results[name]["server_peak_rss_kb"] = peak_rss_kb(proc.pid)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    ns, tracked = admit_ns(args.calls, args.distinct_ips, args.tracked_ips)
+    report = {
+        "benchmark": "admission",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "per_minute": args.per_minute,
+        "results": results,
+        "admit_release_ns": ns,
+        "distinct_ips": args.distinct_ips,
+        "tracked_after": tracked,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Reads with recv() against recv_into a pooled buffer, per message.
+
+Feeds one pipelined EHLO session of --messages transactions (bodies of
+--size bytes) from a forked writer over a socketpair into ServerProtocol,
+read three ways:
+
+  recv            a new bytes object from recv(2048) per read, as Server did
+  pool            recv_into a pooled 2048-byte buffer (same reads, no allocation)
+  pool-by-phase   recv_into pooled buffers of --command-read-size while reading
+                  commands and --data-read-size while reading message data
+
+and reports messages/s, MB/s and reads per message, from the best of
+--repeat runs. A second pass under
+tracemalloc sums, over every read, how far traced memory peaked above where
+it started, as the bytes allocated per message.
+
+    python benchmarks/buffers.py --messages 20000 --size 10240
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Buffers import BufferPool  # noqa: E402
+from Protocol import NEED_DATA, Closed, DataFinished, ReplyTable, ServerProtocol  # noqa: E402
+
+MODES = ("recv", "pool", "pool-by-phase")
+
+
+def build_stream(messages, size):
+    body = "Subject: buffers\n\n" + ("x" * 63 + "\n") * max(1, size // 64)
+    transaction = f"MAIL FROM:<sender@bench.local>\nRCPT TO:<user@d0.example>\nDATA\n{body}.\n"
+    return ("EHLO bench.local\n" + transaction * messages + "QUIT\n").encode()
+
+
+def feed(sock, stream):
+    view = memoryview(stream)
+    for offset in range(0, len(stream), 65536):
+        sock.sendall(view[offset:offset + 65536])
+    sock.shutdown(socket.SHUT_WR)
+
+
+def make_reader(mode, sock, read_sizes):
+    """A function that does one read into protocol and returns the byte count."""
+    pool = BufferPool()
+
+    def recv(protocol):
+        data = sock.recv(2048)
+        protocol.receive_data(data)
+        return len(data)
+
+    def pooled(protocol):
+        size = 2048 if mode == "pool" else read_sizes[protocol.phase]
+        buffer = pool.acquire(size)
+        try:
+            received = sock.recv_into(buffer)
+            protocol.receive_data(memoryview(buffer)[:received])
+        finally:
+            pool.release(buffer)
+        return received
+
+    return recv if mode == "recv" else pooled
+
+
+def run(mode, stream, read_sizes, trace=False):
+    server_side, client_side = socket.socketpair()
+    # A separate process, so the writer does not compete for the GIL
+    writer = os.fork()
+    if writer == 0:
+        server_side.close()
+        feed(client_side, stream)
+        os._exit(0)
+    client_side.close()
+    read = make_reader(mode, server_side, read_sizes)
+    protocol = ServerProtocol(ReplyTable("bench"), max_size=len(stream))
+    messages = reads = allocated = 0
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    while True:
+        event = protocol.next_event()
+        if event is NEED_DATA:
+            protocol.take_replies()
+            if trace:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            read(protocol)
+            reads += 1
+            if trace:
+                allocated += tracemalloc.get_traced_memory()[1] - before
+        elif isinstance(event, DataFinished) and event.message is not None:
+            messages += 1
+        elif isinstance(event, Closed):
+            break
+    elapsed = time.perf_counter() - start
+    if trace:
+        tracemalloc.stop()
+    os.waitpid(writer, 0)
+    server_side.close()
+    return elapsed, messages, reads, allocated
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--messages", type=int, default=20000)
+    arg_parser.add_argument("--size", type=int, default=10240, help="message body bytes")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--command-read-size", type=int, default=4096)
+    arg_parser.add_argument("--data-read-size", type=int, default=65536)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    stream = build_stream(args.messages, args.size)
+    read_sizes = {"greeting": args.command_read_size, "command": args.command_read_size,
+                  "data": args.data_read_size}
+    results = {}
+    for mode in MODES:
+        runs = [run(mode, stream, read_sizes) for _ in range(args.repeat)]
+        elapsed, messages, reads, _ = min(runs)
+        assert messages == args.messages, (mode, messages)
+        results[mode] = {
+            "elapsed_s": elapsed,
+            "messages_per_s": messages / elapsed,
+            "mb_per_s": len(stream) / elapsed / 1e6,
+            "reads_per_message": reads / messages,
+        }
+    # Traced runs last, so tracemalloc's own bookkeeping cannot slow the timed ones
+    for mode in MODES:
+        _, messages, _, allocated = run(mode, stream, read_sizes, trace=True)
+        results[mode]["allocated_bytes_per_message"] = allocated / messages
+
+    report = {
+        "benchmark": "buffers",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": args.messages,
+        "size": args.size,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""BDAT (CHUNKING) against dot-terminated DATA for large bodies.
+
+Starts Server.py and sends --messages bodies of --size bytes (10 MB by
+default) over one EHLO session, once with the CHUNKING extension removed
+from what the client saw (so it falls back to DATA) and once with BDAT.
+Reports MB/s and the server's CPU time per message for each.
+
+    python benchmarks/chunking.py --size 10000000 --messages 5
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from socket import create_connection
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from load import BenchClient, peak_rss_kb, start_server  # noqa: E402
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+def run(port, pid, content, messages, chunking):
+    client = BenchClient("127.0.0.1", port)
+    client.from_field = "<sender@bench.local>\n"
+    client.to_field = ["<user@d0.example>\n"]
+    sock = create_connection(("127.0.0.1", port))
+    try:
+        client.socket_read(sock)
+        extensions = client.greet(sock)
+        if not chunking:
+            extensions.pop("CHUNKING", None)
+        cpu_start = cpu_seconds(pid)
+        start = time.perf_counter()
+        for _ in range(messages):
+            reply = client.send_transaction(sock, extensions, content)
+            if client.extract_response_code(reply) != 250:
+                raise RuntimeError(f"Message refused: {reply!r}")
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(pid) - cpu_start
+        client.socket_write(sock, "QUIT\n")
+        client.read_reply(sock)
+    finally:
+        sock.close()
+    megabytes = len(content.encode()) * messages / 1e6
+    return {
+        "elapsed_s": elapsed,
+        "mb_per_s": megabytes / elapsed,
+        "server_cpu_s_per_message": cpu / messages,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2616)
+    arg_parser.add_argument("--size", type=int, default=10_000_000)
+    arg_parser.add_argument("--messages", type=int, default=5)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    line = "x" * 75 + "\n"
+    content = "Subject: chunking\n\n" + line * (args.size // len(line))
+
+    results = {}
+    for name, chunking in (("data", False), ("bdat", True)):
+        workdir = tempfile.mkdtemp(prefix="smtp-chunking-")
+        proc = start_server(workdir, args.port, ["--max-size", str(args.size * 2)])
+        try:
+            results[name] = run(args.port, proc.pid, content, args.messages, chunking)
+            results[name]["server_peak_rss_kb"] = peak_rss_kb(proc.pid)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "chunking",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size": args.size,
+        "messages": args.messages,
+        "results": results,
+        "speedup": results["data"]["elapsed_s"] / results["bdat"]["elapsed_s"],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
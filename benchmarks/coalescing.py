@@ -0,0 +1,126 @@
+"""Latency per transaction on loopback with and without write coalescing and TCP_NODELAY.
+
+Runs --transactions pipelined EHLO transactions over one connection for
+every combination of:
+
+  server  TCP_NODELAY on (default) or off (--no-nodelay)
+  client  Client as shipped (TCP_NODELAY, one sendmsg per round trip), or
+          one write per command with Nagle left on
+  body    DATA, or a single BDAT chunk (CHUNKING)
+
+and reports p50/p99/mean latency per transaction. A write per command with
+Nagle on is what hits the delayed-ACK stall: the second small write waits
+for the ACK of the first.
+
+    python benchmarks/coalescing.py --transactions 2000 --size 1024
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from socket import create_connection
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from load import BenchClient, percentile, start_server  # noqa: E402
+from Sockets import SocketOptions  # noqa: E402
+
+
+class UncoalescedClient(BenchClient):
+    """Client that writes each pipelined command on its own, with Nagle left on."""
+
+    def __init__(self, serverName, port):
+        super().__init__(serverName, port, esmtp=True)
+        self.socket_options = SocketOptions(nodelay=False)
+
+    def socket_write_all(self, socket, commands):
+        for command in commands:
+            self.socket_write(socket, command)
+
+
+def run(port, client, content, transactions, chunking):
+    client.from_field = "<sender@bench.local>\n"
+    client.to_field = ["<user@d0.example>\n"]
+    sock = client.socket_options.apply(create_connection(("127.0.0.1", port)))
+    latencies = []
+    try:
+        client.socket_read(sock)
+        extensions = client.greet(sock)
+        if not chunking:
+            extensions.pop("CHUNKING", None)
+        for _ in range(transactions):
+            start = time.perf_counter()
+            reply = client.send_transaction(sock, extensions, content)
+            latencies.append(time.perf_counter() - start)
+            if client.extract_response_code(reply) != 250:
+                raise RuntimeError(f"Message refused: {reply!r}")
+        client.socket_write(sock, "QUIT\n")
+        client.read_reply(sock)
+    finally:
+        sock.close()
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2618)
+    arg_parser.add_argument("--transactions", type=int, default=2000)
+    arg_parser.add_argument("--size", type=int, default=1024, help="message body bytes")
+    arg_parser.add_argument("--io", default="blocking", help="server --io mode")
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    content = "Subject: coalescing\n\n" + ("x" * 63 + "\n") * max(1, args.size // 64)
+    results = []
+    for server_nodelay in (True, False):
+        server_args = ["--io", args.io] + ([] if server_nodelay else ["--no-nodelay"])
+        workdir = tempfile.mkdtemp(prefix="smtp-bench-")
+        proc = start_server(workdir, args.port, server_args)
+        try:
+            for coalesced, chunking in itertools.product((True, False), (False, True)):
+                if coalesced:
+                    client = BenchClient("127.0.0.1", args.port, esmtp=True)
+                else:
+                    client = UncoalescedClient("127.0.0.1", args.port)
+                result = run(args.port, client, content, args.transactions, chunking)
+                results.append({
+                    "server_nodelay": server_nodelay,
+                    "client": "coalesced" if coalesced else "write per command",
+                    "body": "BDAT" if chunking else "DATA",
+                    **result,
+                })
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "coalescing",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "io": args.io,
+        "transactions": args.transactions,
+        "size": args.size,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
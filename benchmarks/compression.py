@@ -0,0 +1,104 @@
+"""CPU cost, disk bytes and throughput of per-message compression.
+
+Delivers the same synthetic text messages through MboxBackend with no
+compression and with each codec/level in --settings, reporting CPU seconds
+per message, bytes on disk (mailbox only) and messages/s.
+
+    python benchmarks/compression.py --messages 2000 --settings none,gzip:1,gzip:6,xz:0
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Delivery import MboxBackend  # noqa: E402
+
+WORDS = ("the of and to in is you that it he was for on are as with his they at be this have from or "
+         "one had by word but not what all were we when your can said there use an each which she do "
+         "how their if will up other about out many then them these so some her would make like him "
+         "into time has look two more write go see number no way could people my than first water "
+         "meeting invoice shipment report attached please regards thanks schedule project").split()
+
+
+def make_body(rng, size):
+    lines = []
+    total = 0
+    while total < size:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))) + "\n"
+        lines.append(line)
+        total += len(line)
+    return lines
+
+
+def parse_setting(value):
+    if value == "none":
+        return None, None
+    compression, _, level = value.partition(":")
+    return compression, int(level) if level else None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--messages", type=int, default=2000)
+    arg_parser.add_argument("--body-size", type=int, default=4096)
+    arg_parser.add_argument("--settings", default="none,gzip:1,gzip:6,gzip:9,xz:0,xz:6")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bodies = [make_body(rng, args.body_size) for _ in range(args.messages)]
+    recipients = {"bench.example": ["user@bench.example"]}
+
+    results = []
+    for setting in args.settings.split(","):
+        compression, level = parse_setting(setting)
+        root = tempfile.mkdtemp(prefix="smtp-compress-")
+        try:
+            backend = MboxBackend(root, compression, level)
+            cpu = time.process_time()
+            start = time.perf_counter()
+            for body in bodies:
+                backend.deliver("sender@bench.local", recipients, body)
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            disk = os.path.getsize(os.path.join(root, "bench.example" + backend.suffix))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        results.append({
+            "setting": setting,
+            "messages_per_s": args.messages / elapsed,
+            "cpu_us_per_message": cpu / args.messages * 1e6,
+            "disk_bytes": disk,
+        })
+
+    baseline = next((r["disk_bytes"] for r in results if r["setting"] == "none"), None)
+    for result in results:
+        result["disk_ratio"] = result["disk_bytes"] / baseline if baseline else None
+
+    report = {
+        "benchmark": "compression",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": args.messages,
+        "body_size": args.body_size,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
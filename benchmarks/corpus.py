@@ -0,0 +1,73 @@
+"""Corpus generator of valid and invalid SMTP commands for the parser benchmarks.
+
+Every case is a (name, sentences) pair; sentences are newline terminated, as
+ServerProtocol hands them to the parser.
+"""
+import random
+import string
+
+LOCAL_CHARS = string.ascii_letters + string.digits + "!#$%&'*+-/=?^_`{|}~"
+DOMAIN_CHARS = string.ascii_lowercase + string.digits
+
+
+def local_part(rng, length):
+    return "".join(rng.choice(LOCAL_CHARS) for _ in range(length))
+
+
+def domain(rng, depth, label_length=6):
+    labels = []
+    for _ in range(depth):
+        labels.append(rng.choice(string.ascii_lowercase) +
+                      "".join(rng.choice(DOMAIN_CHARS) for _ in range(label_length - 1)))
+    return ".".join(labels)
+
+
+def whitespace(rng, length):
+    return "".join(rng.choice(" \t") for _ in range(length))
+
+
+def mailbox(rng, local_length=8, depth=2):
+    return f"{local_part(rng, local_length)}@{domain(rng, depth)}"
+
+
+def generate(seed=0, size=200):
+    """Returns a list of (case name, list of sentences)."""
+    rng = random.Random(seed)
+
+    def many(make):
+        return [make() for _ in range(size)]
+
+    return [
+        # Valid commands
+        ("mail_from", many(lambda: f"MAIL FROM: <{mailbox(rng)}>\n")),
+        ("rcpt_to", many(lambda: f"RCPT TO: <{mailbox(rng)}>\n")),
+        ("helo", many(lambda: f"HELO {domain(rng, 2)}\n")),
+        ("data", many(lambda: "DATA\n")),
+        ("quit", many(lambda: "QUIT\n")),
+        ("data_end", many(lambda: ".\n")),
+        ("data_line", many(lambda: local_part(rng, 60) + "\n")),
+        # Stress individual grammar rules
+        ("long_local_64", many(lambda: f"RCPT TO: <{mailbox(rng, local_length=64)}>\n")),
+        ("long_local_256", many(lambda: f"RCPT TO: <{mailbox(rng, local_length=256)}>\n")),
+        ("deep_domain_10", many(lambda: f"RCPT TO: <{mailbox(rng, depth=10)}>\n")),
+        ("deep_domain_40", many(lambda: f"RCPT TO: <{mailbox(rng, depth=40)}>\n")),
+        ("whitespace_runs", many(lambda: f"MAIL{whitespace(rng, 16)}FROM:{whitespace(rng, 16)}"
+                                         f"<{mailbox(rng)}>{whitespace(rng, 16)}\n")),
+        # Invalid commands
+        ("bad_verb", many(lambda: rng.choice(["MAIL FORM:", "RCTP TO:", "HELLO", "DATUM", "EXPN"]) +
+                                  f" <{mailbox(rng)}>\n")),
+        ("bad_path", many(lambda: f"MAIL FROM: {mailbox(rng)}\n")),
+        ("bad_local", many(lambda: f"RCPT TO: <{local_part(rng, 8)} x@{domain(rng, 2)}>\n")),
+        ("bad_domain", many(lambda: f"RCPT TO: <{local_part(rng, 8)}@{domain(rng, 2)}.>\n")),
+        ("missing_crlf", many(lambda: f"MAIL FROM: <{mailbox(rng)}>")),
+    ]
+
+
+# Inputs for timing single grammar rules, positioned where the rule starts
+RULE_INPUTS = {
+    "mailbox": lambda rng: f"{mailbox(rng)}>",
+    "domain": lambda rng: f"{domain(rng, 3)}>",
+    "path": lambda rng: f"<{mailbox(rng)}>",
+    "whitespace": lambda rng: whitespace(rng, 8) + "X",
+    "crlf": lambda rng: "\n",
+}
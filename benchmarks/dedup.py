@@ -0,0 +1,93 @@
+"""Disk savings and write throughput of body deduplication on a bulk campaign replay.
+
+A campaign of --bodies distinct bodies is sent to --domains domains per
+message and resent --resends times, through MboxBackend with and without
+DedupBackend.
+
+    python benchmarks/dedup.py --bodies 200 --domains 20 --resends 3
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from compression import make_body  # noqa: E402
+from Delivery import DedupBackend, MboxBackend  # noqa: E402
+
+
+def disk_usage(root):
+    total = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            total += os.path.getsize(os.path.join(directory, name))
+    return total
+
+
+def replay(backend, campaign):
+    start = time.perf_counter()
+    for recipients, lines in campaign:
+        backend.deliver("campaign@bench.local", recipients, lines)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--bodies", type=int, default=200)
+    arg_parser.add_argument("--domains", type=int, default=20, help="recipient domains per message")
+    arg_parser.add_argument("--resends", type=int, default=3)
+    arg_parser.add_argument("--body-size", type=int, default=8192)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    recipients = {f"d{i}.example": [f"list@d{i}.example"] for i in range(args.domains)}
+    bodies = [make_body(rng, args.body_size) for _ in range(args.bodies)]
+    campaign = [(recipients, body) for _ in range(args.resends + 1) for body in bodies]
+
+    results = []
+    for name in ("mbox", "mbox+dedup"):
+        root = tempfile.mkdtemp(prefix="smtp-dedup-")
+        try:
+            backend = MboxBackend(root)
+            if name.endswith("dedup"):
+                backend = DedupBackend(backend)
+            elapsed = replay(backend, campaign)
+            disk = disk_usage(root)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        results.append({
+            "backend": name,
+            "messages_per_s": len(campaign) / elapsed,
+            "deliveries_per_s": len(campaign) * args.domains / elapsed,
+            "disk_bytes": disk,
+        })
+    results[1]["disk_savings"] = 1 - results[1]["disk_bytes"] / results[0]["disk_bytes"]
+
+    report = {
+        "benchmark": "dedup",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": len(campaign),
+        "domains_per_message": args.domains,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Concurrent delivery throughput and consumer pickup latency per backend.
+
+Writer threads deliver messages to --domains domains through each backend in
+Delivery.BACKENDS while one consumer per backend polls for new messages
+(MailboxIndex for mbox, new/ -> cur/ for maildir). Pickup latency is the
+time from deliver() returning to the consumer reading the message.
+
+    python benchmarks/delivery.py --writers 16 --messages 500
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from Delivery import BACKENDS  # noqa: E402
+from Mailbox import MailboxIndex  # noqa: E402
+from load import percentile  # noqa: E402
+
+POLL_INTERVAL = 0.001
+
+
+def sequence_of(body):
+    for line in body.splitlines():
+        if line.startswith("X-Seq: "):
+            return int(line[7:])
+    return None
+
+
+class MboxConsumer():
+    def __init__(self, root, domain):
+        self.path = os.path.join(root, domain)
+        self.index = None
+        self.next = 0
+
+    def poll(self):
+        if self.index is None:
+            if not os.path.exists(self.path + ".idx"):
+                return []
+            self.index = MailboxIndex(self.path)
+        else:
+            self.index.refresh()
+        found = []
+        while self.next < len(self.index):
+            found.append(sequence_of(self.index.get(self.next)[1]))
+            self.next += 1
+        return found
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+
+
+class MaildirConsumer():
+    def __init__(self, root, domain):
+        self.path = os.path.join(root, domain)
+
+    def poll(self):
+        new = os.path.join(self.path, "new")
+        if not os.path.isdir(new):
+            return []
+        found = []
+        for name in os.listdir(new):
+            with open(os.path.join(new, name)) as f:
+                found.append(sequence_of(f.read()))
+            os.rename(os.path.join(new, name), os.path.join(self.path, "cur", name + ":2,"))
+        return found
+
+    def close(self):
+        pass
+
+
+CONSUMERS = {"mbox": MboxConsumer, "maildir": MaildirConsumer}
+
+
+def run(name, writers, messages, domains, body_size):
+    root = tempfile.mkdtemp(prefix=f"smtp-{name}-")
+    backend = BACKENDS[name](root)
+    recipients = {f"d{i}.example": [f"user@d{i}.example"] for i in range(domains)}
+    body = ["z" * 79 + "\n"] * max(1, body_size // 80)
+    delivered_at = {}
+    latencies = []
+
+    def writer(w):
+        for i in range(messages):
+            seq = w * messages + i
+            backend.deliver("sender@bench.local", recipients, [f"X-Seq: {seq}\n", "\n"] + body)
+            delivered_at[seq] = time.perf_counter()
+
+    def consumer():
+        # Only the first domain is consumed; every domain receives every message
+        reader = CONSUMERS[name](root, "d0.example")
+        remaining = writers * messages
+        while remaining:
+            for seq in reader.poll():
+                seen = time.perf_counter()
+                # deliver() may not have returned to the writer yet
+                latencies.append(max(0.0, seen - delivered_at.get(seq, seen)))
+                remaining -= 1
+            time.sleep(POLL_INTERVAL)
+        reader.close()
+
+    consumer_thread = threading.Thread(target=consumer)
+    consumer_thread.start()
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    consumer_thread.join()
+    shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "backend": name,
+        "messages_per_s": writers * messages / elapsed,
+        "pickup_latency_s": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99)},
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--writers", type=int, default=16)
+    arg_parser.add_argument("--messages", type=int, default=500, help="messages per writer")
+    arg_parser.add_argument("--domains", type=int, default=3)
+    arg_parser.add_argument("--body-size", type=int, default=2048)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    report = {
+        "benchmark": "delivery",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "writers": args.writers,
+        "messages_per_writer": args.messages,
+        "domains": args.domains,
+        "results": [run(name, args.writers, args.messages, args.domains, args.body_size) for name in BACKENDS],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
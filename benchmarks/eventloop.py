@@ -0,0 +1,196 @@
+"""Blocking server against the selectors event loop with 1k concurrent clients.
+
+Starts Server.py once per --io mode and opens --clients connections at the
+same time from a single-threaded non-blocking driver. Every client greets
+with EHLO, sends --transactions pipelined transactions (MAIL, RCPT and DATA
+together, then the body after 354) and QUITs. Reports messages/s, p50/p99
+latency per transaction and until the 220 greeting, plus the server's CPU
+time and peak RSS. The repo has no asyncio mode, so only blocking and
+selectors are compared.
+
+    python benchmarks/eventloop.py --clients 1000 --transactions 5
+"""
+import argparse
+import json
+import os
+import platform
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from chunking import cpu_seconds  # noqa: E402
+from load import peak_rss_kb, percentile, start_server  # noqa: E402
+
+ENVELOPE = b"MAIL FROM:<sender@bench.local>\nRCPT TO:<user@d0.example>\nDATA\n"
+BODY = b"Subject: eventloop\n\n" + b"x" * 63 + b"\n" + b".\n"
+
+
+class BenchSession():
+    """One client connection, advanced whenever its socket has replies."""
+
+    def __init__(self, port, transactions):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.connect_ex(("127.0.0.1", port))
+        self.started = time.perf_counter()
+        self.left = transactions
+        self.buffer = b""
+        # Replies still expected before the next step, and what to do once they are in
+        self.expected = 1
+        self.step = self.greeted
+        self.transaction_start = None
+        self.greeting_latency = None
+        self.latencies = []
+        self.done = False
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        if not data:
+            raise ConnectionError("server closed the connection")
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            if line[3:4] == b"-":
+                continue
+            if line[:1] not in (b"2", b"3"):
+                raise ConnectionError(f"unexpected reply {line!r}")
+            self.expected -= 1
+            if self.expected == 0:
+                self.step()
+
+    def send(self, data, replies, step):
+        self.sock.sendall(data)
+        self.expected = replies
+        self.step = step
+
+    def greeted(self):
+        self.greeting_latency = time.perf_counter() - self.started
+        self.send(b"EHLO bench.local\n", 1, self.next_transaction)
+
+    def next_transaction(self):
+        if self.transaction_start is not None:
+            self.latencies.append(time.perf_counter() - self.transaction_start)
+        if self.left == 0:
+            self.send(b"QUIT\n", 1, self.finished)
+            return
+        self.left -= 1
+        self.transaction_start = time.perf_counter()
+        self.send(ENVELOPE, 3, self.send_body)
+
+    def send_body(self):
+        self.send(BODY, 1, self.next_transaction)
+
+    def finished(self):
+        self.done = True
+
+
+def run_clients(port, clients, transactions, timeout, batch, interval):
+    """Opens batch connections every interval seconds until clients are open, then waits for them."""
+    selector = selectors.DefaultSelector()
+    sessions = []
+    errors = 0
+    active = 0
+    start = time.perf_counter()
+    deadline = start + timeout
+    next_batch = start
+    while (active or len(sessions) < clients) and time.perf_counter() < deadline:
+        if len(sessions) < clients and time.perf_counter() >= next_batch:
+            for _ in range(min(batch, clients - len(sessions))):
+                session = BenchSession(port, transactions)
+                selector.register(session.sock, selectors.EVENT_READ, session)
+                sessions.append(session)
+                active += 1
+            next_batch += interval
+        wait = max(0.0, next_batch - time.perf_counter()) if len(sessions) < clients else 1.0
+        for key, _ in selector.select(wait):
+            session = key.data
+            try:
+                session.on_readable()
+            except OSError:
+                errors += 1
+                session.done = True
+            if session.done:
+                selector.unregister(session.sock)
+                session.sock.close()
+                active -= 1
+    elapsed = time.perf_counter() - start
+    for session in sessions:
+        if not session.done:
+            errors += 1
+            session.sock.close()
+    selector.close()
+    return elapsed, sessions, errors
+
+
+def run_mode(io, port, clients, transactions, timeout, batch, interval):
+    workdir = tempfile.mkdtemp(prefix="smtp-bench-")
+    proc = start_server(workdir, port, ["--io", io])
+    try:
+        cpu_start = cpu_seconds(proc.pid)
+        elapsed, sessions, errors = run_clients(port, clients, transactions, timeout, batch, interval)
+        cpu = cpu_seconds(proc.pid) - cpu_start
+        rss = peak_rss_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    latencies = [latency for session in sessions for latency in session.latencies]
+    greetings = [session.greeting_latency for session in sessions if session.greeting_latency is not None]
+    return {
+        "io": io,
+        "clients": clients,
+        "messages": len(latencies),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "messages_per_s": len(latencies) / elapsed,
+        "transaction_p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "transaction_p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "greeting_p50_ms": percentile(greetings, 50) * 1000 if greetings else None,
+        "greeting_p99_ms": percentile(greetings, 99) * 1000 if greetings else None,
+        "server_cpu_s": cpu,
+        "server_peak_rss_kb": rss,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2617)
+    arg_parser.add_argument("--clients", type=int, default=1000)
+    arg_parser.add_argument("--transactions", type=int, default=5, help="messages per client")
+    arg_parser.add_argument("--batch", type=int, default=10, help="connections opened at once")
+    arg_parser.add_argument("--interval", type=float, default=0.01, help="seconds between batches")
+    arg_parser.add_argument("--modes", default="blocking,selectors", help="comma-separated --io modes")
+    arg_parser.add_argument("--timeout", type=float, default=60.0, help="give up on a mode after this long")
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    results = [run_mode(io, args.port, args.clients, args.transactions, args.timeout, args.batch,
+                        args.interval)
+               for io in args.modes.split(",")]
+    report = {
+        "benchmark": "eventloop",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "transactions_per_client": args.transactions,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Micro-benchmark of Server's Parser over a generated command corpus.
+
+Reports ns/command for the top-level entry points (parse_mail_from,
+parse_rcpt_to, parse_helo, parse_data_end and ServerProtocol.which_cmd end to end),
+for the individual grammar rules, and tracemalloc figures per command:
+peak traced bytes and number of memory blocks still allocated afterwards.
+
+    python benchmarks/grammar.py --repeat 5 --output grammar.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import corpus  # noqa: E402
+from Protocol import Parser, ParseError, ReplyTable, ServerProtocol, SyntaxError500  # noqa: E402
+
+
+def which_cmd(protocol):
+    def run(sentence):
+        try:
+            return protocol.which_cmd(sentence)
+        except SyntaxError500:
+            return None
+    return run
+
+
+def rule(parser, name):
+    method = getattr(parser, name)
+
+    def run(sentence):
+        parser.sentence = sentence
+        parser.increment()
+        try:
+            method()
+        except ParseError:
+            pass
+        parser.flush()
+    return run
+
+
+def time_per_call(func, sentences, repeat):
+    """Best-of-repeat nanoseconds per call."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for sentence in sentences:
+            func(sentence)
+        elapsed = (time.perf_counter_ns() - start) / len(sentences)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def allocations_per_call(func, sentences):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before_blocks = sys.getallocatedblocks()
+    before, _ = tracemalloc.get_traced_memory()
+    peak_total = 0
+    for sentence in sentences:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        func(sentence)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - start
+    after, _ = tracemalloc.get_traced_memory()
+    after_blocks = sys.getallocatedblocks()
+    tracemalloc.stop()
+    return {
+        "peak_bytes": peak_total / len(sentences),
+        "retained_bytes": (after - before) / len(sentences),
+        "retained_blocks": (after_blocks - before_blocks) / len(sentences),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=200, help="sentences per corpus case")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    parser = Parser()
+    protocol = ServerProtocol(ReplyTable("bench"))
+    entry_points = {
+        "parse_mail_from": parser.parse_mail_from,
+        "parse_rcpt_to": parser.parse_rcpt_to,
+        "parse_helo": parser.parse_helo,
+        "parse_data_end": parser.parse_data_end,
+        "which_cmd": which_cmd(protocol),
+    }
+
+    commands = []
+    for case, sentences in corpus.generate(args.seed, args.size):
+        for entry, func in entry_points.items():
+            commands.append({
+                "case": case,
+                "entry": entry,
+                "ns_per_command": time_per_call(func, sentences, args.repeat),
+                **allocations_per_call(func, sentences),
+            })
+
+    rng = random.Random(args.seed)
+    rules = []
+    for name, make in corpus.RULE_INPUTS.items():
+        sentences = [make(rng) for _ in range(args.size)]
+        func = rule(parser, name)
+        rules.append({
+            "rule": name,
+            "ns_per_call": time_per_call(func, sentences, args.repeat),
+            **allocations_per_call(func, sentences),
+        })
+
+    report = {
+        "benchmark": "parser",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commands": commands,
+        "rules": rules,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Load-generation benchmark for Server.py driven by Client protocol logic.
+
+Starts Server.py from a scratch copy of the repo (so forward/ output does not
+land in the working tree), then runs N concurrent synthetic clients for every
+combination of message size, recipient count, domains per message and
+malformed-command fraction. Results are printed (or written) as JSON.
+Sessions use HELO with the whole transaction in one write, or with --esmtp
+EHLO and pipelined MAIL/RCPT/DATA as Client does.
+
+    python benchmarks/load.py --clients 8 --messages 200 --output run.json
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from socket import create_connection
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Client import Client, QuitError, SocketError  # noqa: E402
+
+STAGES = ("connect", "helo", "transaction", "quit", "total")
+
+
+class BenchClient(Client):
+    """Client that runs one session per message and times each protocol stage."""
+
+    def __init__(self, serverName, port, esmtp=False):
+        super().__init__(serverName, port, check_arguments=False)
+        self.myName = "bench.local"
+        self.esmtp = esmtp
+        self.body = None
+
+    def prepare(self, size, recipients, domains, malformed):
+        self.msg = ""
+        self.from_field = "<sender@bench.local>\n"
+        self.to_field = [f"<user{i}@d{i % domains}.example>\n" for i in range(recipients)]
+        self.subject_field = "benchmark\n"
+        line = "x" * 63 + "\n"
+        self.message_field = [line] * max(1, size // len(line))
+        if malformed and self.esmtp:
+            self.from_field = "sender@bench.local\n"
+        msg = self.build_message()
+        if malformed:
+            msg = msg.replace("MAIL FROM:", "MAIL FORM:", 1)
+        self.body = self.build_content()
+        return msg
+
+    def session(self, msg, timings):
+        start = time.perf_counter()
+        sock = self.socket_options.apply(create_connection((self.serverName, self.port)))
+        try:
+            self.check_response(self.socket_read(sock), expected=[220])
+            t = time.perf_counter()
+            timings["connect"].append(t - start)
+
+            if self.esmtp:
+                extensions = self.greet(sock)
+            else:
+                self.socket_write(sock, f"HELO {self.myName}\n")
+                self.check_response(self.socket_read(sock), expected=[250])
+            t2 = time.perf_counter()
+            timings["helo"].append(t2 - t)
+
+            if self.esmtp:
+                reply = self.send_transaction(sock, extensions, self.body)
+            else:
+                self.socket_write(sock, msg)
+                reply = self.socket_read(sock)
+            t3 = time.perf_counter()
+            timings["transaction"].append(t3 - t2)
+
+            self.socket_write(sock, "QUIT\n")
+            self.check_response(self.socket_read(sock), expected=[221])
+            end = time.perf_counter()
+            timings["quit"].append(end - t3)
+            timings["total"].append(end - start)
+            return self.extract_response_code(reply) == 250
+        finally:
+            sock.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_kb(pid):
+    """Peak resident set size of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def start_server(workdir, port, extra_args=()):
+    for path in glob.glob(os.path.join(REPO, "*.py")):
+        shutil.copy(path, workdir)
+    os.makedirs(os.path.join(workdir, "forward"), exist_ok=True)
+    proc = subprocess.Popen([sys.executable, os.path.join(workdir, "Server.py"), str(port), *extra_args],
+                            cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def run_case(port, clients, messages, size, recipients, domains, malformed_fraction, seed, esmtp=False):
+    timings = {stage: [] for stage in STAGES}
+    lock = threading.Lock()
+    counts = {"accepted": 0, "rejected": 0, "errors": 0}
+    per_client = [messages // clients + (1 if i < messages % clients else 0) for i in range(clients)]
+
+    def worker(index, count):
+        rng = random.Random(seed + index)
+        client = BenchClient("127.0.0.1", port, esmtp)
+        local = {stage: [] for stage in STAGES}
+        outcome = {"accepted": 0, "rejected": 0, "errors": 0}
+        for _ in range(count):
+            msg = client.prepare(size, recipients, domains, rng.random() < malformed_fraction)
+            try:
+                outcome["accepted" if client.session(msg, local) else "rejected"] += 1
+            except (QuitError, SocketError, OSError):
+                outcome["errors"] += 1
+        with lock:
+            for stage in STAGES:
+                timings[stage].extend(local[stage])
+            for key in counts:
+                counts[key] += outcome[key]
+
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_client)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "message_size": size,
+        "recipients": recipients,
+        "domains": domains,
+        "malformed_fraction": malformed_fraction,
+        "clients": clients,
+        "esmtp": esmtp,
+        "messages": messages,
+        "elapsed_s": elapsed,
+        "messages_per_s": counts["accepted"] / elapsed if elapsed else None,
+        "sessions_per_s": messages / elapsed if elapsed else None,
+        **counts,
+        "latency_s": {stage: {"p50": percentile(timings[stage], 50), "p99": percentile(timings[stage], 99)}
+                      for stage in STAGES},
+    }
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def float_list(value):
+    return [float(v) for v in value.split(",")]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2599)
+    arg_parser.add_argument("--clients", type=int, default=4)
+    arg_parser.add_argument("--messages", type=int, default=200, help="sessions per case")
+    arg_parser.add_argument("--sizes", type=int_list, default=[256, 1024])
+    arg_parser.add_argument("--recipients", type=int_list, default=[1, 5])
+    arg_parser.add_argument("--domains", type=int_list, default=[1, 3])
+    arg_parser.add_argument("--malformed", type=float_list, default=[0.0, 0.1])
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--esmtp", action="store_true",
+                            help="EHLO and pipelined MAIL/RCPT/DATA instead of HELO with one write")
+    arg_parser.add_argument("--server-arg", action="append", default=[],
+                            help="extra argument passed to Server.py (repeatable)")
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="smtp-bench-")
+    proc = start_server(workdir, args.port, args.server_arg)
+    results = []
+    try:
+        for size, recipients, domains, malformed in itertools.product(
+                args.sizes, args.recipients, args.domains, args.malformed):
+            if domains > recipients:
+                continue
+            results.append(run_case(args.port, args.clients, args.messages, size, recipients,
+                                    domains, malformed, args.seed, args.esmtp))
+        rss = peak_rss_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "load",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server_args": args.server_arg,
+        "server_peak_rss_kb": rss,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
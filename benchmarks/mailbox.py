@@ -0,0 +1,132 @@
+"""Concurrent append stress check and throughput comparison for forward/ mailboxes.
+
+64 writers (threads, or processes with --processes) append messages to the
+same mailbox. Every message carries its writer id, sequence number and a
+checksum line, and bodies include lines starting with "From " to exercise
+escaping. Afterwards each message is parsed back and verified; the script
+exits non-zero if any message is missing or corrupted. The same load is
+then timed with the old open("a") + writelines writer for comparison.
+
+    python benchmarks/mailbox.py --writers 64 --messages 200
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Mailbox import append_message, format_message, read_messages  # noqa: E402
+
+
+def make_lines(writer, seq, rng):
+    lines = [f"X-Writer: {writer}\n", f"X-Seq: {seq}\n", "\n"]
+    for i in range(rng.randint(1, 60)):
+        if i % 7 == 3:
+            lines.append(f"From the desk of writer {writer}\n")
+        else:
+            lines.append("".join(rng.choice("abcdefghij ") for _ in range(rng.randint(0, 120))) + "\n")
+    digest = hashlib.sha1("".join(lines).encode()).hexdigest()
+    return lines + [f"X-Digest: {digest}\n"]
+
+
+def write_framed(path, writer, bodies):
+    for lines in bodies:
+        append_message(path, format_message(f"w{writer}@bench.local", lines))
+
+
+def write_legacy(path, writer, bodies):
+    for lines in bodies:
+        with open(path, "a") as f:
+            f.writelines(lines)
+
+
+def run_writers(target, path, corpus, processes):
+    """Times all writers; bodies are generated up front so only writing is measured."""
+    kind = multiprocessing.Process if processes else threading.Thread
+    workers = [kind(target=target, args=(path, w, bodies)) for w, bodies in enumerate(corpus)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def verify(path, writers, messages):
+    seen = set()
+    corrupted = 0
+    for envelope, body in read_messages(path):
+        lines = body.splitlines(keepends=True)
+        try:
+            writer = int(lines[0].split(": ")[1])
+            seq = int(lines[1].split(": ")[1])
+            digest = lines[-1].split(": ")[1].strip()
+        except (IndexError, ValueError):
+            corrupted += 1
+            continue
+        if (hashlib.sha1("".join(lines[:-1]).encode()).hexdigest() != digest
+                or envelope.split()[1] != f"w{writer}@bench.local" or (writer, seq) in seen):
+            corrupted += 1
+            continue
+        seen.add((writer, seq))
+    return {"expected": writers * messages, "intact": len(seen), "corrupted": corrupted,
+            "missing": writers * messages - len(seen)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--writers", type=int, default=64)
+    arg_parser.add_argument("--messages", type=int, default=200, help="messages per writer")
+    arg_parser.add_argument("--processes", action="store_true", help="use processes instead of threads")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="smtp-mailbox-")
+    try:
+        framed_path = os.path.join(workdir, "framed")
+        legacy_path = os.path.join(workdir, "legacy")
+        corpus = []
+        for writer in range(args.writers):
+            rng = random.Random(args.seed + writer)
+            corpus.append([make_lines(writer, seq, rng) for seq in range(args.messages)])
+        framed_s = run_writers(write_framed, framed_path, corpus, args.processes)
+        legacy_s = run_writers(write_legacy, legacy_path, corpus, args.processes)
+        check = verify(framed_path, args.writers, args.messages)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = args.writers * args.messages
+    report = {
+        "benchmark": "mailbox",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "writers": args.writers,
+        "messages_per_writer": args.messages,
+        "processes": args.processes,
+        "framed_messages_per_s": total / framed_s,
+        "legacy_messages_per_s": total / legacy_s,
+        "verification": check,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if check["corrupted"] or check["missing"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Random access into a large indexed mailbox versus scanning it.
+
+Builds a mailbox of --size-gb (default 10) with append_message, then times
+MailboxIndex.get for random message numbers, time-range queries, and a
+streaming scan to message k as the pre-index baseline.
+
+    python benchmarks/mailbox_index.py --size-gb 10 --dir /mnt/scratch
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Mailbox import MailboxIndex, append_message, format_message  # noqa: E402
+
+
+def build(path, size_bytes, message_size, rng):
+    line = "y" * 75 + "\n"
+    total = 0
+    count = 0
+    start = time.perf_counter()
+    while total < size_bytes:
+        lines = [f"X-Seq: {count}\n", "\n"] + [line] * max(1, (message_size + rng.randint(-512, 512)) // len(line))
+        data = format_message(f"s{count % 97}@bench.local", lines)
+        append_message(path, data, sender=f"s{count % 97}@bench.local", recipients=["r@bench.local"])
+        total += len(data)
+        count += 1
+    return count, time.perf_counter() - start
+
+
+def scan_to(path, k):
+    """Baseline: stream through the mailbox counting envelope lines until message k."""
+    seen = -1
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"From "):
+                seen += 1
+                if seen == k:
+                    return line
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size-gb", type=float, default=10.0)
+    arg_parser.add_argument("--message-size", type=int, default=4096)
+    arg_parser.add_argument("--samples", type=int, default=10000)
+    arg_parser.add_argument("--scan-samples", type=int, default=3)
+    arg_parser.add_argument("--dir", help="scratch directory (needs --size-gb of free space)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="smtp-index-", dir=args.dir)
+    path = os.path.join(workdir, "bench.example")
+    try:
+        count, build_s = build(path, int(args.size_gb * 1024 ** 3), args.message_size, rng)
+
+        with MailboxIndex(path) as index:
+            picks = [rng.randrange(count) for _ in range(args.samples)]
+            start = time.perf_counter()
+            for k in picks:
+                index.get(k)
+            get_s = (time.perf_counter() - start) / len(picks)
+
+            start = time.perf_counter()
+            for k in picks:
+                index.entry(k)
+            entry_s = (time.perf_counter() - start) / len(picks)
+
+            first, last = index.timestamp(0), index.timestamp(count - 1)
+            ranges = []
+            for _ in range(100):
+                lo = rng.uniform(first, last)
+                ranges.append((lo, lo + (last - first) / 1000))
+            start = time.perf_counter()
+            matched = 0
+            for lo, hi in ranges:
+                matched += sum(1 for _ in index.time_range(lo, hi))
+            range_s = (time.perf_counter() - start) / len(ranges)
+
+        scan_picks = [rng.randrange(count) for _ in range(args.scan_samples)]
+        start = time.perf_counter()
+        for k in scan_picks:
+            scan_to(path, k)
+        scan_s = (time.perf_counter() - start) / max(1, len(scan_picks))
+        mailbox_bytes = os.path.getsize(path)
+        index_bytes = os.path.getsize(path + ".idx") + os.path.getsize(path + ".meta")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "mailbox_index",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": count,
+        "mailbox_bytes": mailbox_bytes,
+        "index_bytes": index_bytes,
+        "build_messages_per_s": count / build_s,
+        "indexed_get_us": get_s * 1e6,
+        "indexed_entry_us": entry_s * 1e6,
+        "time_range_query_us": range_s * 1e6,
+        "time_range_avg_matches": matched / len(ranges),
+        "scan_get_us": scan_s * 1e6,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Throughput of Server.py --workers 1..N under the load benchmark.
+
+    python benchmarks/prefork.py --max-workers 4 --clients 16 --output prefork.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import load  # noqa: E402
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2600)
+    arg_parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--clients", type=int, default=16)
+    arg_parser.add_argument("--messages", type=int, default=1000)
+    arg_parser.add_argument("--size", type=int, default=512)
+    arg_parser.add_argument("--recipients", type=int, default=2)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    results = []
+    for workers in range(1, args.max_workers + 1):
+        port = args.port + workers
+        workdir = tempfile.mkdtemp(prefix="smtp-bench-")
+        proc = load.start_server(workdir, port, ["--workers", str(workers)])
+        try:
+            case = load.run_case(port, args.clients, args.messages, args.size, args.recipients,
+                                 1, 0.0, seed=1)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+        case["workers"] = workers
+        results.append(case)
+
+    report = {
+        "benchmark": "prefork",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
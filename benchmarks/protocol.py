@@ -0,0 +1,129 @@
+"""CPU-only throughput ceiling of the sans-I/O protocol core.
+
+Pushes --commands SMTP commands (1M by default) through ServerProtocol with
+no sockets: one EHLO session of pipelined transactions (MAIL, RCPT, DATA
+with a short body, plus a NOOP and an RSET every 50 transactions), fed in
+--read-size pieces as a socket would deliver them. The same is then done
+for a HELO session, and the client side runs ClientProtocol.transaction,
+reply framing and outcome() for as many transactions.
+
+    python benchmarks/protocol.py --commands 1000000 --read-size 65536
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Protocol import (NEED_DATA, ClientProtocol, Closed, DataFinished, ReplyTable,  # noqa: E402
+                      ServerProtocol)
+
+BODY = "Subject: protocol\n\nHello there.\n"
+TRANSACTION = f"MAIL FROM:<sender@bench.local>\nRCPT TO:<user@d0.example>\nDATA\n{BODY}.\n"
+EXTRAS = "NOOP\nRSET\n"
+COMMANDS_PER_TRANSACTION = 3
+
+
+def build_stream(commands, greeting):
+    """Session bytes holding about commands commands, and the exact count."""
+    pieces = [greeting]
+    count = 1
+    transactions = 0
+    while count < commands:
+        pieces.append(TRANSACTION)
+        count += COMMANDS_PER_TRANSACTION
+        transactions += 1
+        if transactions % 50 == 0:
+            pieces.append(EXTRAS)
+            count += 2
+    pieces.append("QUIT\n")
+    return "".join(pieces).encode(), count + 1, transactions
+
+
+def run_server(stream, read_size):
+    protocol = ServerProtocol(ReplyTable("bench"))
+    view = memoryview(stream)
+    messages = 0
+    replies = 0
+    start = time.perf_counter()
+    for offset in range(0, len(stream), read_size):
+        protocol.receive_data(view[offset:offset + read_size])
+        while True:
+            event = protocol.next_event()
+            if event is NEED_DATA or isinstance(event, Closed):
+                break
+            if isinstance(event, DataFinished) and event.message is not None:
+                messages += 1
+        replies += len(protocol.take_replies())
+    return time.perf_counter() - start, messages, replies
+
+
+def run_client(transactions):
+    protocol = ClientProtocol()
+    extensions = {"PIPELINING": None, "SIZE": "52428800", "8BITMIME": None}
+    envelope = "MAIL FROM: <sender@bench.local>\nRCPT TO: <user@d0.example>\n"
+    replies = "250 OK\n250 OK\n354 Start mail input\n"
+    accepted = 0
+    start = time.perf_counter()
+    for _ in range(transactions):
+        commands = protocol.transaction(envelope, BODY, extensions)
+        protocol.receive_data(replies)
+        received = [protocol.next_reply() for _ in commands]
+        reply, data, rejected = protocol.outcome(received)
+        protocol.receive_data("250 OK\n")
+        if data is not None and protocol.next_reply().startswith("250"):
+            accepted += 1
+    return time.perf_counter() - start, accepted
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--commands", type=int, default=1_000_000)
+    arg_parser.add_argument("--read-size", type=int, default=65536, help="bytes per receive_data call")
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    results = {}
+    for name, greeting in (("esmtp", "EHLO bench.local\n"), ("legacy", "HELO bench.local\n")):
+        stream, commands, transactions = build_stream(args.commands, greeting)
+        elapsed, messages, replies = run_server(stream, args.read_size)
+        assert messages == transactions, (messages, transactions)
+        results[name] = {
+            "commands": commands,
+            "messages": messages,
+            "replies": replies,
+            "elapsed_s": elapsed,
+            "commands_per_s": commands / elapsed,
+            "mb_per_s": len(stream) / elapsed / 1e6,
+        }
+
+    transactions = args.commands // COMMANDS_PER_TRANSACTION
+    elapsed, accepted = run_client(transactions)
+    assert accepted == transactions
+    results["client"] = {
+        "transactions": transactions,
+        "elapsed_s": elapsed,
+        "commands_per_s": transactions * COMMANDS_PER_TRANSACTION / elapsed,
+    }
+
+    report = {
+        "benchmark": "protocol",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "read_size": args.read_size,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""End-to-end relay check: Server.py --relay forwarding to a second Server.py.
+
+Starts a remote MTA (plain Server.py) and a relaying Server.py pointed at
+it, sends --messages sessions to the relay, and waits until every message
+has arrived in the remote's forward/ mailboxes. With --outage N the remote
+only starts N seconds after the load, exercising queue persistence and
+retry backoff. Exits non-zero if any message is missing.
+
+    python benchmarks/relay.py --messages 500 --domains 3 --outage 2
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from load import BenchClient, STAGES, start_server  # noqa: E402
+from Mailbox import read_messages  # noqa: E402
+
+
+def delivered(workdir, domains):
+    total = 0
+    for i in range(domains):
+        path = os.path.join(workdir, "forward", f"d{i}.example")
+        if os.path.exists(path):
+            total += len(read_messages(path))
+    return total
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2610)
+    arg_parser.add_argument("--messages", type=int, default=500)
+    arg_parser.add_argument("--domains", type=int, default=3)
+    arg_parser.add_argument("--size", type=int, default=512)
+    arg_parser.add_argument("--relay-workers", type=int, default=4)
+    arg_parser.add_argument("--outage", type=float, default=0.0, help="seconds the remote MTA starts late")
+    arg_parser.add_argument("--timeout", type=float, default=120.0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    remote_port, relay_port = args.port, args.port + 1
+    remote_dir = tempfile.mkdtemp(prefix="smtp-remote-")
+    relay_dir = tempfile.mkdtemp(prefix="smtp-relay-")
+    remote = None
+    relay = start_server(relay_dir, relay_port, ["--relay", f"127.0.0.1:{remote_port}",
+                                                 "--relay-workers", str(args.relay_workers),
+                                                 "--relay-retry-base", "0.5"])
+    try:
+        if not args.outage:
+            remote = start_server(remote_dir, remote_port)
+
+        client = BenchClient("127.0.0.1", relay_port)
+        timings = {stage: [] for stage in STAGES}
+        start = time.perf_counter()
+        accepted = 0
+        for _ in range(args.messages):
+            msg = client.prepare(args.size, args.domains, args.domains, malformed=False)
+            accepted += client.session(msg, timings)
+        accept_s = time.perf_counter() - start
+
+        if args.outage:
+            time.sleep(max(0.0, args.outage - accept_s))
+            remote = start_server(remote_dir, remote_port)
+
+        expected = accepted * args.domains
+        deadline = time.time() + args.timeout
+        count = 0
+        while time.time() < deadline:
+            count = delivered(remote_dir, args.domains)
+            if count >= expected:
+                break
+            time.sleep(0.2)
+        total_s = time.perf_counter() - start
+        failed = len(os.listdir(os.path.join(relay_dir, "forward", ".queue", "failed")))
+    finally:
+        relay.terminate()
+        relay.wait()
+        if remote:
+            remote.terminate()
+            remote.wait()
+        shutil.rmtree(remote_dir, ignore_errors=True)
+        shutil.rmtree(relay_dir, ignore_errors=True)
+
+    report = {
+        "benchmark": "relay",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": args.messages,
+        "domains": args.domains,
+        "outage_s": args.outage,
+        "accepted": accepted,
+        "accept_messages_per_s": accepted / accept_s,
+        "expected_deliveries": expected,
+        "delivered": count,
+        "failed": failed,
+        "end_to_end_s": total_s,
+        "relayed_deliveries_per_s": count / total_s,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if count < expected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Per-reply cost of the precomputed reply table against per-call formatting.
+
+Sends a typical session's worth of replies (greeting, HELO, MAIL/RCPT/DATA
+acknowledgement, closing) through Server.socket_write into a socket stub
+that discards the bytes, once with strings formatted and encoded on every
+call, as the server used to do, and once with the encoded buffers from
+Server.replies.
+
+    python benchmarks/replies.py --sessions 200000
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Protocol import ERROR_500, OK_250  # noqa: E402
+from Server import Server  # noqa: E402
+
+
+class NullSocket():
+    def sendall(self, data):
+        pass
+
+
+def formatted_session(server, sock):
+    server.socket_write(sock, f"220 {server.hostname} ESMTP\n")
+    server.socket_write(sock, f"{OK_250}\n")
+    server.socket_write(sock, f"{ERROR_500}\n")
+    server.socket_write(sock, f"221 {server.hostname} closing connection\n")
+
+
+def table_session(server, sock):
+    replies = server.replies
+    server.socket_write(sock, replies.greeting)
+    server.socket_write(sock, replies.ok_250)
+    server.socket_write(sock, replies.error_500)
+    server.socket_write(sock, replies.closing)
+
+
+def time_sessions(session, server, sessions, repeat):
+    """Best of repeat runs, since a single run is dominated by scheduler noise."""
+    sock = NullSocket()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(sessions):
+            session(server, sock)
+        elapsed = (time.perf_counter_ns() - start) / sessions
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--sessions", type=int, default=200000)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    server = Server(0)
+    formatted = time_sessions(formatted_session, server, args.sessions, args.repeat)
+    table = time_sessions(table_session, server, args.sessions, args.repeat)
+
+    report = {
+        "benchmark": "replies",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sessions": args.sessions,
+        "repeat": args.repeat,
+        "formatted_ns_per_session": formatted,
+        "table_ns_per_session": table,
+        "speedup": formatted / table if table else None,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
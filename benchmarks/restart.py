@@ -0,0 +1,223 @@
+"""Messages lost across hot restarts (SIGHUP) and a final drain (SIGTERM) under load.
+
+Starts Server.py from a scratch copy of the repo and keeps --clients
+threads sending messages over it. Each message carries a unique id. A
+client resends a message until the server acknowledges it, reconnecting
+when a session is closed (421 from a draining server, or a dropped
+connection). While that runs, the benchmark sends SIGHUP --restarts times,
+--interval seconds apart, each time to the newest server process. After
+that it sends SIGTERM, stops the clients, and waits for every server
+process to exit. Then it counts the ids stored under forward/:
+
+  lost         acknowledged, but not stored (should be 0)
+  duplicates   stored more than once (should be 0)
+  refused      connection attempts refused or reset (0 means no downtime)
+
+It also reports the messages/s and the worst transaction latency seen.
+Finding the new process after SIGHUP reads /proc, so this only runs on Linux.
+
+    python benchmarks/restart.py --clients 16 --restarts 5 --io selectors
+"""
+import argparse
+import collections
+import glob
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+from socket import create_connection
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from Client import QuitError, SocketError  # noqa: E402
+from load import BenchClient, percentile, start_server  # noqa: E402
+
+MARKER = re.compile(rb"^restart-id (\d+)$", re.MULTILINE)
+
+
+def children(pid):
+    """Pids of the processes pid started."""
+    found = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                found += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return found
+
+
+def command_line(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().split(b"\0")
+    except OSError:
+        return []
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # A zombie has exited; it only waits for its parent to reap it
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+def hot_restart(pid, timeout=10.0):
+    """Sends SIGHUP to pid and returns the pid of the server it starts."""
+    before = set(children(pid))
+    os.kill(pid, signal.SIGHUP)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for child in set(children(pid)) - before:
+            if b"--listen-fd" in command_line(child):
+                return child
+        time.sleep(0.01)
+    raise RuntimeError("No new server process after SIGHUP")
+
+
+class Sender():
+    """Sends numbered messages until stopped, resending each one until it is acknowledged."""
+
+    def __init__(self, port, ids, content, stop):
+        self.client = BenchClient("127.0.0.1", port, esmtp=True)
+        self.client.from_field = "<sender@bench.local>\n"
+        self.client.to_field = ["<user@d0.example>\n"]
+        self.port = port
+        self.ids = ids
+        self.content = content
+        self.stop = stop
+        self.acknowledged = []
+        self.latencies = []
+        self.sessions_closed = 0
+        self.refused = 0
+
+    def run(self):
+        pending = None
+        while not self.stop.is_set():
+            try:
+                sock = self.client.socket_options.apply(create_connection(("127.0.0.1", self.port)))
+            except (ConnectionRefusedError, ConnectionResetError):
+                if not self.stop.is_set():
+                    # After the final SIGTERM nothing listens any more, as intended
+                    self.refused += 1
+                time.sleep(0.01)
+                continue
+            try:
+                if self.client.extract_response_code(self.client.socket_read(sock)) != 220:
+                    raise QuitError()
+                extensions = self.client.greet(sock)
+                while not self.stop.is_set():
+                    pending = next(self.ids) if pending is None else pending
+                    start = time.perf_counter()
+                    reply = self.client.send_transaction(sock, extensions, self.content.format(pending))
+                    if self.client.extract_response_code(reply) != 250:
+                        raise QuitError()
+                    self.latencies.append(time.perf_counter() - start)
+                    self.acknowledged.append(pending)
+                    pending = None
+                self.client.socket_write(sock, "QUIT\n")
+                self.client.read_reply(sock)
+            except (QuitError, SocketError, OSError):
+                self.sessions_closed += 1
+            finally:
+                sock.close()
+
+
+def stored_ids(workdir):
+    counts = collections.Counter()
+    for path in glob.glob(os.path.join(workdir, "forward", "*")):
+        with open(path, "rb") as f:
+            counts.update(int(found) for found in MARKER.findall(f.read()))
+    return counts
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2619)
+    arg_parser.add_argument("--clients", type=int, default=16)
+    arg_parser.add_argument("--restarts", type=int, default=5)
+    arg_parser.add_argument("--interval", type=float, default=1.0, help="seconds between signals")
+    arg_parser.add_argument("--size", type=int, default=1024, help="message body bytes")
+    arg_parser.add_argument("--io", default="blocking", help="server --io mode")
+    arg_parser.add_argument("--workers", type=int, default=1, help="server --workers")
+    arg_parser.add_argument("--drain-timeout", type=float, default=5.0, help="server --drain-timeout")
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    content = "Subject: restart\n\nrestart-id {}\n" + ("x" * 63 + "\n") * max(1, args.size // 64)
+    workdir = tempfile.mkdtemp(prefix="smtp-bench-")
+    server_args = ["--io", args.io, "--workers", str(args.workers), "--drain-timeout", str(args.drain_timeout)]
+    proc = start_server(workdir, args.port, server_args)
+    servers = [proc.pid]
+    stop = threading.Event()
+    # next() on a count is atomic in CPython, so the threads can share it
+    ids = itertools.count()
+    senders = [Sender(args.port, ids, content, stop) for _ in range(args.clients)]
+    threads = [threading.Thread(target=sender.run) for sender in senders]
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for _ in range(args.restarts):
+            time.sleep(args.interval)
+            servers.append(hot_restart(servers[-1]))
+        time.sleep(args.interval)
+        stop.set()
+        os.kill(servers[-1], signal.SIGTERM)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        proc.wait(timeout=args.drain_timeout + 10)
+        deadline = time.monotonic() + args.drain_timeout + 10
+        while any(alive(pid) for pid in servers) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        counts = stored_ids(workdir)
+    finally:
+        stop.set()
+        for pid in servers:
+            if alive(pid):
+                os.kill(pid, signal.SIGKILL)
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    acknowledged = [id for sender in senders for id in sender.acknowledged]
+    latencies = [latency for sender in senders for latency in sender.latencies]
+    report = {
+        "benchmark": "restart",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "io": args.io,
+        "workers": args.workers,
+        "clients": args.clients,
+        "restarts": args.restarts,
+        "acknowledged": len(acknowledged),
+        "stored": len(counts),
+        "lost": sum(1 for id in acknowledged if id not in counts),
+        "duplicates": sum(1 for count in counts.values() if count > 1),
+        "refused": sum(sender.refused for sender in senders),
+        "sessions_closed": sum(sender.sessions_closed for sender in senders),
+        "messages_per_s": len(acknowledged) / elapsed,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
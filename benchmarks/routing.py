@@ -0,0 +1,97 @@
+"""Route lookup cost with up to 100k rules.
+
+Generates exact and wildcard rules, loads them through Router, and times
+lookups of matching, wildcard-matching and unrouted domains, both cold
+(the LRU is cleared before each lookup) and warm. The per-rule-count
+results show that trie lookup cost does not grow with the number of rules.
+
+    python benchmarks/routing.py --rules 1000,10000,100000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Routing import Router  # noqa: E402
+
+
+def make_rules(count, rng):
+    rules = []
+    for i in range(count):
+        domain = f"host{i}.zone{i % 997}.example"
+        pattern = f"*.{domain}" if i % 4 == 0 else domain
+        rules.append((pattern, f"relay{rng.randrange(64)}.internal:25"))
+    return rules
+
+
+def time_lookups(router, domains, cold):
+    start = time.perf_counter_ns()
+    for domain in domains:
+        if cold:
+            router.cache.clear()
+        router.resolve(domain)
+    return (time.perf_counter_ns() - start) / len(domains)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rules", default="1000,10000,100000")
+    arg_parser.add_argument("--lookups", type=int, default=100000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    workdir = tempfile.mkdtemp(prefix="smtp-routes-")
+    try:
+        for count in (int(n) for n in args.rules.split(",")):
+            rules = make_rules(count, rng)
+            path = os.path.join(workdir, f"routes-{count}")
+            with open(path, "w") as f:
+                f.write("* default.internal:25\n")
+                f.writelines(f"{pattern} {target}\n" for pattern, target in rules)
+
+            start = time.perf_counter()
+            router = Router(path, check_interval=3600)
+            load_s = time.perf_counter() - start
+
+            picks = [rules[rng.randrange(count)][0] for _ in range(args.lookups)]
+            exact = [p for p in picks if not p.startswith("*.")]
+            wildcard = ["mx." + p[2:] for p in picks if p.startswith("*.")]
+            unrouted = [f"nowhere{i}.invalid" for i in range(len(exact))]
+            results.append({
+                "rules": count,
+                "load_s": load_s,
+                "cold_exact_ns": time_lookups(router, exact, cold=True),
+                "cold_wildcard_ns": time_lookups(router, wildcard, cold=True),
+                "cold_unrouted_ns": time_lookups(router, unrouted, cold=True),
+                "warm_exact_ns": time_lookups(router, exact[:1000] * (len(exact) // 1000 or 1), cold=False),
+            })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "routing",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Memory per session and transition cost of the Session state machine.
+
+Keeps --sessions Session objects alive at once (10k by default) and
+measures them with tracemalloc, against the same fields held in an
+ordinary __dict__ class as Server used to keep them. Also times advance()
+over a whole transaction (EHLO, MAIL, two RCPT, DATA, then reset).
+
+    python benchmarks/session.py --sessions 10000
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Session import GREETED, INIT, Session  # noqa: E402
+
+TRANSACTION = ("ehlo", "mail_from", "rcpt_to", "rcpt_to", "data")
+
+
+class DictSession():
+    """The per-session fields without __slots__, for comparison."""
+
+    def __init__(self):
+        self.state = INIT
+        self.esmtp = False
+        self.sentence = None
+        self.buffer = bytearray()
+        self.pos = 0
+        self.outbox = []
+        self.sender = None
+        self.recipients = []
+        self.forward_domains = []
+        self.text = []
+        self.chunks = []
+        self.chunked_size = 0
+        self.envelope_start = None
+
+
+def run_transaction(session):
+    for cmd in TRANSACTION:
+        session.advance(cmd)
+    session.reset()
+
+
+def footprint(factory, sessions):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = []
+    for _ in range(sessions):
+        kept.append(factory())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    # The list holding the sessions is not part of their cost
+    total -= sys.getsizeof(kept)
+    return total / sessions
+
+
+def transitions_ns(transactions):
+    session = Session()
+    start = time.perf_counter_ns()
+    for _ in range(transactions):
+        run_transaction(session)
+    elapsed = time.perf_counter_ns() - start
+    assert session.state == GREETED
+    return elapsed / (transactions * (len(TRANSACTION) + 1))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--sessions", type=int, default=10000)
+    arg_parser.add_argument("--transactions", type=int, default=200000)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    report = {
+        "benchmark": "session",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sessions": args.sessions,
+        "bytes_per_session": {
+            "slots": footprint(Session, args.sessions),
+            "dict": footprint(DictSession, args.sessions),
+        },
+        "ns_per_transition": transitions_ns(args.transactions),
+    }
+    report["memory_ratio"] = report["bytes_per_session"]["dict"] / report["bytes_per_session"]["slots"]
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Stalled-client check: thousands of connections that never send a byte.
+
+Starts Server.py with short timeouts, opens --stalled connections that read
+the greeting and then go silent, and waits until every one of them has been
+answered with 421 and closed. Connections are opened while the server
+drains earlier ones, since the listen backlog only holds so many. A real
+session is started afterwards to check an honest client is still served.
+Also times the TimerHeap operations the server uses with --keys live
+deadlines. Exits non-zero if any stalled connection is left open.
+
+    python benchmarks/timeouts.py --stalled 2000 --greeting-timeout 0.01
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import selectors
+import shutil
+import sys
+import tempfile
+import time
+from socket import create_connection
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from load import BenchClient, STAGES, peak_rss_kb, start_server  # noqa: E402
+from Timeouts import TimerHeap  # noqa: E402
+
+
+def open_fds(pid):
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return None
+
+
+def stall(port, count, deadline):
+    """Opens count silent connections and collects what the server says before closing each."""
+    selector = selectors.DefaultSelector()
+    replies = {}
+    for i in range(count):
+        sock = create_connection(("127.0.0.1", port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, b"")
+    opened = time.perf_counter()
+    while selector.get_map() and time.perf_counter() < deadline:
+        for key, _ in selector.select(timeout=0.5):
+            try:
+                data = key.fileobj.recv(4096)
+            except OSError:
+                data = b""
+            if data:
+                selector.modify(key.fileobj, selectors.EVENT_READ, key.data + data)
+                continue
+            last = key.data.rstrip(b"\n").split(b"\n")[-1]
+            code = last[:3].decode() or "eof"
+            replies[code] = replies.get(code, 0) + 1
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+    left_open = len(selector.get_map())
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    return opened, replies, left_open
+
+
+def heap_ops(keys, seed):
+    rng = random.Random(seed)
+    timers = TimerHeap()
+    start = time.perf_counter_ns()
+    for key in range(keys):
+        timers.schedule(key, rng.random())
+    for key in range(keys):
+        timers.schedule(key, rng.random() + 1)
+    for key in range(0, keys, 2):
+        timers.cancel(key)
+    expired = timers.pop_expired(now=3)
+    elapsed = time.perf_counter_ns() - start
+    assert len(expired) == keys // 2
+    return elapsed / (keys * 2 + keys // 2 + len(expired))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--port", type=int, default=2612)
+    arg_parser.add_argument("--stalled", type=int, default=2000)
+    arg_parser.add_argument("--greeting-timeout", type=float, default=0.01)
+    arg_parser.add_argument("--workers", type=int, default=1)
+    arg_parser.add_argument("--keys", type=int, default=100000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--timeout", type=float, default=300.0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="smtp-timeouts-")
+    proc = start_server(workdir, args.port, ["--greeting-timeout", str(args.greeting_timeout),
+                                             "--workers", str(args.workers)])
+    try:
+        start = time.perf_counter()
+        opened, replies, left_open = stall(args.port, args.stalled, start + args.timeout)
+        drained = time.perf_counter()
+
+        timings = {stage: [] for stage in STAGES}
+        client = BenchClient("127.0.0.1", args.port)
+        accepted = client.session(client.prepare(512, 1, 1, False), timings)
+        fds = open_fds(proc.pid)
+        rss = peak_rss_kb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "benchmark": "timeouts",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stalled": args.stalled,
+        "workers": args.workers,
+        "greeting_timeout_s": args.greeting_timeout,
+        "connect_s": opened - start,
+        "drain_s": drained - start,
+        "replies": replies,
+        "left_open": left_open,
+        "honest_session_s": timings["total"][0] if accepted else None,
+        "server_open_fds": fds,
+        "server_peak_rss_kb": rss,
+        "timer_heap_keys": args.keys,
+        "timer_heap_ns_per_op": heap_ops(args.keys, args.seed),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(1 if left_open else 0)
+
+
+if __name__ == "__main__":
+    main()
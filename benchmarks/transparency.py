@@ -0,0 +1,105 @@
+"""Dot-stuffing, un-stuffing and end-of-DATA search on multi-MB bodies.
+
+Compares the whole-buffer helpers in Transparency.py with doing the same work
+line by line in Python (stuffing each line, and calling Parser.parse_data_end
+on each line as the server used to). Bodies of each --sizes MB are built
+from 76-byte lines, a --dot-fraction of which start with a dot.
+
+    python benchmarks/transparency.py --sizes 1,8,32 --dot-fraction 0.01
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Protocol import Parser  # noqa: E402
+from Transparency import find_end, stuff, unstuff  # noqa: E402
+
+
+def make_body(size, dot_fraction, rng):
+    lines = []
+    total = 0
+    while total < size:
+        line = ("." if rng.random() < dot_fraction else "x") + "y" * 74 + "\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines)
+
+
+def per_line_stuff(body):
+    return "".join("." + line if line.startswith(".") else line for line in body.splitlines(keepends=True))
+
+
+def per_line_unstuff(body):
+    return "".join(line[1:] if line.startswith(".") else line for line in body.splitlines(keepends=True))
+
+
+def per_line_end(parser, data):
+    for index, line in enumerate(data.splitlines(keepends=True)):
+        if parser.parse_data_end(line):
+            return index
+    return -1
+
+
+def best(func, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--sizes", default="1,8,32", help="body sizes in MB")
+    arg_parser.add_argument("--dot-fraction", type=float, default=0.01)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    parser = Parser()
+    results = []
+    for megabytes in (float(n) for n in args.sizes.split(",")):
+        body = make_body(int(megabytes * 1_000_000), args.dot_fraction, rng)
+        stuffed_lines_s, expected = best(per_line_stuff, body)
+        stuffed_s, stuffed = best(stuff, body)
+        assert stuffed == expected
+        unstuffed_lines_s, _ = best(per_line_unstuff, stuffed)
+        unstuffed_s, restored = best(unstuff, stuffed)
+        assert restored == body
+        data = stuffed + ".\n"
+        end_lines_s, _ = best(per_line_end, parser, data, repeat=1)
+        end_s, end = best(find_end, data)
+        assert end == len(stuffed)
+        results.append({
+            "mb": megabytes,
+            "stuff_mb_per_s": {"per_line": megabytes / stuffed_lines_s, "buffer": megabytes / stuffed_s},
+            "unstuff_mb_per_s": {"per_line": megabytes / unstuffed_lines_s, "buffer": megabytes / unstuffed_s},
+            "find_end_mb_per_s": {"per_line": megabytes / end_lines_s, "buffer": megabytes / end_s},
+        })
+
+    report = {
+        "benchmark": "transparency",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dot_fraction": args.dot_fraction,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Per-IP admission control, with explicit clock values.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Admission import Admission  # noqa: E402
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_session_limit(self):
+        admission = Admission(max_sessions=2)
+        self.assertEqual([admission.admit("a", 0.0) for _ in range(3)], [None, None, "sessions"])
+        admission.release("a")
+        self.assertIsNone(admission.admit("a", 0.0))
+
+    def test_rate_limit(self):
+        admission = Admission(rate=1.0, burst=2.0)
+        self.assertEqual([admission.admit("a", 0.0) for _ in range(3)], [None, None, "rate"])
+        self.assertIsNone(admission.admit("a", 1.0))
+
+    def test_addresses_with_open_sessions_are_not_evicted(self):
+        admission = Admission(max_sessions=1, tracked=2)
+        for ip in ("a", "b", "c"):
+            self.assertIsNone(admission.admit(ip, 0.0))
+        self.assertEqual(admission.admit("a", 0.0), "sessions")
+        for ip in ("a", "b", "c"):
+            admission.release(ip)
+        # Closed, they may go
+        admission.admit("d", 0.0)
+        self.assertEqual(len(admission.clients), 2)
+
+    def test_release_of_unknown_address(self):
+        admission = Admission(max_sessions=1, tracked=1)
+        admission.release("a")
+        self.assertIsNone(admission.admit("a", 0.0))
+        self.assertEqual(admission.admit("a", 0.0), "sessions")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Content-addressed body store: reference counts and garbage collection.
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+import BodyStore  # noqa: E402
+
+LINES = ["Subject: hi\n", "\n", "body\n"]
+
+
+class BodyStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="smtp-bodies-")
+        self.store = BodyStore.BodyStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_counts_and_collect(self):
+        digest = self.store.put(LINES)
+        self.assertEqual(self.store.put(LINES), digest)
+        self.assertEqual(self.store.refs(digest), 2)
+        self.store.release(digest, 2)
+        self.assertEqual(self.store.collect(), 1)
+        self.assertFalse(os.path.exists(self.store.path(digest)))
+
+    @unittest.skipIf(BodyStore.fcntl is None, "needs flock")
+    def test_refs_file_collected_before_the_lock(self):
+        digest = self.store.put(LINES)
+        self.store.release(digest)
+        path = self.store.path(digest)
+        flock = BodyStore.fcntl.flock
+
+        def collected_meanwhile(fd, operation):
+            # What collect() does if it gets the lock between our open and our flock
+            BodyStore.fcntl.flock = flock
+            os.remove(path)
+            os.remove(f"{path}.refs")
+            flock(fd, operation)
+
+        BodyStore.fcntl.flock = collected_meanwhile
+        try:
+            writer = self.store.writer()
+            writer.write("".join(LINES).encode())
+            writer.finish()
+        finally:
+            BodyStore.fcntl.flock = flock
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.store.refs(digest), 1)
+        self.assertEqual(self.store.collect(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
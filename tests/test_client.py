@@ -0,0 +1,38 @@
+"""Client against canned server replies over a socketpair.
+
+    python -m unittest discover tests
+"""
+import os
+import socket
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Client import Client  # noqa: E402
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sock, self.server = socket.socketpair()
+        self.client = Client("test.local", 25, check_arguments=False)
+        self.client.from_field = "<sender@test.local>\n"
+        self.client.to_field = ["<gone@d0.example>\n", "<user@d1.example>\n"]
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.close()
+
+    def test_partial_rejection_reads_the_reply_to_the_data(self):
+        self.server.sendall(b"250 OK\n550 No such user\n250 OK\n354 Go ahead\n250 Queued\n252 Cannot VRFY\n")
+        reply = self.client.send_transaction(self.sock, {"PIPELINING": None}, "body\n")
+        self.assertEqual(reply, "250 Queued")
+        self.assertEqual(self.client.rejected, {"gone@d0.example": "550 No such user"})
+        # The connection is still in step: the next command gets its own reply
+        self.assertEqual(self.client.simple_command(self.sock, {}, "VRFY user\n"), 252)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""EventLoop driven one turn at a time against a real client socket.
+
+    python -m unittest discover tests
+"""
+import errno
+import os
+import socket
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from EventLoop import EventLoop  # noqa: E402
+from Server import Server  # noqa: E402
+
+
+class ExhaustedListener():
+    """A listening socket whose first accept() calls fail as if out of file descriptors."""
+
+    def __init__(self, listener, failures):
+        self.listener = listener
+        self.failures = failures
+
+    def accept(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(errno.EMFILE, "Too many open files")
+        return self.listener.accept()
+
+    def fileno(self):
+        return self.listener.fileno()
+
+
+class EventLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(0, io="selectors")
+        # Kept instead of written under forward/
+        self.delivered = []
+        self.server.deliver = self.delivered.append
+        self.listener = self.server.open_listener()
+        self.listener.setblocking(False)
+        self.loop = EventLoop(self.server, self.listener)
+        self.loop.poller.register(self.listener.fileno())
+        self.waker, self.wakeup = socket.socketpair()
+
+    def tearDown(self):
+        for conn in list(self.loop.connections.values()):
+            self.loop.close(conn)
+        self.listener.close()
+        self.waker.close()
+        self.wakeup.close()
+
+    def serve(self, data):
+        """Sends data, half-closes, and runs the loop until it has closed the connection."""
+        client = socket.create_connection(self.listener.getsockname())
+        client.sendall(data)
+        client.shutdown(socket.SHUT_WR)
+        for _ in range(10):
+            self.loop.turn(self.listener.fileno(), self.waker)
+            if not self.loop.connections:
+                break
+        client.settimeout(5)
+        received = b""
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            received += chunk
+        client.close()
+        return [int(line[:3]) for line in received.decode().splitlines()]
+
+    def test_pipelined_commands_answered_before_eof_close(self):
+        codes = self.serve(b"EHLO client\nMAIL FROM:<a@b.example>\nRCPT TO:<u@d.example>\nNOOP\n")
+        self.assertEqual(codes, [220] + [250] * 5 + [250, 250, 250])
+        self.assertEqual(self.loop.connections, {})
+
+    def test_message_before_eof_is_stored(self):
+        codes = self.serve(b"EHLO client\nMAIL FROM:<a@b.example>\nRCPT TO:<u@d.example>\nDATA\nhi\n.\n")
+        self.assertEqual(codes[-3:], [250, 354, 250])
+        message, = self.delivered
+        self.assertEqual(message.text, ["hi\n"])
+
+    def test_failed_delivery_gets_451_and_session_goes_on(self):
+        def deliver(message):
+            raise FileNotFoundError("forward/ is gone")
+        self.server.deliver = deliver
+        transaction = b"MAIL FROM:<a@b.example>\nRCPT TO:<u@d.example>\nDATA\nhi\n.\n"
+        codes = self.serve(b"EHLO client\n" + transaction + b"NOOP\n")
+        self.assertEqual(codes[-4:], [250, 354, 451, 250])
+        self.assertEqual(self.loop.connections, {})
+
+    def test_accept_is_retried_after_an_error(self):
+        self.loop.listener = ExhaustedListener(self.listener, failures=1)
+        client = socket.create_connection(self.listener.getsockname())
+        self.loop.turn(self.listener.fileno(), self.waker)
+        self.assertEqual(self.loop.connections, {})
+        # No new connection arrives, so no new edge: only the retry can pick it up
+        self.assertGreater(self.loop.poll_timeout(), 0)
+        for _ in range(10):
+            self.loop.turn(self.listener.fileno(), self.waker)
+            if self.loop.connections:
+                break
+        self.assertEqual(len(self.loop.connections), 1)
+        client.settimeout(5)
+        self.assertEqual(client.recv(100)[:3], b"220")
+        client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Regression tests for the SIGUSR1 session profiler with overlapping sessions.
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Profiler import SessionProfiler  # noqa: E402
+
+
+class SessionProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp(prefix="smtp-profile-")
+        self.profiler = SessionProfiler(self.out_dir, sessions=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def written(self):
+        return [name for name in os.listdir(self.out_dir) if name.endswith(".prof")]
+
+    def test_overlapping_sessions(self):
+        self.profiler.arm()
+        for key in ("a", "b", "c"):
+            self.profiler.session_started(key)
+        # Only two sessions were asked for; the third is not counted
+        self.assertEqual(self.profiler.profiled, {"a", "b"})
+        self.profiler.session_finished("a")
+        self.assertIsNotNone(self.profiler.profile)
+        self.profiler.session_finished("c")
+        self.assertEqual(self.written(), [])
+        self.profiler.session_finished("b")
+        self.assertEqual(len(self.written()), 1)
+        self.assertIsNone(self.profiler.profile)
+        self.assertEqual(self.profiler.remaining, 0)
+
+    def test_unarmed_does_nothing(self):
+        self.profiler.session_started("a")
+        self.profiler.session_finished("a")
+        self.assertIsNone(self.profiler.profile)
+        self.assertEqual(self.written(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
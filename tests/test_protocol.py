@@ -0,0 +1,262 @@
+"""Regression tests for the sans-I/O protocol core: bytes in, replies and events out.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Protocol import (NEED_DATA, ClientProtocol, Closed, DataFinished, DataStarted, Greeted,  # noqa: E402
+                      ReplyTable, ServerProtocol)
+
+REPLIES = ReplyTable("test.local", max_size=1000)
+ENVELOPE = "MAIL FROM:<sender@test.local>\nRCPT TO:<user@d0.example>\n"
+
+
+def feed(protocol, data):
+    """Passes data to protocol and returns (events, replies) up to the next NEED_DATA."""
+    protocol.receive_data(data)
+    events = []
+    while True:
+        event = protocol.next_event()
+        if event is NEED_DATA:
+            break
+        events.append(event)
+        if isinstance(event, Closed):
+            break
+    return events, b"".join(protocol.take_replies())
+
+
+def codes(replies):
+    """Reply codes of every line, continuation lines included."""
+    return [int(line[:3]) for line in replies.decode().splitlines()]
+
+
+def messages(events):
+    return [event.message for event in events if isinstance(event, DataFinished)]
+
+
+class ServerProtocolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = ServerProtocol(REPLIES, max_size=1000)
+
+    def test_pipelined_ehlo_transaction(self):
+        events, replies = feed(self.protocol, (f"EHLO client\n{ENVELOPE}DATA\nSubject: hi\n\nbody\n.\n").encode())
+        self.assertEqual(codes(replies), [250] * 5 + [250, 250, 354, 250])
+        self.assertIsInstance(events[0], Greeted)
+        self.assertTrue(events[0].esmtp)
+        message, = messages(events)
+        self.assertEqual(message.sender, "sender@test.local")
+        self.assertEqual(message.recipients, ["user@d0.example"])
+        self.assertEqual(message.text, ["Subject: hi\n", "\n", "body\n"])
+
+    def test_crlf_greeting(self):
+        _, replies = feed(self.protocol, b"EHLO client\r\n")
+        self.assertTrue(replies.startswith(b"250-test.local Hello client\n"))
+        protocol = ServerProtocol(REPLIES, max_size=1000)
+        _, replies = feed(protocol, b"HELO client\r\n")
+        self.assertEqual(replies, b"250 Hello client pleased to meet you\n")
+
+    def test_helo_transaction_gets_one_reply(self):
+        feed(self.protocol, b"HELO client\n")
+        events, replies = feed(self.protocol, f"{ENVELOPE}DATA\nbody\n.\n".encode())
+        self.assertEqual(codes(replies), [250])
+        self.assertEqual(len(messages(events)), 1)
+
+    def test_data_one_byte_at_a_time(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}DATA\n".encode())
+        found = []
+        for byte in b"..stuffed\nline\n.\n":
+            events, _ = feed(self.protocol, bytes([byte]))
+            found += messages(events)
+        message, = found
+        self.assertEqual(message.text, [".stuffed\n", "line\n"])
+
+    def test_helo_rset_mid_transaction(self):
+        feed(self.protocol, b"HELO client\n")
+        _, replies = feed(self.protocol, b"MAIL FROM:<sender@test.local>\nRSET\nNOOP\n")
+        self.assertEqual(codes(replies), [250, 250])
+        self.assertIsNone(self.protocol.session.sender)
+        events, replies = feed(self.protocol, f"{ENVELOPE}DATA\nbody\n.\n".encode())
+        self.assertEqual(codes(replies), [250])
+        self.assertEqual(len(messages(events)), 1)
+
+    def test_bdat_chunks(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}".encode())
+        events, replies = feed(self.protocol, b"BDAT 6\nfirst\nBDAT 7 LAST\nsecond\n")
+        self.assertEqual(codes(replies), [250, 250])
+        self.assertIsInstance(events[0], DataStarted)
+        message, = messages(events)
+        self.assertEqual(message.text, ["first\n", "second\n"])
+
+    def test_bdat_chunk_read_in_place(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}BDAT 5 LAST\n".encode())
+        view = self.protocol.pending_chunk()
+        self.assertEqual(len(view), 5)
+        view[:] = b"body\n"
+        self.protocol.chunk_received(5)
+        events, replies = feed(self.protocol, b"")
+        self.assertEqual(codes(replies), [250])
+        self.assertEqual(messages(events)[0].text, ["body\n"])
+
+    def test_bdat_size_is_checked_before_allocating(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}".encode())
+        events, replies = feed(self.protocol, b"BDAT 99999999999 LAST\n")
+        self.assertEqual(codes(replies), [552])
+        self.assertEqual(events, [])
+        self.assertIsNone(self.protocol.chunk)
+        self.assertLessEqual(len(self.protocol.pending_chunk()), 65536)
+
+    def test_refused_bdat_chunk_is_skipped(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}".encode())
+        events, replies = feed(self.protocol, b"BDAT 2000 LAST\n" + b"x" * 1500)
+        self.assertEqual(codes(replies), [552])
+        view = self.protocol.pending_chunk()
+        view[:100] = b"y" * 100
+        self.protocol.chunk_received(100)
+        events, replies = feed(self.protocol, b"x" * 400 + b"NOOP\n")
+        self.assertEqual(codes(replies), [250])
+        self.assertEqual(messages(events), [])
+
+    def test_bdat_total_over_limit(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}".encode())
+        events, replies = feed(self.protocol, b"BDAT 600\n" + b"x" * 600 + b"BDAT 600 LAST\n" + b"x" * 600)
+        self.assertEqual(codes(replies), [250, 552])
+        self.assertEqual(messages(events), [None])
+        _, replies = feed(self.protocol, b"BDAT 1 LAST\nx")
+        self.assertEqual(codes(replies), [503])
+
+    def test_declared_size_over_limit(self):
+        _, replies = feed(self.protocol, b"EHLO client\nMAIL FROM:<a@b.c> SIZE=5000\n")
+        self.assertEqual(codes(replies)[-1], 552)
+
+    def test_data_over_limit_is_read_and_refused(self):
+        body = "x" * 63 + "\n"
+        events, replies = feed(self.protocol, f"EHLO client\n{ENVELOPE}DATA\n{body * 20}.\nNOOP\n".encode())
+        self.assertEqual(codes(replies)[-2:], [552, 250])
+        self.assertEqual(messages(events), [None])
+
+    def test_long_command_line_is_refused_as_it_arrives(self):
+        feed(self.protocol, b"EHLO client\n")
+        _, replies = feed(self.protocol, b"x" * 600)
+        self.assertEqual(codes(replies), [500])
+        self.assertEqual(len(self.protocol.session.buffer), 0)
+        _, replies = feed(self.protocol, b"x" * 100000)
+        self.assertEqual(replies, b"")
+        self.assertEqual(len(self.protocol.session.buffer), 0)
+        _, replies = feed(self.protocol, b"xx\nNOOP\n")
+        self.assertEqual(codes(replies), [250])
+
+    def test_long_command_line_in_one_read(self):
+        _, replies = feed(self.protocol, b"EHLO client\nNOOP " + b"x" * 600 + b"\nNOOP\n")
+        self.assertEqual(codes(replies)[-2:], [500, 250])
+
+    def test_data_line_without_newline_is_not_held(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}DATA\n".encode())
+        for _ in range(8):
+            feed(self.protocol, b"y" * 100)
+            self.assertLessEqual(len(self.protocol.session.buffer) - self.protocol.session.pos, 2)
+        events, replies = feed(self.protocol, b"\n..dot\n.\n")
+        self.assertEqual(codes(replies), [250])
+        self.assertEqual(messages(events)[0].text, ["y" * 800 + "\n", ".dot\n"])
+
+    def test_data_line_over_limit_is_dropped(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}DATA\n".encode())
+        for _ in range(5):
+            feed(self.protocol, b"y" * 500)
+        self.assertEqual(self.protocol.data_pieces, [])
+        events, replies = feed(self.protocol, b"\n.\nNOOP\n")
+        self.assertEqual(codes(replies), [552, 250])
+        self.assertEqual(messages(events), [None])
+
+    def test_end_line_split_across_reads(self):
+        feed(self.protocol, f"EHLO client\n{ENVELOPE}DATA\nbody\n".encode())
+        events, _ = feed(self.protocol, b".")
+        self.assertEqual(messages(events), [])
+        events, replies = feed(self.protocol, b"\r\n")
+        self.assertEqual(codes(replies), [250])
+        self.assertEqual(messages(events)[0].text, ["body\n"])
+
+    def test_out_of_sequence(self):
+        _, replies = feed(self.protocol, b"EHLO client\nRCPT TO:<user@d0.example>\n")
+        self.assertEqual(codes(replies)[-1], 503)
+
+    def test_eof_after_pipelined_commands(self):
+        events, replies = feed(self.protocol, f"EHLO client\n{ENVELOPE}NOOP\n".encode())
+        self.assertEqual(codes(replies), [250] * 5 + [250, 250, 250])
+        events, replies = feed(self.protocol, b"")
+        self.assertEqual(replies, b"")
+        self.assertIsInstance(events[-1], Closed)
+
+    def test_eof_in_message_data_stores_nothing(self):
+        events, _ = feed(self.protocol, f"EHLO client\n{ENVELOPE}DATA\npartial\n".encode())
+        events, _ = feed(self.protocol, b"")
+        self.assertEqual(messages(events), [])
+        self.assertIsInstance(events[-1], Closed)
+
+    def test_quit(self):
+        events, replies = feed(self.protocol, b"EHLO client\nQUIT\nNOOP\n")
+        self.assertEqual(codes(replies)[-1], 221)
+        self.assertIsInstance(events[-1], Closed)
+
+
+class ClientProtocolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = ClientProtocol(chunk_size=4)
+
+    def test_multiline_replies(self):
+        self.protocol.receive_data("250-host Hello\n250-PIPELINING\n250 CHUNKING\n25")
+        reply = self.protocol.next_reply()
+        self.assertEqual(self.protocol.extensions(reply), {"PIPELINING": None, "CHUNKING": None})
+        self.assertIsNone(self.protocol.next_reply())
+        self.protocol.receive_data("0 OK\n")
+        self.assertEqual(self.protocol.next_reply(), "250 OK")
+
+    def test_pipelined_data_transaction(self):
+        commands = self.protocol.transaction(ENVELOPE, "body\n", {"PIPELINING": None, "SIZE": "1000"})
+        self.assertEqual(commands, ["MAIL FROM:<sender@test.local> SIZE=5\n", "RCPT TO:<user@d0.example>\n",
+                                    "DATA\n"])
+        reply, data, rejected = self.protocol.outcome(["250 OK", "250 OK", "354 Go ahead"])
+        self.assertIsNone(reply)
+        self.assertEqual(data, b"body\n.\n")
+        self.assertEqual(rejected, {})
+
+    def test_bdat_transaction(self):
+        commands = self.protocol.transaction(ENVELOPE, "body\n", {"CHUNKING": None})
+        self.assertEqual(commands[2:], [b"BDAT 4\nbody", b"BDAT 1 LAST\n\n"])
+        self.assertEqual(self.protocol.outcome(["250 OK"] * 4), ("250 OK", None, {}))
+
+    def test_refused_sender(self):
+        self.protocol.transaction(ENVELOPE, "body\n", {"PIPELINING": None})
+        reply, data, _ = self.protocol.outcome(["550 No", "503 Bad sequence", "503 Bad sequence"])
+        self.assertEqual((reply, data), ("550 No", None))
+
+    def test_some_recipients_refused_data_still_sent(self):
+        envelope = ENVELOPE + "RCPT TO:<other@d1.example>\n"
+        self.protocol.transaction(envelope, "body\n", {"PIPELINING": None})
+        reply, data, rejected = self.protocol.outcome(["250 OK", "550 No such user", "250 OK", "354 Go ahead"])
+        # The reply to the data decides, so it must still be read
+        self.assertIsNone(reply)
+        self.assertEqual(data, b"body\n.\n")
+        self.assertEqual(rejected, {0: "550 No such user"})
+
+    def test_some_recipients_refused_bdat(self):
+        envelope = ENVELOPE + "RCPT TO:<other@d1.example>\n"
+        self.protocol.transaction(envelope, "body\n", {"CHUNKING": None})
+        replies = ["250 OK", "250 OK", "451 Try later", "250 OK", "250 OK"]
+        self.assertEqual(self.protocol.outcome(replies), ("250 OK", None, {1: "451 Try later"}))
+
+    def test_every_recipient_refused(self):
+        self.protocol.transaction(ENVELOPE, "body\n", {"PIPELINING": None})
+        reply, data, rejected = self.protocol.outcome(["250 OK", "550 No such user", "503 Bad sequence"])
+        self.assertEqual((reply, data), ("550 No such user", None))
+        self.assertEqual(rejected, {0: "550 No such user"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""RelayQueue bookkeeping after a delivery, with a stub sender instead of a socket.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Relay import RelayQueue  # noqa: E402
+
+TARGET = ("relay.test", 25)
+
+
+class StubSender():
+    def __init__(self, rejected):
+        self.rejected = rejected
+        self.sent = []
+
+    def send(self, sender, recipients, lines):
+        self.sent.append(list(recipients))
+        return {rcpt: reply for rcpt, reply in self.rejected.items() if rcpt in recipients}
+
+    def close(self):
+        pass
+
+
+class RelayQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="relay-test-")
+        self.queue = RelayQueue(self.root, lambda domain: TARGET)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def entries(self, directory):
+        found = []
+        for name in sorted(os.listdir(os.path.join(self.root, directory))):
+            with open(os.path.join(self.root, directory, name)) as f:
+                found.append(json.load(f))
+        return found
+
+    def test_delivered(self):
+        path = self.queue.enqueue("s@a.example", "d.example", ["a@d.example"], ["body\n"])
+        self.queue.attempt(path, {TARGET: StubSender({})})
+        self.assertEqual(os.listdir(os.path.join(self.root, "d.example")), [])
+
+    def test_only_refused_recipients_are_retried(self):
+        recipients = ["ok@d.example", "later@d.example", "gone@d.example"]
+        path = self.queue.enqueue("s@a.example", "d.example", recipients, ["body\n"])
+        sender = StubSender({"later@d.example": "451 Try later", "gone@d.example": "550 No such user"})
+        self.queue.attempt(path, {TARGET: sender})
+
+        queued, = self.entries("d.example")
+        self.assertEqual(queued["recipients"], ["later@d.example"])
+        self.assertEqual(queued["attempts"], 1)
+        failed, = self.entries("failed")
+        self.assertEqual(failed["recipients"], ["gone@d.example"])
+
+        # The retry goes to the deferred recipient alone
+        sender.rejected = {}
+        self.queue.attempt(path, {TARGET: sender})
+        self.assertEqual(sender.sent[-1], ["later@d.example"])
+        self.assertEqual(self.entries("d.example"), [])
+
+    def test_corrupt_entry_is_set_aside(self):
+        path = self.queue.enqueue("s@a.example", "d.example", ["a@d.example"], ["body\n"])
+        with open(path, "w") as f:
+            f.write('{"sender": "s@a.exa')
+        self.queue.attempt(path, {TARGET: StubSender({})})
+        self.assertEqual(os.listdir(os.path.join(self.root, "d.example")), [])
+        self.assertEqual(os.listdir(os.path.join(self.root, "failed")), [os.path.basename(path)])
+
+
+if __name__ == "__main__":
+    unittest.main()
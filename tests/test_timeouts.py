@@ -0,0 +1,52 @@
+"""TimerHeap and Timeouts bookkeeping, with explicit clock values.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from Timeouts import COMPACT_SLACK, TimerHeap, Timeouts  # noqa: E402
+
+
+class TimerHeapTest(unittest.TestCase):
+
+    def test_expiry_order_and_reschedule(self):
+        timers = TimerHeap()
+        timers.schedule("a", 5.0)
+        timers.schedule("b", 3.0)
+        timers.schedule("a", 1.0)
+        timers.cancel("b")
+        self.assertEqual(timers.next_deadline(), 1.0)
+        self.assertEqual(timers.pop_expired(now=4.0), ["a"])
+        self.assertEqual(len(timers), 0)
+        self.assertIsNone(timers.next_deadline())
+
+    def test_heap_stays_bounded_without_pops(self):
+        # The blocking server schedules and cancels, but never looks at the top
+        timeouts = Timeouts()
+        for conn in range(2000):
+            timeouts.start_session(conn, now=0.0)
+            for _ in range(5):
+                timeouts.start_read(conn, "command", now=0.0)
+                timeouts.end_read(conn)
+            timeouts.end_session(conn)
+        self.assertEqual(len(timeouts.timers), 0)
+        self.assertLessEqual(len(timeouts.timers.heap), COMPACT_SLACK)
+
+    def test_compaction_keeps_live_deadlines(self):
+        timers = TimerHeap()
+        for key in range(100):
+            timers.schedule(key, float(key))
+        for _ in range(10):
+            for key in range(100):
+                timers.schedule(key, float(key))
+        self.assertLessEqual(len(timers.heap), 2 * len(timers) + COMPACT_SLACK)
+        self.assertEqual(timers.pop_expired(now=9.5), list(range(10)))
+
+
+if __name__ == "__main__":
+    unittest.main()